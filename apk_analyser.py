@@ -1,25 +1,49 @@
 #!/usr/bin/env python3
 
+import argparse
 import json
 import os
-import sys
+import traceback
 from glob import glob
+from multiprocessing import Pool, util
 
-from cp55.apk_handler import ApkHandler
+from cp55.apk_handler import ApkHandler, default_output, dex_backend, smali_backend
+from cp55.budget import BudgetExceeded, BudgetLimits, decode_stage, parse_limits
 from cp55.component_inspector import ComponentInspector
-from database_interface import DatabaseInterface
+from cp55.downloader import DownloaderClient
+from cp55.invocation_artifact import get_artifact_path, load_artifact
+from cp55.journal import Journal, select_packages
+from cp55.pipeline import Stage, run_pipeline
+from cp55.result_cache import ResultCache
+from cp55.scratch import ScratchSpace, default_min_free
+from cp55.summary_cache import SummaryCache
+from database_interface import DatabaseInterface, create_sink
+from result_writer import BundleCollector, ResultWriter, default_batch_delay, default_batch_size
 
 manifest_file_name = "/AndroidManifest.xml"
 output_directory = "output/"
 apk_file_extension = ".apk"
+worker_output_prefix = "apk.out."
 
+# Statuses of the apps whose analysis ran out of budget, whose results are never cached
+incomplete_statuses = {"timeout", "partial"}
+
+worker_state = dict()
+
+
+def download_apk(package_name, downloader=None):
+    """
+    Downloads an app from the PlayStore to the output directory, through the given DownloaderClient if any, or by
+    running the downloader container for the app otherwise.
+    """
+    if downloader is not None:
+        downloader.download_apk(package_name)
+        return
 
-def download_apk(package_name):
     docker_command = "docker run \
     -u $(id -u):$(id -g) \
     -v \"${PWD}/credentials.json\":\"/app/credentials.json\" \
     -v \"${PWD}/\"" + output_directory + ":\"/app/Downloads/\" \
-    -p 5000:5000 \
     --entrypoint=python3 \
     --rm downloader download.py -c /app/credentials.json \"" + package_name + "\""
 
@@ -31,75 +55,503 @@ def download_apk(package_name):
     os.rename(downloaded_apk_file, apk_file)
 
 
-def process_apk(apk_path, input_package, inspection_filter, db):
-    apk_handler = ApkHandler(apk_path)
+def analyse_apk(apk_handler, inspection_filter, budget_limits=None, artifact_path=None, summary_cache=None,
+                incremental=False):
+    """
+    Inspects the components of an already decoded apk.
 
-    try:
-        apk_handler.decode_apk()
+    When the inspection of the components or the sql checks run out of budget, the analysis stops with the "partial"
+    status and keeps the results completed so far.
 
-        component_inspector = ComponentInspector(apk_handler, inspection_filter)
-        background_results, analysis_status = component_inspector.inspect_background_components()
+    :param artifact_path: the file the reachable invocations of the components are saved to, for rematch.py, not
+                          saved if None
+    :param summary_cache: the SummaryCache of the class summaries shared across apps, if any
+    :param incremental: whether the components whose classes did not change since the artifact was saved are carried
+                        forward from it rather than inspected again
 
-        app_id = db.insert_app(input_package, analysis_status)
-        db.insert_components(app_id, background_results)
+    :return: a tuple of the analysis status, the component results and the sql results, the latter being None when
+    the providers did not need to be checked for sql injections
+    :raises: BudgetExceeded If reading the manifest exceeds its budget.
+    """
+    previous_artifact = None
+    if incremental and artifact_path is not None and os.path.exists(artifact_path):
+        try:
+            previous_artifact = load_artifact(artifact_path)
+        except (OSError, ValueError) as e:
+            print("Failed to read the previous artifact due to {}, inspecting all the components.".format(e))
 
-        if analysis_status == "full":
-            os.remove(apk_path)
-            print("Finished analyzing app " + input_package + " with status " + analysis_status +
-                  ". Summary: " + str(len(background_results)) + " component(s).")
+    component_inspector = ComponentInspector(apk_handler, inspection_filter, budget_limits, summary_cache,
+                                             previous_artifact)
 
-        elif analysis_status == "background":
+    try:
+        background_results, analysis_status = component_inspector.inspect_background_components()
+    except BudgetExceeded as exception:
+        print(str(exception) + ", keeping " + str(len(exception.results)) + " component(s).")
+        if artifact_path is not None:
+            component_inspector.save_invocations(artifact_path)
+        return "partial", exception.results, None
+
+    if artifact_path is not None:
+        component_inspector.save_invocations(artifact_path)
+    if component_inspector.carried_forward > 0:
+        print("Carried forward " + str(component_inspector.carried_forward) + " unchanged component(s).")
+
+    sql_results = None
+    if analysis_status == "background":
+        try:
             sql_results = component_inspector.inspect_providers_for_sql_injection()
+        except BudgetExceeded as exception:
+            print(str(exception) + ", keeping " + str(len(exception.results)) + " sql check(s).")
+            return "partial", background_results, exception.results
 
-            db.insert_sql_checks(app_id, sql_results)
-            db.update_app_analysis_status(app_id, "full")
+    return analysis_status, background_results, sql_results
 
-            print("Finished analyzing app " + input_package + " with status " + analysis_status +
-                  ". Summary: " + str(len(background_results)) + " component(s). Also analyzed " +
-                  str(len(sql_results)) + " methods for sql vulnerabilities.")
 
-        apk_handler.cleanup()
+def decode_and_analyse_apk(apk_handler, inspection_filter, budget_limits=None, artifact_path=None,
+                           summary_cache=None, incremental=False):
+    """
+    Decodes and analyses an apk, see analyse_apk. The status is "timeout" when decoding the apk or reading its
+    manifest runs out of budget.
+    """
+    budget_limits = budget_limits if budget_limits is not None else BudgetLimits()
+
+    try:
+        apk_handler.decode_apk(budget_limits.start(decode_stage))
+        return analyse_apk(apk_handler, inspection_filter, budget_limits, artifact_path, summary_cache, incremental)
+    except BudgetExceeded as exception:
+        print(str(exception) + ".")
+        return "timeout", [], None
+
+
+def print_class_cache_statistics(apk_handler):
+    statistics = apk_handler.get_class_cache_statistics()
+    if statistics["hits"] + statistics["misses"] > 0:
+        print("Class cache: " + str(statistics["hits"]) + " hit(s), " + str(statistics["misses"]) + " miss(es), " +
+              str(statistics["evictions"]) + " eviction(s).")
+
+
+def store_results(db, input_package, analysis_status, background_results, sql_results):
+    """
+    Stores the results of an app in a single transaction.
+
+    :param db: the DatabaseInterface, or the ResultWriter queueing the results for it
+    :return: a tuple of the final analysis status of the app and the apps committed to the database by this call, see
+    DatabaseInterface.store_app_results
+    """
+    final_status = analysis_status
+    if sql_results is not None and analysis_status not in incomplete_statuses:
+        final_status = "full"
+
+    committed = db.store_app_results(input_package, analysis_status, background_results, sql_results, final_status)
+
+    if sql_results is None:
+        print("Finished analyzing app " + input_package + " with status " + analysis_status +
+              ". Summary: " + str(len(background_results)) + " component(s).")
+    else:
+        print("Finished analyzing app " + input_package + " with status " + analysis_status +
+              ". Summary: " + str(len(background_results)) + " component(s). Also analyzed " +
+              str(len(sql_results)) + " methods for sql vulnerabilities.")
+
+    return final_status, committed
+
+
+def analyse_apk_with_cache(apk_handler, apk_path, inspection_filter, result_cache, budget_limits=None,
+                           artifact_path=None, summary_cache=None, incremental=False):
+    """
+    Returns the analysis results of the apk from the cache or, on a cache miss, decodes and analyses the apk and
+    caches its results. The results of an analysis that ran out of budget are not cached. An apk is only served from
+    the cache when its artifact exists, so that an apk cached before the artifacts were saved, or cached under another
+    package name, gets one.
+    """
+    if result_cache is None:
+        return decode_and_analyse_apk(apk_handler, inspection_filter, budget_limits, artifact_path, summary_cache,
+                                      incremental)
+
+    cache_key = result_cache.get_key(apk_path)
+    results = result_cache.get(cache_key)
+    if results is not None and (artifact_path is None or os.path.exists(artifact_path)):
+        return tuple(results)
+
+    results = decode_and_analyse_apk(apk_handler, inspection_filter, budget_limits, artifact_path, summary_cache,
+                                     incremental)
+    if results[0] not in incomplete_statuses:
+        result_cache.put(cache_key, results)
+
+    return results
+
+
+def process_apk(apk_path, input_package, inspection_filter, db, output=None, result_cache=None,
+                backend=smali_backend, budget_limits=None, artifact_directory=None, summary_cache=None,
+                incremental=False, scratch=None):
+    """
+    :param output: the name of the directory apktool decodes into, defaults to the one chosen by ApkHandler
+    :param artifact_directory: the directory the reachable invocations of the apps are saved to, not saved if None
+    :param summary_cache: the SummaryCache of the class summaries shared across apps, if any
+    :param incremental: whether the unchanged components are carried forward from the artifact of the app
+    :param scratch: the ScratchSpace the apk is decoded in, the current directory if None
+    :return: the final analysis status of the app
+    """
+    if scratch is not None:
+        output = scratch.get_workspace(output if output is not None else default_output)
+    apk_handler = ApkHandler(apk_path, output, no_resources=True, backend=backend, scratch=scratch)
+    artifact_path = None
+    if artifact_directory is not None:
+        artifact_path = get_artifact_path(artifact_directory, input_package)
+
+    try:
+        results = analyse_apk_with_cache(apk_handler, apk_path, inspection_filter, result_cache, budget_limits,
+                                         artifact_path, summary_cache, incremental)
+        print_class_cache_statistics(apk_handler)
+        analysis_status, _ = store_results(db, input_package, *results)
+
+        if results[0] == "full":
+            os.remove(apk_path)
+
+        if apk_handler.was_decoded():
+            apk_handler.cleanup()
+
+        return analysis_status
 
     except Exception:
-        apk_handler.cleanup()
+        if apk_handler.was_decoded():
+            apk_handler.cleanup()
         db.insert_app(input_package, "failed")
         print("Failed to inspect app " + input_package + " or to store the results in the database.")
         raise Exception
 
 
+def analyse_package(input_package, inspection_filter, db, output=None, result_cache=None, backend=smali_backend,
+                    budget_limits=None, artifact_directory=None, summary_cache=None, incremental=False, scratch=None,
+                    downloader=None):
+    """
+    Downloads the app with the given package name from the PlayStore and analyses it.
+
+    :param output: the name of the directory apktool decodes into, see process_apk
+    :param downloader: the DownloaderClient of the downloader server, a container is run for the app if None
+    :return: the final analysis status of the app
+    """
+    try:
+        download_apk(input_package, downloader)
+    except Exception as e:
+        db.insert_app(input_package, "download_failed")
+        print("Failed to download app " + input_package + " due to {}".format(e))
+        return "download_failed"
+
+    apk_path = output_directory + input_package + apk_file_extension
+
+    try:
+        analysis_status = process_apk(apk_path, input_package, inspection_filter, db, output, result_cache, backend,
+                                      budget_limits, artifact_directory, summary_cache, incremental, scratch)
+    except Exception:
+        os.remove(apk_path)
+        return "failed"
+
+    return analysis_status
+
+
+def init_worker(inspection_filter, result_cache, backend, budget_limits, artifact_directory, summary_cache_path,
+                incremental, scratch_root, scratch_reserve, downloader_address):
+    """
+    Sets up the state of a batch mode worker process. Every worker gets its own decode directory, so that concurrent
+    workers never share apktool's output. The results of the worker are collected rather than stored, and handed to
+    the result writer of the main process. The worker opens its own connection to the summary cache, which writes
+    the pending summaries when the worker retires, and its own scratch space, whose reaper finishes deleting the
+    released workspaces when the worker retires.
+    """
+    worker_state["db"] = DatabaseInterface(BundleCollector())
+    worker_state["summary_cache"] = None
+    if summary_cache_path is not None:
+        worker_state["summary_cache"] = SummaryCache(summary_cache_path)
+        util.Finalize(worker_state["summary_cache"], worker_state["summary_cache"].close, exitpriority=10)
+    worker_state["scratch"] = ScratchSpace(scratch_root, min_free=scratch_reserve)
+    util.Finalize(worker_state["scratch"], worker_state["scratch"].close, exitpriority=10)
+    worker_state["downloader"] = None
+    if downloader_address is not None:
+        worker_state["downloader"] = DownloaderClient(downloader_address, output_directory)
+    worker_state["inspection_filter"] = inspection_filter
+    worker_state["result_cache"] = result_cache
+    worker_state["backend"] = backend
+    worker_state["budget_limits"] = budget_limits
+    worker_state["artifact_directory"] = artifact_directory
+    worker_state["incremental"] = incremental
+    worker_state["output"] = worker_output_prefix + str(os.getpid())
+
+
+def analyse_package_in_worker(input_package):
+    status = analyse_package(input_package, worker_state["inspection_filter"], worker_state["db"],
+                             worker_state["output"], worker_state["result_cache"], worker_state["backend"],
+                             worker_state["budget_limits"], worker_state["artifact_directory"],
+                             worker_state["summary_cache"], worker_state["incremental"], worker_state["scratch"],
+                             worker_state["downloader"])
+    return input_package, status, worker_state["db"].sink.take()
+
+
+def analyse_packages(packages, inspection_filter, result_cache, backend, budget_limits, artifact_directory,
+                     summary_cache_path, incremental, scratch_root, scratch_reserve, downloader_address, writer,
+                     workers, apks_per_worker):
+    """
+    Analyses the given packages in a pool of worker processes, whose results are stored by the given result writer.
+
+    :param workers: the number of worker processes
+    :param apks_per_worker: the number of apps a worker analyses before it is replaced by a fresh process
+    """
+    with Pool(processes=workers, initializer=init_worker,
+              initargs=(inspection_filter, result_cache, backend, budget_limits, artifact_directory,
+                        summary_cache_path, incremental, scratch_root, scratch_reserve, downloader_address),
+              maxtasksperchild=apks_per_worker) as pool:
+        for _, _, bundles in pool.imap_unordered(analyse_package_in_worker, packages):
+            for bundle in bundles:
+                writer.store_app_results(*bundle)
+        # The workers retire rather than being terminated, so that their finalizers run
+        pool.close()
+        pool.join()
+
+
+def analyse_decoded_apk_in_worker(apk_path, output, artifact_path):
+    apk_handler = ApkHandler(apk_path, output, no_resources=True, backend=worker_state["backend"],
+                             scratch=worker_state["scratch"])
+    try:
+        return analyse_apk(apk_handler, worker_state["inspection_filter"], worker_state["budget_limits"],
+                           artifact_path, worker_state["summary_cache"], worker_state["incremental"])
+    except BudgetExceeded as exception:
+        print(str(exception) + ".")
+        return "timeout", [], None
+    finally:
+        print_class_cache_statistics(apk_handler)
+        apk_handler.cleanup()
+
+
+def run_staged_pipeline(packages, inspection_filter, result_cache, budget_limits, writer, scratch, downloader,
+                        arguments):
+    """
+    Analyses the given packages in a pipeline of download, decode, analysis and storage stages, so that the downloads,
+    the apktool runs and the smali analysis of different apps overlap. Each stage has its own number of workers and
+    takes its apps from a bounded queue, which caps the number of downloaded apks waiting on disk.
+
+    The storage stage hands the results to the given result writer and removes the files of the app. The apps are
+    decoded in workspaces of the given scratch space, and downloaded with the given DownloaderClient if any.
+    """
+
+    def download(input_package):
+        item = {"package": input_package, "apk_path": output_directory + input_package + apk_file_extension,
+                "apk_handler": None, "output": None, "artifact_path": None, "cache_key": None, "status": None,
+                "results": None}
+        try:
+            download_apk(input_package, downloader)
+        except Exception as e:
+            print("Failed to download app " + input_package + " due to {}".format(e))
+            item["status"] = "download_failed"
+        return item
+
+    def decode(item):
+        if arguments.artifacts is not None:
+            item["artifact_path"] = get_artifact_path(arguments.artifacts, item["package"])
+
+        # A failing app is passed on as "failed", so that the store stage records it and removes its files
+        try:
+            if item["status"] is None and result_cache is not None:
+                item["cache_key"] = result_cache.get_key(item["apk_path"])
+                results = result_cache.get(item["cache_key"])
+                # An apk is only served from the cache when its artifact exists, see analyse_apk_with_cache
+                if results is not None and (item["artifact_path"] is None or os.path.exists(item["artifact_path"])):
+                    item["results"] = tuple(results)
+                    item["status"] = item["results"][0]
+
+            if item["status"] is None:
+                item["output"] = scratch.get_workspace(worker_output_prefix + item["package"])
+                # The dex backend has nothing to decode, its worker reads the classes straight from the apk
+                if arguments.backend != dex_backend:
+                    item["apk_handler"] = ApkHandler(item["apk_path"], item["output"], no_resources=True,
+                                                     backend=arguments.backend, scratch=scratch)
+                    item["apk_handler"].decode_apk(budget_limits.start(decode_stage))
+        except BudgetExceeded as exception:
+            print(str(exception) + " for app " + item["package"] + ".")
+            item["status"] = "timeout"
+        except Exception:
+            print("Failed to decode app " + item["package"] + ".")
+            traceback.print_exc()
+            item["status"] = "failed"
+        return item
+
+    def analyse(item):
+        if item["status"] is None:
+            try:
+                item["results"] = pool.apply(analyse_decoded_apk_in_worker,
+                                             (item["apk_path"], item["output"], item["artifact_path"]))
+                item["status"] = item["results"][0]
+                if result_cache is not None and item["status"] not in incomplete_statuses:
+                    result_cache.put(item["cache_key"], item["results"])
+            except Exception:
+                print("Failed to analyse app " + item["package"] + ".")
+                traceback.print_exc()
+                item["status"] = "failed"
+        return item
+
+    def store(item):
+        input_package = item["package"]
+        try:
+            if item["results"] is None:
+                writer.store_app_results(input_package, item["status"], [])
+                if item["status"] == "failed":
+                    print("Failed to inspect app " + input_package + ".")
+            else:
+                store_results(writer, input_package, *item["results"])
+        except Exception:
+            print("Failed to store the results of app " + input_package + " in the database.")
+        finally:
+            if item["apk_handler"] is not None:
+                item["apk_handler"].cleanup()
+            if os.path.exists(item["apk_path"]):
+                os.remove(item["apk_path"])
+
+    stages = [Stage("download", download, arguments.downloaders, arguments.queue_size),
+              Stage("decode", decode, arguments.decoders, arguments.queue_size),
+              Stage("analyse", analyse, arguments.workers, arguments.queue_size),
+              Stage("store", store, 1, arguments.queue_size)]
+
+    with Pool(processes=arguments.workers, initializer=init_worker,
+              initargs=(inspection_filter, result_cache, arguments.backend, budget_limits, arguments.artifacts,
+                        arguments.summary_cache, arguments.incremental, arguments.scratch, scratch.min_free,
+                        arguments.downloader),
+              maxtasksperchild=arguments.apks_per_worker) as pool:
+        run_pipeline(packages, stages)
+        pool.close()
+        pool.join()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Analyses the components of Android apps.")
+    parser.add_argument("apk", nargs="?",
+                        help="path of a local apk, the apps in package_names.json are analysed if it is missing")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes used for the apps in package_names.json")
+    parser.add_argument("--apks-per-worker", type=int, default=50,
+                        help="number of apps a worker process analyses before it is replaced")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="overlap the download, decode, analysis and storage of different apps")
+    parser.add_argument("--downloaders", type=int, default=8,
+                        help="number of concurrent downloads in pipeline mode")
+    parser.add_argument("--decoders", type=int, default=4,
+                        help="number of concurrent apktool runs in pipeline mode")
+    parser.add_argument("--queue-size", type=int, default=4,
+                        help="number of apps that can wait in front of each stage in pipeline mode")
+    parser.add_argument("--downloader", metavar="HOST:PORT",
+                        help="download the apps through downloader_server.py, which keeps its PlayStore session, "
+                             "rather than running the downloader container for each app")
+    parser.add_argument("--journal", default="journal.jsonl",
+                        help="file recording the outcome of each package, used to resume an interrupted sweep")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="analyse again the packages whose download or analysis failed, or ran out of budget, in a "
+                             "previous run")
+    parser.add_argument("--backend", choices=[smali_backend, dex_backend], default=smali_backend,
+                        help="read the classes from apktool's smali output or straight from the dex files of the apk")
+    parser.add_argument("--sink",
+                        help="where the results are stored: mysql, console, sqlite:PATH, jsonl:PATH or "
+                             "parquet:DIRECTORY; defaults to mysql if CP55PASSWD is set, to console otherwise")
+    parser.add_argument("--group-commit", type=int, default=default_batch_size,
+                        help="maximum number of apps whose results are committed together when analysing the apps in "
+                             "package_names.json")
+    parser.add_argument("--commit-interval", type=float, default=default_batch_delay,
+                        help="maximum number of seconds the results of an app wait for the other apps of their commit")
+    parser.add_argument("--artifacts",
+                        help="directory saving the invocations reachable from the components of each app, which "
+                             "rematch.py matches against a new filter without decoding the apps again")
+    parser.add_argument("--incremental", action="store_true",
+                        help="carry forward the components of each app whose classes did not change since its artifact "
+                             "was saved, and only inspect the others; the apps already in the database are analysed "
+                             "again, only the ones in the journal are skipped; requires --artifacts")
+    parser.add_argument("--summary-cache",
+                        help="SQLite file caching the summaries of the classes across apps, so that the library "
+                             "classes bundled by many apps are analysed once; only used by the smali backend")
+    parser.add_argument("--scratch",
+                        help="directory the apks are decoded in, defaults to one in /dev/shm if it is writable and to "
+                             "./cp55-scratch otherwise")
+    parser.add_argument("--scratch-reserve", type=int, default=default_min_free // (1024 * 1024),
+                        help="number of megabytes left free on the file system of the scratch directory; the apks are "
+                             "decoded in ./cp55-scratch when it runs short")
+    parser.add_argument("--cache", help="directory caching the analysis results of apks, disabled if missing")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="maximum size of the result cache in megabytes")
+    parser.add_argument("--timeout", action="append", metavar="STAGE=SECONDS",
+                        help="wall clock budget of a stage of the analysis of each app (decode, manifest, inspection "
+                             "or sql), can be repeated")
+    parser.add_argument("--max-rss", action="append", metavar="STAGE=MEGABYTES",
+                        help="memory budget of a stage of the analysis of each app (manifest, inspection or sql), "
+                             "can be repeated")
+    return parser.parse_args()
+
+
 def main():
-    db = DatabaseInterface()
+    arguments = parse_arguments()
 
     inspection_filter_file = open("filter.json", "r")
     inspection_filter = json.load(inspection_filter_file)
 
-    if len(sys.argv) < 2:
+    budget_limits = BudgetLimits(parse_limits(arguments.timeout), parse_limits(arguments.max_rss, 1024 * 1024))
+
+    if arguments.incremental and arguments.artifacts is None:
+        print("The incremental mode needs the artifacts of the previous analyses, see --artifacts.")
+        exit(0)
+
+    if arguments.artifacts is not None:
+        os.makedirs(arguments.artifacts, exist_ok=True)
+
+    scratch = ScratchSpace(arguments.scratch, min_free=arguments.scratch_reserve * 1024 * 1024)
+    scratch.reap_stale()
+
+    result_cache = None
+    if arguments.cache is not None:
+        result_cache = ResultCache(arguments.cache, inspection_filter, arguments.cache_size * 1024 * 1024,
+                                   arguments.backend)
+
+    if arguments.apk is None:
         # Using the package_names.json file
         print("Working with the package_names.json file.")
 
         package_list_file = open("package_names.json", "r")
         packages = json.load(package_list_file)
 
-        for input_package in packages:
-            try:
-                download_apk(input_package)
-            except Exception:
-                db.insert_app(input_package, "download_failed")
-                print("Failed to download app " + input_package + ".")
-                continue
-
-            apk_path = output_directory + input_package + apk_file_extension
-
-            try:
-                process_apk(apk_path, input_package, inspection_filter, db)
-            except Exception:
-                os.remove(apk_path)
-                continue
+        db = DatabaseInterface(create_sink(arguments.sink, arguments.group_commit))
+        journal = Journal(arguments.journal)
+        packages = select_packages(packages, journal, db, arguments.retry_failed, arguments.incremental)
+        print("Analysing " + str(len(packages)) + " package(s).")
+
+        downloader = None
+        if arguments.downloader is not None:
+            downloader = DownloaderClient(arguments.downloader, output_directory)
+
+        # The apps are recorded in the journal once their results are committed
+        writer = ResultWriter(db, journal.record, arguments.group_commit, arguments.commit_interval)
+
+        if arguments.pipeline:
+            run_staged_pipeline(packages, inspection_filter, result_cache, budget_limits, writer, scratch, downloader,
+                                arguments)
+        elif arguments.workers > 1:
+            analyse_packages(packages, inspection_filter, result_cache, arguments.backend, budget_limits,
+                             arguments.artifacts, arguments.summary_cache, arguments.incremental, arguments.scratch,
+                             scratch.min_free, arguments.downloader, writer, arguments.workers,
+                             arguments.apks_per_worker)
+        else:
+            summary_cache = None
+            if arguments.summary_cache is not None:
+                summary_cache = SummaryCache(arguments.summary_cache)
+
+            for input_package in packages:
+                analyse_package(input_package, inspection_filter, writer, result_cache=result_cache,
+                                backend=arguments.backend, budget_limits=budget_limits,
+                                artifact_directory=arguments.artifacts, summary_cache=summary_cache,
+                                incremental=arguments.incremental, scratch=scratch, downloader=downloader)
+
+            if summary_cache is not None:
+                summary_cache.close()
+
+        writer.close()
+        journal.close()
     else:
         # Using a local apk file
         print("Working with a local apk.")
 
-        apk_path = sys.argv[1]
+        apk_path = arguments.apk
 
         if not os.path.exists(apk_path):
             print("The argument provided is not a valid file path.")
@@ -111,7 +563,20 @@ def main():
 
         input_package = apk_path.split("/")[-1][:-4]
 
-        process_apk(apk_path, input_package, inspection_filter, db)
+        summary_cache = None
+        if arguments.summary_cache is not None:
+            summary_cache = SummaryCache(arguments.summary_cache)
+
+        db = DatabaseInterface(create_sink(arguments.sink))
+        process_apk(apk_path, input_package, inspection_filter, db, result_cache=result_cache,
+                    backend=arguments.backend, budget_limits=budget_limits, artifact_directory=arguments.artifacts,
+                    summary_cache=summary_cache, incremental=arguments.incremental, scratch=scratch)
+        db.close()
+
+        if summary_cache is not None:
+            summary_cache.close()
+
+    scratch.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,2 @@
+# Identifies the analysis logic in cached and stored results, to be bumped whenever the results it produces change
+analyser_version = "4"
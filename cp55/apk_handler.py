@@ -1,31 +1,65 @@
-import glob
 import os
 import shutil
+import signal
 import subprocess
 
+from cp55.budget import Budget, BudgetExceeded
+from cp55.dex_handler import DexReader
+from cp55.lru_cache import LruCache
+from cp55.smali_handler import SmaliHandler
+
+smali_backend = "smali"
+dex_backend = "dex"
+
+smali_file_extension = ".smali"
+default_output = "apk.out"
+
+default_class_cache_size = 256 * 1024 * 1024
+
 
 class ApkHandler:
     """
     Class responsible for interacting with the apk file and the its extracted resources.
+
+    The classes of the apk are read either from the smali files written by apktool (the "smali" backend) or straight
+    from the dex files of the apk (the "dex" backend), in which case apktool is not run at all. The parsed classes are
+    kept in a cache bounded by their approximate size, since the analysis reaches the same classes over and over.
     """
 
-    def __init__(self, file_apk, output=None, no_resources=False, no_sources=False):
+    def __init__(self, file_apk, output=None, no_resources=False, no_sources=False, backend=smali_backend,
+                 class_cache_size=default_class_cache_size, scratch=None):
+        """
+        :param output: the directory apktool decodes into, e.g. a workspace of the scratch space
+        :param scratch: the ScratchSpace whose reaper deletes the output on cleanup, deleted in place if None
+        """
         self.__file_apk = file_apk
         self.__no_res = no_resources
         self.__no_src = no_sources
+        self.__backend = backend
+        self.__scratch = scratch
+        self.__dex_reader = None
+        self.__class_cache = LruCache(class_cache_size, lambda x: x.size)
         if output is None:
-            self.__output = "apk.out"
+            self.__output = default_output
         else:
             self.__output = output
         self.__smali_paths = None
         self.__was_decoded = False
 
-    def decode_apk(self):
+    def decode_apk(self, budget: Budget = None):
         """
         Decodes the apk using apktool's decode function with the parameters passed in the constructor and returns
         the output of the command line process.
         TODO: throw error if extraction fails
+
+        :param budget: the budget of the decoding; apktool is killed when its time runs out
+        :raises: BudgetExceeded If apktool does not finish in time.
         """
+        if self.__backend == dex_backend:
+            self.__dex_reader = DexReader(self.__file_apk)
+            self.__was_decoded = True
+            return ""
+
         command = "apktool decode"
         if self.__no_res:
             command = command + " --no-res"
@@ -38,8 +72,20 @@ class ApkHandler:
         command = command + " " + self.__file_apk
 
         self.__was_decoded = True
-        apktool_output = subprocess.getoutput(command)
-
+        timeout = budget.remaining() if budget is not None else None
+
+        # apktool runs in its own process group, so that the java process it starts is killed along with it
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                   start_new_session=True)
+        try:
+            apktool_output, _ = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            raise BudgetExceeded(budget.stage, "time")
+
+        if apktool_output.endswith("\n"):
+            apktool_output = apktool_output[:-1]
         return apktool_output
 
     def was_decoded(self):
@@ -47,41 +93,86 @@ class ApkHandler:
 
     def get_manifest_file_path(self):
         """
-        Concatenates the output location with the manifest file default path.
+        Concatenates the output location with the manifest file default path. If the apk was not decoded, the path of
+        the apk itself is returned, from which ManifestHandler reads the binary manifest.
 
         :return: The relative path of the manifest file.
         :raises: IOError If manifest file is not present at the location.
         """
+        if not self.__was_decoded or self.__backend == dex_backend:
+            return self.__file_apk
+
         path = self.__output + "/AndroidManifest.xml"
         if os.path.isfile(path):
             return path
         else:
             raise IOError("Manifest file not found")
 
+    def get_class_handler(self, canonical_name):
+        """
+        Returns the handler of the given class, which exposes the canonical_name, methods, invoked_methods and
+        get_method members of SmaliHandler whatever the backend.
+
+        :return: the handler or None if the apk does not define the class
+        """
+        class_handler = self.__class_cache.get(canonical_name)
+        if class_handler is not None:
+            return class_handler
+
+        if self.__backend == dex_backend:
+            if self.__dex_reader is None:
+                self.__dex_reader = DexReader(self.__file_apk)
+            class_handler = self.__dex_reader.get_class_handler(canonical_name)
+        else:
+            path = self.get_smali_file_path(canonical_name)
+            if path is not None:
+                class_handler = SmaliHandler(path)
+
+        if class_handler is not None:
+            self.__class_cache.put(canonical_name, class_handler)
+
+        return class_handler
+
+    def get_class_cache_statistics(self):
+        """
+        :return: the hit, miss and eviction counters of the class handler cache
+        """
+        return self.__class_cache.get_statistics()
+
+    def get_class_names(self):
+        if self.__backend == dex_backend:
+            if self.__dex_reader is None:
+                self.__dex_reader = DexReader(self.__file_apk)
+            return self.__dex_reader.get_class_names()
+
+        if self.__smali_paths is None:
+            self.__build_class_canonical_name_file_path_dict()
+        return list(self.__smali_paths.keys())
+
     def get_smali_file_path(self, canonical_name):
         if self.__smali_paths is None:
             self.__build_class_canonical_name_file_path_dict()
         return self.__smali_paths.get(canonical_name, None)
 
     def __build_class_canonical_name_file_path_dict(self):
-        smali_paths = []
-
-        top_level_directories = list(
-            map(lambda x: self.__output + "/" + x,
-                filter(lambda x: x.startswith("smali"),
-                       os.listdir(self.__output))))
+        """
+        Maps the canonical name of every class to its smali file. The package of a class is the path of its directory
+        relative to the smali directory holding it, whatever the depth of the output directory itself.
+        """
+        name_path_dict = dict()
 
-        for directory in top_level_directories:
-            result = glob.glob(directory + '/**/*.smali', recursive=True)
-            smali_paths.extend(result)
+        for top_level_directory in sorted(os.listdir(self.__output)):
+            if not top_level_directory.startswith("smali"):
+                continue
 
-        name_path_dict = dict()
-        for smali_path in smali_paths:
-            parts = smali_path.split("/")
-            del parts[0]
-            del parts[0]
-            canonical_name = ".".join(parts).replace(".smali", "")
-            name_path_dict[canonical_name] = smali_path
+            top_level_path = os.path.join(self.__output, top_level_directory)
+            for directory, _, file_names in os.walk(top_level_path):
+                package = os.path.relpath(directory, top_level_path)
+                prefix = "" if package == os.curdir else package.replace(os.sep, ".") + "."
+                for file_name in file_names:
+                    if file_name.endswith(smali_file_extension):
+                        canonical_name = prefix + file_name[:-len(smali_file_extension)]
+                        name_path_dict[canonical_name] = os.path.join(directory, file_name)
 
         self.__smali_paths = name_path_dict
 
@@ -89,4 +180,13 @@ class ApkHandler:
         """
         Deletes the resources created by the extract function.
         """
-        shutil.rmtree(self.__output)
+        self.__class_cache.clear()
+
+        if self.__dex_reader is not None:
+            self.__dex_reader.close()
+            self.__dex_reader = None
+
+        if self.__scratch is not None:
+            self.__scratch.release(self.__output)
+        elif os.path.exists(self.__output):
+            shutil.rmtree(self.__output)
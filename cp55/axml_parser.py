@@ -0,0 +1,224 @@
+import struct
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+android_namespace = "http://schemas.android.com/apk/res/android"
+manifest_entry_name = "AndroidManifest.xml"
+
+# Chunk types of the binary xml format
+xml_chunk = 0x0003
+string_pool_chunk = 0x0001
+resource_map_chunk = 0x0180
+start_namespace_chunk = 0x0100
+end_namespace_chunk = 0x0101
+start_element_chunk = 0x0102
+end_element_chunk = 0x0103
+
+utf8_flag = 1 << 8
+no_entry = 0xFFFFFFFF
+
+# Value types of the typed attribute values
+type_reference = 0x01
+type_attribute = 0x02
+type_string = 0x03
+type_float = 0x04
+type_int_dec = 0x10
+type_int_hex = 0x11
+type_int_boolean = 0x12
+
+# Resource ids of the android attributes read by the analysis. Obfuscated apps may strip the attribute names from the
+# string pool, in which case the names are recovered from the resource ids.
+android_attributes = {
+    0x01010000: "theme",
+    0x01010001: "label",
+    0x01010002: "icon",
+    0x01010003: "name",
+    0x01010006: "permission",
+    0x01010007: "readPermission",
+    0x01010008: "writePermission",
+    0x0101000e: "enabled",
+    0x01010010: "exported",
+    0x01010011: "process",
+    0x01010018: "authorities",
+    0x01010019: "syncable",
+    0x0101001a: "initOrder",
+    0x0101001b: "grantUriPermissions",
+    0x01010020: "description",
+    0x0101020c: "minSdkVersion",
+    0x01010270: "targetSdkVersion",
+    0x01010271: "maxSdkVersion",
+    0x010103a9: "isolatedProcess",
+    0x01010505: "directBootAware",
+    0x01010599: "foregroundServiceType",
+}
+
+
+def is_binary_xml(data):
+    return len(data) >= 8 and struct.unpack_from("<HH", data, 0) == (xml_chunk, 8)
+
+
+def read_length(data, offset, utf8):
+    """
+    Reads the length prefix of a string pool entry.
+
+    :return: a tuple of the length and the offset right after the prefix
+    """
+    if utf8:
+        length = data[offset]
+        if length & 0x80:
+            return ((length & 0x7F) << 8) | data[offset + 1], offset + 2
+        return length, offset + 1
+
+    length = struct.unpack_from("<H", data, offset)[0]
+    if length & 0x8000:
+        return ((length & 0x7FFF) << 16) | struct.unpack_from("<H", data, offset + 2)[0], offset + 4
+    return length, offset + 2
+
+
+def parse_string_pool(data, chunk_start):
+    string_count, _, flags, strings_start = struct.unpack_from("<IIII", data, chunk_start + 8)
+    utf8 = flags & utf8_flag != 0
+
+    strings = list()
+    for index in range(string_count):
+        offset = chunk_start + strings_start + struct.unpack_from("<I", data, chunk_start + 28 + index * 4)[0]
+        if utf8:
+            # The utf-16 length precedes the utf-8 byte length
+            _, offset = read_length(data, offset, True)
+            length, offset = read_length(data, offset, True)
+            strings.append(data[offset:offset + length].decode("utf-8", errors="replace"))
+        else:
+            length, offset = read_length(data, offset, False)
+            strings.append(data[offset:offset + length * 2].decode("utf-16-le", errors="replace"))
+
+    return strings
+
+
+def format_value(strings, raw_value, value_type, value_data):
+    """
+    Formats a typed attribute value the way aapt does.
+    """
+    if raw_value != no_entry:
+        return strings[raw_value]
+    if value_type == type_string:
+        return strings[value_data]
+    if value_type == type_int_boolean:
+        return "true" if value_data != 0 else "false"
+    if value_type == type_int_dec:
+        return str(struct.unpack("<i", struct.pack("<I", value_data))[0])
+    if value_type == type_int_hex:
+        return "0x%x" % value_data
+    if value_type == type_float:
+        return repr(struct.unpack("<f", struct.pack("<I", value_data))[0])
+    if value_type == type_reference:
+        return "@0x%08x" % value_data
+    if value_type == type_attribute:
+        return "?0x%08x" % value_data
+    return "0x%08x" % value_data
+
+
+def decode_binary_xml(data, budget=None):
+    """
+    Converts a binary xml document, such as the AndroidManifest.xml stored in an apk, to its textual form.
+
+    :param data: the bytes of the binary xml document
+    :param budget: the budget of the stage reading the document, checked for each chunk
+    :return: the xml document as a string
+    :raises: BudgetExceeded If the conversion exceeds the budget.
+    """
+    if not is_binary_xml(data):
+        raise ValueError("Not a binary xml document")
+
+    strings = list()
+    resource_ids = list()
+    prefixes = {android_namespace: "android"}
+    pending_namespaces = list()
+    output = list()
+
+    def get_string(index):
+        if index == no_entry or index >= len(strings):
+            return ""
+        return strings[index]
+
+    def get_attribute_name(index):
+        name = get_string(index)
+        if index < len(resource_ids) and resource_ids[index] in android_attributes:
+            return android_attributes[resource_ids[index]]
+        return name
+
+    offset = struct.unpack_from("<H", data, 2)[0]
+    end = min(len(data), struct.unpack_from("<I", data, 4)[0])
+    while offset + 8 <= end:
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", data, offset)
+        if chunk_size < 8:
+            break
+        if budget is not None:
+            budget.check()
+
+        if chunk_type == string_pool_chunk:
+            strings = parse_string_pool(data, offset)
+
+        elif chunk_type == resource_map_chunk:
+            count = (chunk_size - header_size) // 4
+            resource_ids = list(struct.unpack_from("<%dI" % count, data, offset + header_size))
+
+        elif chunk_type == start_namespace_chunk:
+            prefix, uri = struct.unpack_from("<II", data, offset + header_size)
+            if get_string(uri) != android_namespace:
+                prefixes[get_string(uri)] = get_string(prefix)
+                pending_namespaces.append((get_string(prefix), get_string(uri)))
+
+        elif chunk_type == start_element_chunk:
+            _, name, attribute_start, attribute_size, attribute_count = \
+                struct.unpack_from("<IIHHH", data, offset + header_size)
+            element = "<" + get_string(name)
+
+            # The android namespace is always declared on the root element, even if the manifest omits it
+            if len(output) == 0:
+                pending_namespaces.insert(0, ("android", android_namespace))
+            for prefix, uri in pending_namespaces:
+                element += " xmlns:" + prefix + "=" + quoteattr(uri)
+            pending_namespaces = list()
+
+            # Obfuscated apps may leave attributes without a name or repeat one, which the xml parser rejects; they
+            # are skipped, the first of the repeated attributes being kept
+            attribute_names = set()
+            attribute_offset = offset + header_size + attribute_start
+            for index in range(attribute_count):
+                namespace, attribute_name, raw_value, _, _, value_type, value_data = \
+                    struct.unpack_from("<IIIHBBI", data, attribute_offset + index * attribute_size)
+
+                attribute_name = get_attribute_name(attribute_name)
+                if attribute_name == "":
+                    continue
+                prefix = prefixes.get(get_string(namespace), None)
+                if prefix:
+                    attribute_name = prefix + ":" + attribute_name
+                if attribute_name in attribute_names:
+                    continue
+                attribute_names.add(attribute_name)
+
+                value = format_value(strings, raw_value, value_type, value_data)
+                element += " " + attribute_name + "=" + quoteattr(value)
+
+            output.append(element + ">")
+
+        elif chunk_type == end_element_chunk:
+            _, name = struct.unpack_from("<II", data, offset + header_size)
+            output.append("</" + escape(get_string(name)) + ">")
+
+        offset += chunk_size
+
+    return "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n" + "\n".join(output)
+
+
+def read_manifest_from_apk(apk_path, budget=None):
+    """
+    Reads the binary AndroidManifest.xml straight from the apk archive, without decoding the apk with apktool.
+
+    :param budget: the budget of the stage reading the manifest, see decode_binary_xml
+    :return: the manifest as an xml string
+    """
+    with zipfile.ZipFile(apk_path) as apk:
+        data = apk.read(manifest_entry_name)
+    return decode_binary_xml(data, budget)
@@ -0,0 +1,113 @@
+import os
+import time
+
+# Stages of the analysis of an app that have their own budget
+decode_stage = "decode"
+manifest_stage = "manifest"
+inspection_stage = "inspection"
+sql_stage = "sql"
+stages = (decode_stage, manifest_stage, inspection_stage, sql_stage)
+
+# Number of checks of a budget between two reads of the resident set size
+rss_check_interval = 256
+
+page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def get_rss():
+    """
+    :return: the resident set size of the current process in bytes, or None if it cannot be read
+    """
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * page_size
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised when a stage of the analysis of an app runs out of time or memory.
+    """
+
+    def __init__(self, stage, reason, results=None):
+        """
+        :param results: the results the stage completed before running out of budget, if any
+        """
+        super().__init__(stage, reason)
+        self.stage = stage
+        self.reason = reason
+        self.results = results
+
+    def __str__(self):
+        return "The " + self.stage + " stage exceeded its " + self.reason + " budget"
+
+
+class Budget:
+    """
+    Wall clock and memory budget of a stage. The work of the stage calls check regularly, which raises BudgetExceeded
+    once the budget is spent, so that the stage stops at a point where its partial results are consistent.
+    """
+
+    def __init__(self, stage, seconds=None, max_rss=None):
+        """
+        :param seconds: the maximum duration of the stage, unlimited if None
+        :param max_rss: the maximum resident set size of the process in bytes during the stage, unlimited if None
+        """
+        self.stage = stage
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.max_rss = max_rss
+        self.__checks = 0
+
+    def remaining(self):
+        """
+        :return: the number of seconds left, or None if the duration of the stage is unlimited
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise BudgetExceeded(self.stage, "time")
+
+        if self.max_rss is not None:
+            self.__checks += 1
+            if self.__checks % rss_check_interval == 1:
+                rss = get_rss()
+                if rss is not None and rss > self.max_rss:
+                    raise BudgetExceeded(self.stage, "memory")
+
+
+class BudgetLimits:
+    """
+    The wall clock and memory limits of each stage of the analysis of an app, from which a fresh budget is started
+    for every app.
+    """
+
+    def __init__(self, timeouts=None, max_rss=None):
+        """
+        :param timeouts: dict mapping stage names to their maximum duration in seconds
+        :param max_rss: dict mapping stage names to the maximum resident set size of the process in bytes
+        """
+        self.timeouts = timeouts if timeouts is not None else dict()
+        self.max_rss = max_rss if max_rss is not None else dict()
+
+    def start(self, stage):
+        return Budget(stage, self.timeouts.get(stage, None), self.max_rss.get(stage, None))
+
+
+def parse_limits(values, scale=1):
+    """
+    Parses limits given on the command line as "stage=value", e.g. "decode=300".
+
+    :param scale: the factor applied to the values, e.g. to convert megabytes to bytes
+    :return: dict mapping the stage names to their limits
+    """
+    limits = dict()
+    for value in values or []:
+        stage, _, limit = value.partition("=")
+        if stage not in stages:
+            raise ValueError("Unknown stage " + stage + ", expected one of " + ", ".join(stages))
+        limits[stage] = float(limit) * scale
+    return limits
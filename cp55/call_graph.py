@@ -0,0 +1,287 @@
+from array import array
+
+# Number of bits of the method id in the packed (class id, method id) key of a method
+method_bits = 32
+method_mask = (1 << method_bits) - 1
+
+
+def pack_method(class_id, method_id):
+    return (class_id << method_bits) | method_id
+
+
+def find_strongly_connected_components(offsets, targets, budget=None):
+    """
+    Iterative version of Tarjan's algorithm.
+
+    :param offsets: the successors of node i are targets[offsets[i]:offsets[i + 1]]
+    :param targets: the successor node ids of all the nodes
+    :param budget: the budget of the stage building the graph, checked for each node, if any
+    :return: a tuple of the component id of each node and the number of components
+    :raises: BudgetExceeded If the budget runs out.
+    """
+    node_count = len(offsets) - 1
+    index = array("i", [-1]) * node_count
+    low = array("i", [0]) * node_count
+    on_stack = bytearray(node_count)
+    component = array("i", [-1]) * node_count
+    stack = list()
+    counter = 0
+    component_count = 0
+
+    for root in range(node_count):
+        if index[root] != -1:
+            continue
+
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, offsets[root])]
+
+        while len(work) > 0:
+            node, next_successor = work[-1]
+            if next_successor < offsets[node + 1]:
+                work[-1] = (node, next_successor + 1)
+                successor = targets[next_successor]
+                if index[successor] == -1:
+                    index[successor] = low[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack[successor] = True
+                    work.append((successor, offsets[successor]))
+                elif on_stack[successor]:
+                    low[node] = min(low[node], index[successor])
+            else:
+                if budget is not None:
+                    budget.check()
+                work.pop()
+                if len(work) > 0:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = component_count
+                        if member == node:
+                            break
+                    component_count += 1
+
+    return component, component_count
+
+
+def get_invoked_methods(class_handler, summary_cache=None):
+    """
+    :return: the invocations of every method of the class, from the summary cache if it knows the class
+    """
+    if summary_cache is None:
+        return class_handler.invoked_methods
+
+    invoked_methods = summary_cache.get_invoked_methods(class_handler)
+    if invoked_methods is None:
+        invoked_methods = dict(class_handler.invoked_methods.items())
+        summary_cache.put_invoked_methods(class_handler, invoked_methods)
+    return invoked_methods
+
+
+class SymbolTable:
+    """
+    Interns names to consecutive integer ids.
+    """
+
+    def __init__(self):
+        self.names = list()
+        self.__ids = dict()
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        symbol = self.__ids.get(name, None)
+        if symbol is None:
+            symbol = len(self.names)
+            self.__ids[name] = symbol
+            self.names.append(name)
+        return symbol
+
+    def get_id(self, name):
+        return self.__ids.get(name, None)
+
+
+class CallGraph:
+    """
+    Call graph of a whole app, built once from all its classes and shared by the reachability queries of all its
+    components.
+
+    The nodes are (class, method name) pairs of the methods defined in the app. A node has an edge to every method of
+    the app it invokes; invocations of classes outside the app are kept as the data of the node. The graph is condensed
+    into its strongly connected components, so a query walks each cycle of methods as a single node.
+
+    Class and method names are interned, so that the graph is made of integer arrays: the invocations of the nodes and
+    their successors are stored in compressed sparse row form, i.e. a flat array of targets and an array of offsets.
+    An invocation is identified by its own id, which get_invocation turns back into a class and method name.
+
+    When the classes the queries start from are known, the graph only holds the classes they reach, so that the other
+    classes of the app are never read.
+    """
+
+    def __init__(self, apk_handler, budget=None, root_classes=None, summary_cache=None):
+        """
+        :param budget: the budget of the stage building the graph, checked for each class, method and component
+        :param root_classes: the names of the classes the queries start from, all the classes of the app if None
+        :param summary_cache: the SummaryCache the invocations of the classes are taken from and added to, if any
+        """
+        self.classes = SymbolTable()
+        self.methods = SymbolTable()
+        # Content hashes of the classes of the graph, None for the classes read by the dex backend
+        self.class_hashes = dict()
+        self.__invocation_keys = array("Q")
+        self.__invocation_ids = dict()
+
+        node_ids = dict()
+        class_nodes = dict()
+        invocation_offsets = array("I", [0])
+        invocation_targets = array("I")
+
+        if root_classes is None:
+            to_visit = list(apk_handler.get_class_names())
+            queued = None
+        else:
+            to_visit = list(root_classes)
+            queued = set(to_visit)
+
+        # The classes are visited breadth first, the called classes being queued when the graph starts from roots
+        next_class = 0
+        while next_class < len(to_visit):
+            class_name = to_visit[next_class]
+            next_class += 1
+            if budget is not None:
+                budget.check()
+
+            class_handler = apk_handler.get_class_handler(class_name)
+            if class_handler is None:
+                continue
+
+            class_id = self.classes.intern(class_handler.canonical_name)
+            self.class_hashes[class_handler.canonical_name] = class_handler.content_hash
+            first_node = len(node_ids)
+            for method, invocations in get_invoked_methods(class_handler, summary_cache).items():
+                node_ids[pack_method(class_id, self.methods.intern(method))] = len(node_ids)
+                invocation_targets.extend(sorted(self.__intern_invocations(invocations)))
+                invocation_offsets.append(len(invocation_targets))
+                if queued is not None:
+                    for called_class in invocations.keys():
+                        if called_class not in queued:
+                            queued.add(called_class)
+                            to_visit.append(called_class)
+            class_nodes[class_id] = (first_node, len(node_ids))
+
+        edge_offsets = array("I", [0])
+        edge_targets = array("I")
+        for node in range(len(node_ids)):
+            if budget is not None:
+                budget.check()
+            for invocation in invocation_targets[invocation_offsets[node]:invocation_offsets[node + 1]]:
+                successor = node_ids.get(self.__invocation_keys[invocation], None)
+                if successor is not None:
+                    edge_targets.append(successor)
+            edge_offsets.append(len(edge_targets))
+
+        self.__class_nodes = class_nodes
+        self.__invocation_offsets = invocation_offsets
+        self.__invocation_targets = invocation_targets
+        self.__component, component_count = find_strongly_connected_components(edge_offsets, edge_targets, budget)
+
+        # Members and successors of each component, in compressed sparse row form as well
+        self.__member_offsets = array("I", [0]) * (component_count + 1)
+        for component in self.__component:
+            self.__member_offsets[component + 1] += 1
+        for component in range(component_count):
+            self.__member_offsets[component + 1] += self.__member_offsets[component]
+        self.__members = array("I", [0]) * len(node_ids)
+        next_member = array("I", self.__member_offsets)
+        for node, component in enumerate(self.__component):
+            self.__members[next_member[component]] = node
+            next_member[component] += 1
+
+        self.__successor_offsets = array("I", [0])
+        self.__successors = array("I")
+        for component in range(component_count):
+            if budget is not None:
+                budget.check()
+            successors = set()
+            for node in self.__members[self.__member_offsets[component]:self.__member_offsets[component + 1]]:
+                for successor in edge_targets[edge_offsets[node]:edge_offsets[node + 1]]:
+                    if self.__component[successor] != component:
+                        successors.add(self.__component[successor])
+            self.__successors.extend(successors)
+            self.__successor_offsets.append(len(self.__successors))
+
+    def __intern_invocations(self, invocations):
+        """
+        :param invocations: dict mapping called class names to the set of the called method names
+        :return: the set of the ids of the invocations
+        """
+        invocation_ids = set()
+        for called_class, called_methods in invocations.items():
+            class_id = self.classes.intern(called_class)
+            for called_method in called_methods:
+                key = pack_method(class_id, self.methods.intern(called_method))
+                invocation = self.__invocation_ids.get(key, None)
+                if invocation is None:
+                    invocation = len(self.__invocation_keys)
+                    self.__invocation_ids[key] = invocation
+                    self.__invocation_keys.append(key)
+                invocation_ids.add(invocation)
+        return invocation_ids
+
+    def get_invocation(self, invocation):
+        """
+        :return: a tuple of the called class name and the called method name of the given invocation id
+        """
+        key = self.__invocation_keys[invocation]
+        return self.classes.names[key >> method_bits], self.methods.names[key & method_mask]
+
+    def get_invocation_count(self):
+        return len(self.__invocation_keys)
+
+    def get_reachable_methods(self, class_name):
+        """
+        :return: the ids of the nodes reachable from any method of the given class, the methods of the class included
+        """
+        class_id = self.classes.get_id(class_name)
+        first_node, end_node = self.__class_nodes.get(class_id, (0, 0))
+
+        to_visit = list(set(self.__component[node] for node in range(first_node, end_node)))
+        visited = set(to_visit)
+        reachable = list()
+        while len(to_visit) > 0:
+            component = to_visit.pop()
+            reachable.extend(self.__members[self.__member_offsets[component]:self.__member_offsets[component + 1]])
+            for successor in self.__successors[self.__successor_offsets[component]:
+                                               self.__successor_offsets[component + 1]]:
+                if successor not in visited:
+                    visited.add(successor)
+                    to_visit.append(successor)
+
+        return reachable
+
+    def get_reachable_invocations(self, class_handler):
+        """
+        Collects the invocations of every method reachable from the class of the given handler.
+
+        :return: the set of the ids of the invocations
+        """
+        if self.classes.get_id(class_handler.canonical_name) not in self.__class_nodes:
+            # The class is not part of the graph, only its own invocations are known
+            invocations = set()
+            for method_invocations in class_handler.invoked_methods.values():
+                invocations.update(self.__intern_invocations(method_invocations))
+            return invocations
+
+        invocations = set()
+        for node in self.get_reachable_methods(class_handler.canonical_name):
+            invocations.update(self.__invocation_targets[self.__invocation_offsets[node]:
+                                                         self.__invocation_offsets[node + 1]])
+        return invocations
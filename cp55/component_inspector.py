@@ -1,10 +1,12 @@
-import json
 import re
 
 from cp55.apk_handler import ApkHandler
-from cp55.manifest_elements import ContentProvider, Service, BroadcastReceiver
+from cp55.budget import BudgetExceeded, BudgetLimits, inspection_stage, manifest_stage, sql_stage
+from cp55.call_graph import CallGraph
+from cp55.filter_matcher import compile_filter, format_filter_matches
+from cp55.invocation_artifact import save_artifact
+from cp55.manifest_elements import Activity, ContentProvider, Service, BroadcastReceiver
 from cp55.manifest_handler import ManifestHandler
-from cp55.smali_handler import SmaliHandler
 from cp55.sql_injection_checker import SqlInjectionChecker
 
 
@@ -15,20 +17,41 @@ def get_component_type(component):
         return "service"
     elif isinstance(component, BroadcastReceiver):
         return "receiver"
+    elif isinstance(component, Activity):
+        return "activity"
 
 
-def has_sql(stack_trace):
-    for top_level_class, invoked_methods in stack_trace.items():
-        for top_level_method, invocations in invoked_methods.items():
-            for called_object in invocations.keys():
-                if "sql" in called_object.lower():
-                    return True
-    return False
+# Component types of the targets of filter.json, in the order in which the components are inspected
+target_component_types = {"providers": "provider", "services": "service", "receivers": "receiver",
+                          "activities": "activity"}
+default_targets = ["providers", "services", "receivers"]
+
+
+def get_target_component_types(inspection_filter):
+    """
+    :return: the set of the types of the components targeted by the filter, the background components if the filter
+             has no targets
+    :raises: ValueError If a target is unknown.
+    """
+    targets = default_targets
+    if inspection_filter is not None and "targets" in inspection_filter:
+        targets = inspection_filter["targets"]
+
+    component_types = set()
+    for target in targets:
+        if target not in target_component_types:
+            raise ValueError("Unknown target " + target + ", expected one of " + ", ".join(target_component_types))
+        component_types.add(target_component_types[target])
+    return component_types
+
+
+def is_sql_class(class_name):
+    return "sql" in class_name.lower()
 
 
 sql_start_functions = [("insert(Landroid/net/Uri;Landroid/content/ContentValues;)Landroid/net/Uri;", {"p2"}),
                        ("query(Landroid/net/Uri;[Ljava/lang/String;Ljava/lang/String;" +
-                        "[Ljava/lang/String;Ljava/lang/String;)Landroid/database/Cursor", {"p2", "p3", "p4", "p5"}),
+                        "[Ljava/lang/String;Ljava/lang/String;)Landroid/database/Cursor;", {"p2", "p3", "p4", "p5"}),
                        ("update(Landroid/net/Uri;Landroid/content/ContentValues;" +
                         "Ljava/lang/String;[Ljava/lang/String;)I", {"p2", "p3"}),
                        ("delete(Landroid/net/Uri;Ljava/lang/String;[Ljava/lang/String;)I", {"p2", "p3"})]
@@ -36,206 +59,240 @@ sql_start_functions = [("insert(Landroid/net/Uri;Landroid/content/ContentValues;
 
 class ComponentInspector:
 
-    def __init__(self, apk_handler: ApkHandler, inspection_filter):
+    def __init__(self, apk_handler: ApkHandler, inspection_filter, budget_limits: BudgetLimits = None,
+                 summary_cache=None, previous_artifact=None):
+        """
+        :param budget_limits: the time and memory limits of the stages of the inspection, unlimited if None
+        :param summary_cache: the SummaryCache shared by the apps of the sweep, if any
+        :param previous_artifact: the artifact of a previous analysis of the app, see load_artifact, whose components
+                                  are carried forward when none of the classes they reach changed
+        :raises: BudgetExceeded If reading the manifest exceeds its budget.
+        """
         if apk_handler.was_decoded is False:
             apk_handler.decode_apk()
         self.apk_handler = apk_handler
+        self.budget_limits = budget_limits if budget_limits is not None else BudgetLimits()
+        self.summary_cache = summary_cache
+        self.component_types = get_target_component_types(inspection_filter)
 
+        budget = self.budget_limits.start(manifest_stage)
         manifest_path = apk_handler.get_manifest_file_path()
-        self.manifest_handler = ManifestHandler(manifest_path)
-
-        if inspection_filter is not None:
-            self.target_methods = inspection_filter["method_filters"]
-            self.target_classes = inspection_filter["object_filters"]
-        else:
-            self.target_methods = None
-            self.target_classes = None
+        self.manifest_handler = ManifestHandler(manifest_path, budget, self.component_types)
+        self.call_graph = None
+        self.invocation_matches = dict()
+        # Tuples of the name, the type and the reachable invocations of the inspected components, see save_invocations
+        self.component_invocations = list()
+
+        self.previous_artifact = None
+        if previous_artifact is not None:
+            invocations, components, class_hashes = previous_artifact
+            self.previous_artifact = (invocations, {(name, component_type): indexes
+                                                    for name, component_type, indexes in components}, class_hashes)
+        # Content hashes of the classes the carried forward components depend on, None for the missing classes
+        self.class_hashes = dict()
+        self.carried_forward = 0
+
+        self.filter_matcher = compile_filter(inspection_filter)
 
     def inspect_background_components(self):
         """
-        Inspects the background components of the application (content providers, services, and broadcast receivers)
-        to check if the target classes and methods defined in the filter are present.
+        Inspects the components of the application targeted by the filter (content providers, services and broadcast
+        receivers by default, activities on demand) to check if the target classes and methods defined in the filter
+        are present. The other components are neither read from the manifest nor inspected.
 
         :return: a tuple where the first element is a list of dictionaries representing the analysis result for
         each individual component and the second element is the status of the analysis
+        :raises: BudgetExceeded If the inspection exceeds its budget, with the results of the components inspected so
+        far.
         """
         result = list()
 
-        providers = self.manifest_handler.get_providers()
-        services = self.manifest_handler.get_services()
-        receivers = self.manifest_handler.get_receivers()
-
         components = list()
-        components.extend(providers)
-        components.extend(services)
-        components.extend(receivers)
+        components.extend(self.manifest_handler.get_providers())
+        components.extend(self.manifest_handler.get_services())
+        components.extend(self.manifest_handler.get_receivers())
+        components.extend(self.manifest_handler.get_activities())
 
         analysis_status = "full"
 
-        for component in components:
-            path = self.apk_handler.get_smali_file_path(component.name)
-
-            if path is None:
-                continue
-
-            smali_handler = SmaliHandler(path)
-            stack_trace = self.__build_stack_trace_for_class(smali_handler)
+        budget = self.budget_limits.start(inspection_stage)
+        try:
+            carried_invocations = dict()
+            if self.previous_artifact is not None:
+                for component in components:
+                    budget.check()
+                    invocations = self.__carry_forward(component)
+                    if invocations is not None:
+                        carried_invocations[component] = invocations
+            self.carried_forward = len(carried_invocations)
+            graph_roots = [component.name for component in components if component not in carried_invocations]
+
+            for component in components:
+                budget.check()
+                invocations = carried_invocations.get(component, None)
+                if invocations is None:
+                    smali_handler = self.apk_handler.get_class_handler(component.name)
+
+                    if smali_handler is None:
+                        continue
 
-            matches = self.__find_matching_classes(stack_trace)
-            matches.update(self.__find_matching_methods(stack_trace))
-
-            if len(matches) == 0:
-                matches = "[]"
-            else:
-                matches = json.dumps(list(matches))
-
-            component_has_sql = has_sql(stack_trace)
-            if component_has_sql and isinstance(component, ContentProvider):
-                analysis_status = "background"
-
-            component_result = {
-                "name": component.name,
-                "type": get_component_type(component),
-                "enabled": component.enabled,
-                "exported": component.exported,
-                "direct_boot_aware": component.direct_boot_aware,
-                "filter_matches": matches,
-                "authorities": component.authorities,
-                "permission": component.permission,
-                "grant_uri_permission": component.grant_uri_permission,
-                "write_permission": component.write_permission,
-                "read_permission": component.read_permission,
-                "has_sql": component_has_sql,
-                "foreground_service_type": component.foreground_service_type
-            }
-
-            result.append(component_result)
+                    invocations = self.__find_reachable_invocations(smali_handler, budget, graph_roots)
+
+                matches = set()
+                component_has_sql = False
+                for invocation in invocations:
+                    invocation_matches, invocation_has_sql = self.__match_invocation(invocation)
+                    matches.update(invocation_matches)
+                    component_has_sql = component_has_sql or invocation_has_sql
+
+                matches = format_filter_matches(matches)
+
+                if component_has_sql and isinstance(component, ContentProvider):
+                    analysis_status = "background"
+
+                self.component_invocations.append((component.name, get_component_type(component), invocations))
+                component_result = {
+                    "name": component.name,
+                    "type": get_component_type(component),
+                    "enabled": component.enabled,
+                    "exported": component.exported,
+                    "direct_boot_aware": component.direct_boot_aware,
+                    "filter_matches": matches,
+                    "authorities": component.authorities,
+                    "permission": component.permission,
+                    "grant_uri_permission": component.grant_uri_permission,
+                    "write_permission": component.write_permission,
+                    "read_permission": component.read_permission,
+                    "has_sql": component_has_sql,
+                    "foreground_service_type": component.foreground_service_type
+                }
+
+                result.append(component_result)
+        except BudgetExceeded as exception:
+            exception.results = result
+            raise
 
         return result, analysis_status
 
-    def inspect_providers_for_sql_injection(self):
-        result = list()
-
-        sql_checker = SqlInjectionChecker(self.apk_handler)
-
-        providers = self.manifest_handler.get_providers()
-        for provider in providers:
-            path = self.apk_handler.get_smali_file_path(provider.name)
-
-            if path is None:
-                continue
-
-            smali_handler = SmaliHandler(path)
-
-            for (start_function, arguments) in sql_start_functions:
-                method = smali_handler.get_method(start_function)
-                method_name = re.findall(".*\\(", start_function)[0][:-1]
-
-                has_query_checks = sql_checker.check_method(method, arguments)
-                has_uri_checks = sql_checker.check_method(method, {"p1"})
-
-                result.append({
-                    "provider_name": provider.name,
-                    "method_name": method_name,
-                    "has_query_checks": has_query_checks,
-                    "has_uri_checks": has_uri_checks
-                })
-
-        return result
-
-    def __find_matching_methods(self, stack_trace):
-        """
-        Returns the set of matching methods.
-        """
-        matches = set()
-        for top_level_class, invoked_methods in stack_trace.items():
-            for top_level_method, invocations in invoked_methods.items():
-                for called_object, called_methods in invocations.items():
-                    for called_method in called_methods:
-                        potential_match = called_object + ":" + called_method
-                        if potential_match in self.target_methods:
-                            matches.add(potential_match)
-        return matches
-
-    def __find_matching_classes(self, stack_trace):
+    def save_invocations(self, path):
         """
-        Returns the set of matching classes.
+        Saves the invocations reachable from the components inspected so far, along with the content hashes of the
+        classes they depend on, so that the app can be matched against another filter without being decoded again, and
+        its next version analysed incrementally, see invocation_artifact.py.
         """
-        matches = set()
-        for top_level_class, invoked_methods in stack_trace.items():
-            for top_level_method, invocations in invoked_methods.items():
-                for called_object in invocations.keys():
-                    if called_object in self.target_classes:
-                        matches.add(called_object)
-        return matches
-
-    def __build_stack_trace_for_class(self, smali_handler):
+        class_hashes = dict(self.class_hashes)
+        component_invocations = list()
+        for name, component_type, invocations in self.component_invocations:
+            component_invocations.append((name, component_type, {
+                invocation if isinstance(invocation, tuple) else self.call_graph.get_invocation(invocation)
+                for invocation in invocations}))
+        if self.call_graph is not None:
+            class_hashes.update(self.call_graph.class_hashes)
+
+        save_artifact(path, component_invocations, {name: content_hash for name, content_hash in class_hashes.items()
+                                                    if content_hash is not None})
+
+    def __carry_forward(self, component):
         """
-        Builds a stack trace like data structure for the java class associated to the given smali handler.
+        Returns the invocations the previous analysis found reachable from the component, if none of the classes of the
+        app they depend on changed since: the class of the component and the classes of the app it calls have the same
+        content, and the classes it calls that were missing from the app are still missing.
 
-        The structure is as follows:
-        dict(key = top level class,
-             value = dict(key = top level method,
-                          value = dict(key = called object,
-                                       value = set(called method)
-                          )
-             )
+        :return: the set of the (class name, method name) reachable invocations, or None if the component has to be
+                 inspected again
+        """
+        invocations, components, previous_hashes = self.previous_artifact
+        indexes = components.get((component.name, get_component_type(component)), None)
+        if indexes is None or previous_hashes.get(component.name, None) is None:
+            return None
+
+        reachable = [invocations[index] for index in indexes]
+        for class_name in {component.name}.union(called_object for called_object, _ in reachable):
+            if previous_hashes.get(class_name, None) != self.__get_class_hash(class_name):
+                return None
+        return set(reachable)
+
+    def __get_class_hash(self, class_name):
+        if class_name not in self.class_hashes:
+            class_handler = self.apk_handler.get_class_handler(class_name)
+            self.class_hashes[class_name] = class_handler.content_hash if class_handler is not None else None
+        return self.class_hashes[class_name]
 
-        If an object is is called inside a top level class and it has a smali class, then the class of that object
-        will be considered a top level class as well, recursively building the stack trace across different classes.
+    def inspect_providers_for_sql_injection(self):
+        """
+        Checks the entry points of the content providers for sql injections.
 
-        :param smali_handler: the smali handler of the object for which the stack trace is built
-        :return: the stack trace like data structure defined above
+        :return: a list of dictionaries representing the checks of each entry point
+        :raises: BudgetExceeded If the checks exceed their budget, with the results of the entry points checked so far.
         """
-        canonical_name = smali_handler.canonical_name
-        invoked_methods = smali_handler.invoked_methods
+        result = list()
 
-        invoked_methods_to_visit = list()
-        methods_filter = set()
+        budget = self.budget_limits.start(sql_stage)
+        sql_checker = SqlInjectionChecker(self.apk_handler, budget=budget, summary_cache=self.summary_cache)
 
-        invoked_methods_to_visit.append(invoked_methods.values())
-        stack_trace = {canonical_name: invoked_methods}
+        try:
+            providers = self.manifest_handler.get_providers()
+            for provider in providers:
+                smali_handler = self.apk_handler.get_class_handler(provider.name)
 
-        while len(invoked_methods_to_visit) > 0:
-            for invoked_method in invoked_methods_to_visit.pop():
-                for java_class, methods in invoked_method.items():
+                if smali_handler is None:
+                    continue
 
-                    path_to_class = self.apk_handler.get_smali_file_path(java_class)
+                for (start_function, arguments) in sql_start_functions:
+                    budget.check()
+                    method = smali_handler.get_method(start_function)
+                    method_name = re.findall(".*\\(", start_function)[0][:-1]
 
-                    full_method_names = set(map(lambda x: java_class + ":" + x, methods))
+                    has_query_checks = sql_checker.check_method(method, arguments)
+                    has_uri_checks = sql_checker.check_method(method, {"p1"})
 
-                    if path_to_class is None or full_method_names.issubset(methods_filter):
-                        continue
-                    else:
-                        for method in methods:
-                            methods_filter.add(java_class + ":" + method)
+                    result.append({
+                        "provider_name": provider.name,
+                        "method_name": method_name,
+                        "has_query_checks": has_query_checks,
+                        "has_uri_checks": has_uri_checks
+                    })
+        except BudgetExceeded as exception:
+            exception.results = result
+            raise
 
-                        child_handler = SmaliHandler(path_to_class)
-                        child_invoked_methods = child_handler.invoked_methods
-                        called_methods = dict(
-                            filter(lambda x: child_handler.canonical_name + ":" + x[0] in methods_filter,
-                                   child_invoked_methods.items()))
+        return result
 
-                        # Add the new methods to visit to the list
-                        invoked_methods_to_visit.append(called_methods.copy().values())
+    def __match_invocation(self, invocation):
+        """
+        Matches an invocation against the filter. The result is computed once per app for each invocation, and shared
+        by all the components that reach it.
 
-                        new_methods_to_filter = set(
-                            map(lambda x: child_handler.canonical_name + ":" + x, called_methods.keys()))
-                        methods_filter.update(new_methods_to_filter)
+        :param invocation: the id of the invocation in the call graph, or the (class name, method name) of an
+                           invocation carried forward from the previous analysis
+        :return: a tuple of the filter entries matched by the invocation and whether it calls an sql class
+        """
+        result = self.invocation_matches.get(invocation, None)
+        if result is None:
+            if isinstance(invocation, tuple):
+                called_object, called_method = invocation
+            else:
+                called_object, called_method = self.call_graph.get_invocation(invocation)
 
-                        # Update the stack_trace object
-                        if child_handler.canonical_name not in stack_trace:
-                            stack_trace[child_handler.canonical_name] = called_methods
+            result = (self.filter_matcher.match(called_object, called_method), is_sql_class(called_object))
+            self.invocation_matches[invocation] = result
+        return result
 
-                        else:
-                            for top_level_method, methods_invoked_inside in called_methods.items():
-                                if top_level_method not in stack_trace[child_handler.canonical_name]:
-                                    stack_trace[child_handler.canonical_name][top_level_method] = methods_invoked_inside
+    def __find_reachable_invocations(self, smali_handler, budget, graph_roots):
+        """
+        Finds the invocations of every method reachable from the java class associated to the given smali handler.
 
-                                else:
-                                    stack_trace[child_handler.canonical_name][top_level_method].update(
-                                        methods_invoked_inside)
+        If an object is called inside the class and it has a smali class, then the methods of that object are
+        considered as well, recursively across different classes. The reachable methods are looked up in the call graph
+        of the app, which is built once from the components that are not carried forward and shared by all of them.
 
-                        break
+        :param smali_handler: the smali handler of the object for which the invocations are collected
+        :param budget: the budget of the inspection, checked while the call graph is built
+        :param graph_roots: the names of the classes of the components inspected from the call graph, which only
+                            covers the classes they reach
+        :return: the set of the ids of the invocations in the call graph
+        """
+        if self.call_graph is None:
+            self.call_graph = CallGraph(self.apk_handler, budget, graph_roots, self.summary_cache)
 
-        return stack_trace
+        return self.call_graph.get_reachable_invocations(smali_handler)
@@ -0,0 +1,655 @@
+import mmap
+import re
+import struct
+import zipfile
+
+from cp55.smali_handler import InvokedMethods, MethodBodies
+
+dex_file_name_pattern = re.compile("^classes([0-9]*)\\.dex$")
+
+
+def build_opcode_table():
+    """
+    Builds the table of the dalvik opcodes, mapping each opcode to its mnemonic and instruction format.
+    """
+    table = [("unused", "10x")] * 256
+
+    def put(first_opcode, names, instruction_format):
+        for index, name in enumerate(names):
+            table[first_opcode + index] = (name, instruction_format)
+
+    put(0x00, ["nop"], "10x")
+    table[0x01] = ("move", "12x")
+    table[0x02] = ("move/from16", "22x")
+    table[0x03] = ("move/16", "32x")
+    table[0x04] = ("move-wide", "12x")
+    table[0x05] = ("move-wide/from16", "22x")
+    table[0x06] = ("move-wide/16", "32x")
+    table[0x07] = ("move-object", "12x")
+    table[0x08] = ("move-object/from16", "22x")
+    table[0x09] = ("move-object/16", "32x")
+    put(0x0a, ["move-result", "move-result-wide", "move-result-object", "move-exception"], "11x")
+    put(0x0e, ["return-void"], "10x")
+    put(0x0f, ["return", "return-wide", "return-object"], "11x")
+    table[0x12] = ("const/4", "11n")
+    table[0x13] = ("const/16", "21s")
+    table[0x14] = ("const", "31i")
+    table[0x15] = ("const/high16", "21h")
+    table[0x16] = ("const-wide/16", "21s")
+    table[0x17] = ("const-wide/32", "31i")
+    table[0x18] = ("const-wide", "51l")
+    table[0x19] = ("const-wide/high16", "21h")
+    table[0x1a] = ("const-string", "21c")
+    table[0x1b] = ("const-string/jumbo", "31c")
+    table[0x1c] = ("const-class", "21c")
+    put(0x1d, ["monitor-enter", "monitor-exit"], "11x")
+    table[0x1f] = ("check-cast", "21c")
+    table[0x20] = ("instance-of", "22c")
+    table[0x21] = ("array-length", "12x")
+    table[0x22] = ("new-instance", "21c")
+    table[0x23] = ("new-array", "22c")
+    table[0x24] = ("filled-new-array", "35c")
+    table[0x25] = ("filled-new-array/range", "3rc")
+    table[0x26] = ("fill-array-data", "31t")
+    table[0x27] = ("throw", "11x")
+    table[0x28] = ("goto", "10t")
+    table[0x29] = ("goto/16", "20t")
+    table[0x2a] = ("goto/32", "30t")
+    table[0x2b] = ("packed-switch", "31t")
+    table[0x2c] = ("sparse-switch", "31t")
+    put(0x2d, ["cmpl-float", "cmpg-float", "cmpl-double", "cmpg-double", "cmp-long"], "23x")
+    put(0x32, ["if-eq", "if-ne", "if-lt", "if-ge", "if-gt", "if-le"], "22t")
+    put(0x38, ["if-eqz", "if-nez", "if-ltz", "if-gez", "if-gtz", "if-lez"], "21t")
+
+    value_kinds = ["", "-wide", "-object", "-boolean", "-byte", "-char", "-short"]
+    put(0x44, ["aget" + kind for kind in value_kinds] + ["aput" + kind for kind in value_kinds], "23x")
+    put(0x52, ["iget" + kind for kind in value_kinds] + ["iput" + kind for kind in value_kinds], "22c")
+    put(0x60, ["sget" + kind for kind in value_kinds] + ["sput" + kind for kind in value_kinds], "21c")
+
+    invoke_kinds = ["invoke-virtual", "invoke-super", "invoke-direct", "invoke-static", "invoke-interface"]
+    put(0x6e, invoke_kinds, "35c")
+    put(0x74, [kind + "/range" for kind in invoke_kinds], "3rc")
+
+    put(0x7b, ["neg-int", "not-int", "neg-long", "not-long", "neg-float", "neg-double", "int-to-long",
+               "int-to-float", "int-to-double", "long-to-int", "long-to-float", "long-to-double", "float-to-int",
+               "float-to-long", "float-to-double", "double-to-int", "double-to-long", "double-to-float",
+               "int-to-byte", "int-to-char", "int-to-short"], "12x")
+
+    binary_operations = ["add-int", "sub-int", "mul-int", "div-int", "rem-int", "and-int", "or-int", "xor-int",
+                         "shl-int", "shr-int", "ushr-int",
+                         "add-long", "sub-long", "mul-long", "div-long", "rem-long", "and-long", "or-long",
+                         "xor-long", "shl-long", "shr-long", "ushr-long",
+                         "add-float", "sub-float", "mul-float", "div-float", "rem-float",
+                         "add-double", "sub-double", "mul-double", "div-double", "rem-double"]
+    put(0x90, binary_operations, "23x")
+    put(0xb0, [operation + "/2addr" for operation in binary_operations], "12x")
+    put(0xd0, ["add-int/lit16", "rsub-int", "mul-int/lit16", "div-int/lit16", "rem-int/lit16", "and-int/lit16",
+               "or-int/lit16", "xor-int/lit16"], "22s")
+    put(0xd8, ["add-int/lit8", "rsub-int/lit8", "mul-int/lit8", "div-int/lit8", "rem-int/lit8", "and-int/lit8",
+               "or-int/lit8", "xor-int/lit8", "shl-int/lit8", "shr-int/lit8", "ushr-int/lit8"], "22b")
+
+    table[0xfa] = ("invoke-polymorphic", "45cc")
+    table[0xfb] = ("invoke-polymorphic/range", "4rcc")
+    table[0xfc] = ("invoke-custom", "35c")
+    table[0xfd] = ("invoke-custom/range", "3rc")
+    table[0xfe] = ("const-method-handle", "21c")
+    table[0xff] = ("const-method-type", "21c")
+
+    return table
+
+
+opcodes = build_opcode_table()
+
+# Size of each instruction format in 16-bit code units
+format_sizes = {"10x": 1, "12x": 1, "11n": 1, "11x": 1, "10t": 1, "20t": 2, "22x": 2, "21t": 2, "21s": 2, "21h": 2,
+                "21c": 2, "23x": 2, "22b": 2, "22t": 2, "22s": 2, "22c": 2, "32x": 3, "30t": 3, "31t": 3, "31i": 3,
+                "31c": 3, "35c": 3, "3rc": 3, "45cc": 4, "4rcc": 4, "51l": 5}
+
+# Payload pseudo-instructions following the code of a method
+packed_switch_payload = 0x0100
+sparse_switch_payload = 0x0200
+fill_array_data_payload = 0x0300
+
+# Average number of characters of disassembled smali per code unit, used to estimate the size of a class
+code_unit_weight = 28
+
+access_flag_names = [(0x1, "public"), (0x2, "private"), (0x4, "protected"), (0x8, "static"), (0x10, "final"),
+                     (0x20, "synchronized"), (0x40, "bridge"), (0x80, "varargs"), (0x100, "native"),
+                     (0x400, "abstract"), (0x800, "strictfp"), (0x1000, "synthetic"), (0x10000, "constructor"),
+                     (0x20000, "declared-synchronized")]
+
+
+def read_uleb128(data, offset):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte & 0x80 == 0:
+            return result, offset
+        shift += 7
+
+
+def read_sleb128(data, offset):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if byte & 0x80 == 0:
+            if byte & 0x40:
+                result -= 1 << shift
+            return result, offset
+
+
+def signed(value, bits):
+    if value & (1 << (bits - 1)):
+        return value - (1 << bits)
+    return value
+
+
+def format_literal(value):
+    if value < 0:
+        return "-0x%x" % -value
+    return "0x%x" % value
+
+
+def escape_string(text):
+    escaped = list()
+    for character in text:
+        if character in "\"'\\":
+            escaped.append("\\" + character)
+        elif character == "\n":
+            escaped.append("\\n")
+        elif character == "\t":
+            escaped.append("\\t")
+        elif character == "\r":
+            escaped.append("\\r")
+        elif ord(character) < 0x20 or ord(character) > 0x7E:
+            escaped.append("\\u%04x" % (ord(character) & 0xFFFF))
+        else:
+            escaped.append(character)
+    return "".join(escaped)
+
+
+def format_access_flags(access_flags):
+    return " ".join(name for flag, name in access_flag_names if access_flags & flag)
+
+
+class DexFile:
+    """
+    Reader for a single dex file, decoding its tables on demand.
+    """
+
+    def __init__(self, data):
+        """
+        :param data: the bytes or a memoryview of the dex file
+        """
+        self.data = data
+        (self.__string_ids_size, self.__string_ids_offset, self.__type_ids_size, self.__type_ids_offset,
+         self.__proto_ids_size, self.__proto_ids_offset, self.__field_ids_size, self.__field_ids_offset,
+         self.__method_ids_size, self.__method_ids_offset, class_defs_size, class_defs_offset) = \
+            struct.unpack_from("<12I", data, 0x38)
+
+        self.__strings = dict()
+
+        self.class_defs = dict()
+        for index in range(class_defs_size):
+            class_def_offset = class_defs_offset + index * 32
+            type_index = struct.unpack_from("<I", data, class_def_offset)[0]
+            self.class_defs[self.get_type(type_index)] = class_def_offset
+
+    def get_string(self, index):
+        string = self.__strings.get(index, None)
+        if string is None:
+            offset = struct.unpack_from("<I", self.data, self.__string_ids_offset + index * 4)[0]
+            _, offset = read_uleb128(self.data, offset)
+            end = offset
+            while self.data[end] != 0:
+                end += 1
+            # Modified utf-8 encodes the null character on two bytes
+            raw = bytes(self.data[offset:end]).replace(b"\xc0\x80", b"\x00")
+            string = raw.decode("utf-8", errors="surrogatepass").encode("utf-16", "surrogatepass").decode("utf-16")
+            self.__strings[index] = string
+        return string
+
+    def get_type(self, index):
+        string_index = struct.unpack_from("<I", self.data, self.__type_ids_offset + index * 4)[0]
+        return self.get_string(string_index)
+
+    def get_type_list(self, offset):
+        if offset == 0:
+            return []
+        size = struct.unpack_from("<I", self.data, offset)[0]
+        return [self.get_type(type_index) for type_index in struct.unpack_from("<%dH" % size, self.data, offset + 4)]
+
+    def get_proto(self, index):
+        """
+        :return: the prototype descriptor, e.g. "(ILjava/lang/String;)V"
+        """
+        _, return_type_index, parameters_offset = struct.unpack_from("<III", self.data,
+                                                                     self.__proto_ids_offset + index * 12)
+        return "(" + "".join(self.get_type_list(parameters_offset)) + ")" + self.get_type(return_type_index)
+
+    def get_method(self, index):
+        """
+        :return: a tuple of the class descriptor, the method name and the prototype descriptor
+        """
+        class_index, proto_index, name_index = struct.unpack_from("<HHI", self.data,
+                                                                  self.__method_ids_offset + index * 8)
+        return self.get_type(class_index), self.get_string(name_index), self.get_proto(proto_index)
+
+    def get_field(self, index):
+        class_index, type_index, name_index = struct.unpack_from("<HHI", self.data,
+                                                                 self.__field_ids_offset + index * 8)
+        return self.get_type(class_index) + "->" + self.get_string(name_index) + ":" + self.get_type(type_index)
+
+    def get_reference(self, opcode_name, index):
+        """
+        Formats the constant pool item an instruction refers to.
+        """
+        if opcode_name.startswith("const-string"):
+            return "\"" + escape_string(self.get_string(index)) + "\""
+        if opcode_name.startswith("invoke-custom"):
+            # The index is the one of a call site, rendered unresolved like baksmali does for a bare call site
+            return "call_site_%d" % index
+        if opcode_name.startswith("invoke"):
+            class_descriptor, method_name, proto = self.get_method(index)
+            return class_descriptor + "->" + method_name + proto
+        if opcode_name[1:4] in ("get", "put"):
+            return self.get_field(index)
+        if opcode_name in ("const-method-handle", "const-method-type"):
+            return "0x%x" % index
+        return self.get_type(index)
+
+
+class DexClassHandler:
+    """
+    Counterpart of SmaliHandler for a class read from a dex file. The methods are disassembled into the same
+    smali lines apktool writes, so that the analysis treats both backends alike.
+    """
+
+    def __init__(self, dex_file: DexFile, class_def_offset):
+        self.__dex = dex_file
+        data = dex_file.data
+
+        class_index = struct.unpack_from("<I", data, class_def_offset)[0]
+        class_data_offset = struct.unpack_from("<I", data, class_def_offset + 24)[0]
+
+        self.canonical_name = dex_file.get_type(class_index)[1:-1].replace("/", ".")
+        # The bytecode refers to the tables of its dex file, so it does not identify the class across apps
+        self.content_hash = None
+        locations = {}
+
+        # Approximate memory footprint, used to bound the class handler cache. The methods are only disassembled when
+        # accessed, so the size is estimated from the number of code units of each method.
+        self.size = 0
+
+        if class_data_offset != 0:
+            offset = class_data_offset
+            static_fields_size, offset = read_uleb128(data, offset)
+            instance_fields_size, offset = read_uleb128(data, offset)
+            direct_methods_size, offset = read_uleb128(data, offset)
+            virtual_methods_size, offset = read_uleb128(data, offset)
+
+            for _ in range((static_fields_size + instance_fields_size) * 2):
+                _, offset = read_uleb128(data, offset)
+
+            for methods_size in (direct_methods_size, virtual_methods_size):
+                method_index = 0
+                for _ in range(methods_size):
+                    method_index_diff, offset = read_uleb128(data, offset)
+                    access_flags, offset = read_uleb128(data, offset)
+                    code_offset, offset = read_uleb128(data, offset)
+                    method_index += method_index_diff
+
+                    _, method_name, proto = dex_file.get_method(method_index)
+                    signature = method_name + proto
+                    flags = format_access_flags(access_flags)
+                    if len(flags) > 0:
+                        signature = flags + " " + signature
+
+                    locations[signature] = code_offset
+                    if code_offset != 0:
+                        self.size += struct.unpack_from("<I", data, code_offset + 12)[0] * code_unit_weight
+
+        self.methods = MethodBodies(locations, self.__decode_body)
+        self.invoked_methods = InvokedMethods(self.methods)
+
+    def __decode_body(self, code_offset):
+        if code_offset == 0:
+            return []
+        return self.__disassemble(code_offset)
+
+    def get_invoked_methods(self):
+        return self.invoked_methods
+
+    def get_methods(self):
+        return self.methods
+
+    def get_method(self, method_name):
+        """
+        Returns the lines/content of the method given the method name, see SmaliHandler.get_method.
+        """
+        method_signature = self.methods.find_signature(method_name)
+        if method_signature is None:
+            return None
+        return self.methods[method_signature]
+
+    def __disassemble(self, code_offset):
+        data = self.__dex.data
+        registers_size, ins_size, _, tries_size, _, insns_size = struct.unpack_from("<HHHHII", data, code_offset)
+        code = struct.unpack_from("<%dH" % insns_size, data, code_offset + 16)
+        first_parameter = registers_size - ins_size
+
+        def register(number):
+            if number >= first_parameter:
+                return "p" + str(number - first_parameter)
+            return "v" + str(number)
+
+        # First pass: split the code in instructions and collect the branch targets
+        instructions = list()
+        targets = dict()
+        payload_kinds = dict()
+        address = 0
+        while address < insns_size:
+            unit = code[address]
+            if unit in (packed_switch_payload, sparse_switch_payload, fill_array_data_payload):
+                if unit == packed_switch_payload:
+                    size = code[address + 1] * 2 + 4
+                elif unit == sparse_switch_payload:
+                    size = code[address + 1] * 4 + 2
+                else:
+                    element_width = code[address + 1]
+                    element_count = code[address + 2] | (code[address + 3] << 16)
+                    size = (element_width * element_count + 1) // 2 + 4
+                instructions.append((address, None, None))
+                address += size
+                continue
+
+            name, instruction_format = opcodes[unit & 0xFF]
+            size = format_sizes[instruction_format]
+            if address + size > insns_size:
+                break
+            instructions.append((address, name, instruction_format))
+
+            if instruction_format in ("10t", "20t", "30t"):
+                targets.setdefault(address + self.__branch_offset(code, address, instruction_format), set()).add(
+                    "goto")
+            elif instruction_format in ("21t", "22t"):
+                targets.setdefault(address + signed(code[address + 1], 16), set()).add("cond")
+            elif instruction_format == "31t":
+                payload_address = address + signed(code[address + 1] | (code[address + 2] << 16), 32)
+                if name == "packed-switch":
+                    kind = "pswitch"
+                    payload_kinds[payload_address] = ("pswitch_data", address)
+                elif name == "sparse-switch":
+                    kind = "sswitch"
+                    payload_kinds[payload_address] = ("sswitch_data", address)
+                else:
+                    kind = None
+                    payload_kinds[payload_address] = ("array", address)
+
+                targets.setdefault(payload_address, set()).add(payload_kinds[payload_address][0])
+                if kind is not None and 0 <= payload_address < insns_size:
+                    for case_address in self.__switch_targets(code, payload_address, address):
+                        targets.setdefault(case_address, set()).add(kind)
+
+            address += size
+
+        # The try blocks and their handlers
+        catches = dict()
+        if tries_size != 0:
+            tries_offset = code_offset + 16 + insns_size * 2
+            if insns_size % 2 == 1:
+                tries_offset += 2
+            handlers_offset = tries_offset + tries_size * 8
+            for index in range(tries_size):
+                start_address, instruction_count, handler_offset = struct.unpack_from("<IHH", data,
+                                                                                      tries_offset + index * 8)
+                targets.setdefault(start_address, set()).add("try_start")
+                targets.setdefault(start_address + instruction_count, set()).add("try_end")
+
+                offset = handlers_offset + handler_offset
+                size, offset = read_sleb128(data, offset)
+                handlers = list()
+                for _ in range(abs(size)):
+                    type_index, offset = read_uleb128(data, offset)
+                    handler_address, offset = read_uleb128(data, offset)
+                    handlers.append((self.__dex.get_type(type_index), handler_address, "catch"))
+                    targets.setdefault(handler_address, set()).add("catch")
+                if size <= 0:
+                    handler_address, offset = read_uleb128(data, offset)
+                    handlers.append((None, handler_address, "catchall"))
+                    targets.setdefault(handler_address, set()).add("catchall")
+                catches[start_address + instruction_count] = catches.get(start_address + instruction_count, [])
+                catches[start_address + instruction_count].append((start_address, handlers))
+
+        # Labels are numbered per kind in address order, like baksmali does
+        labels = dict()
+        counters = dict()
+        for target_address in sorted(targets.keys()):
+            for kind in ("try_end", "goto", "cond", "pswitch", "sswitch", "catch", "catchall", "try_start",
+                         "pswitch_data", "sswitch_data", "array"):
+                if kind in targets[target_address]:
+                    counter = counters.get(kind, 0)
+                    counters[kind] = counter + 1
+                    labels.setdefault(target_address, []).append((kind, ":" + kind + "_" + str(counter)))
+
+        def label(target_address, kind):
+            for label_kind, name in labels.get(target_address, []):
+                if label_kind == kind:
+                    return name
+            return ":" + kind + "_" + format_literal(target_address)
+
+        # Second pass: render the instructions
+        lines = list()
+
+        def render_labels(label_address):
+            for _, label_name in labels.get(label_address, []):
+                lines.append(label_name)
+
+            for (start_address, handlers) in catches.get(label_address, []):
+                for exception_type, handler_address, handler_kind in handlers:
+                    directive = ".catch " + exception_type if exception_type is not None else ".catchall"
+                    lines.append(directive + " {" + label(start_address, "try_start") + " .. " +
+                                 label(label_address, "try_end") + "} " + label(handler_address, handler_kind))
+
+        for instruction_address, name, instruction_format in instructions:
+            render_labels(instruction_address)
+
+            if name is None:
+                lines.extend(self.__render_payload(code, instruction_address, payload_kinds, label))
+                continue
+
+            lines.append(self.__render_instruction(code, instruction_address, name, instruction_format, register,
+                                                   label))
+
+        # A try block can end with the code of the method
+        render_labels(insns_size)
+
+        return lines
+
+    @staticmethod
+    def __branch_offset(code, address, instruction_format):
+        if instruction_format == "10t":
+            return signed(code[address] >> 8, 8)
+        if instruction_format == "20t":
+            return signed(code[address + 1], 16)
+        return signed(code[address + 1] | (code[address + 2] << 16), 32)
+
+    @staticmethod
+    def __switch_targets(code, payload_address, switch_address):
+        size = code[payload_address + 1]
+        if code[payload_address] == packed_switch_payload:
+            first = payload_address + 4
+        else:
+            first = payload_address + 2 + size * 2
+        return [switch_address + signed(code[first + index * 2] | (code[first + index * 2 + 1] << 16), 32)
+                for index in range(size)]
+
+    def __render_payload(self, code, address, payload_kinds, label):
+        kind, switch_address = payload_kinds.get(address, (None, None))
+        unit = code[address]
+        size = code[address + 1]
+
+        if unit == packed_switch_payload and kind == "pswitch_data":
+            first_key = signed(code[address + 2] | (code[address + 3] << 16), 32)
+            lines = [".packed-switch " + format_literal(first_key)]
+            for case_address in self.__switch_targets(code, address, switch_address):
+                lines.append(label(case_address, "pswitch"))
+            lines.append(".end packed-switch")
+            return lines
+
+        if unit == sparse_switch_payload and kind == "sswitch_data":
+            lines = [".sparse-switch"]
+            case_addresses = self.__switch_targets(code, address, switch_address)
+            for index in range(size):
+                key = signed(code[address + 2 + index * 2] | (code[address + 3 + index * 2] << 16), 32)
+                lines.append(format_literal(key) + " -> " + label(case_addresses[index], "sswitch"))
+            lines.append(".end sparse-switch")
+            return lines
+
+        if unit == fill_array_data_payload:
+            return [".array-data " + str(size), ".end array-data"]
+
+        return []
+
+    def __render_instruction(self, code, address, name, instruction_format, register, label):
+        unit = code[address]
+        high = unit >> 8
+
+        if instruction_format == "10x":
+            return name
+        if instruction_format == "12x":
+            return name + " " + register(high & 0xF) + ", " + register(high >> 4)
+        if instruction_format == "11n":
+            return name + " " + register(high & 0xF) + ", " + format_literal(signed(high >> 4, 4))
+        if instruction_format == "11x":
+            return name + " " + register(high)
+        if instruction_format in ("10t", "20t", "30t"):
+            return name + " " + label(address + self.__branch_offset(code, address, instruction_format), "goto")
+        if instruction_format == "22x":
+            return name + " " + register(high) + ", " + register(code[address + 1])
+        if instruction_format == "21t":
+            return name + " " + register(high) + ", " + label(address + signed(code[address + 1], 16), "cond")
+        if instruction_format == "21s":
+            return name + " " + register(high) + ", " + format_literal(signed(code[address + 1], 16))
+        if instruction_format == "21h":
+            shift = 48 if name == "const-wide/high16" else 16
+            return name + " " + register(high) + ", " + format_literal(signed(code[address + 1], 16) << shift)
+        if instruction_format == "21c":
+            return name + " " + register(high) + ", " + self.__dex.get_reference(name, code[address + 1])
+        if instruction_format == "23x":
+            return name + " " + register(high) + ", " + register(code[address + 1] & 0xFF) + ", " + \
+                register(code[address + 1] >> 8)
+        if instruction_format == "22b":
+            return name + " " + register(high) + ", " + register(code[address + 1] & 0xFF) + ", " + \
+                format_literal(signed(code[address + 1] >> 8, 8))
+        if instruction_format == "22t":
+            return name + " " + register(high & 0xF) + ", " + register(high >> 4) + ", " + \
+                label(address + signed(code[address + 1], 16), "cond")
+        if instruction_format == "22s":
+            return name + " " + register(high & 0xF) + ", " + register(high >> 4) + ", " + \
+                format_literal(signed(code[address + 1], 16))
+        if instruction_format == "22c":
+            return name + " " + register(high & 0xF) + ", " + register(high >> 4) + ", " + \
+                self.__dex.get_reference(name, code[address + 1])
+        if instruction_format == "32x":
+            return name + " " + register(code[address + 1]) + ", " + register(code[address + 2])
+        if instruction_format in ("31i", "31c"):
+            value = code[address + 1] | (code[address + 2] << 16)
+            if instruction_format == "31c":
+                return name + " " + register(high) + ", " + self.__dex.get_reference(name, value)
+            return name + " " + register(high) + ", " + format_literal(signed(value, 32))
+        if instruction_format == "31t":
+            payload_address = address + signed(code[address + 1] | (code[address + 2] << 16), 32)
+            kind = {"packed-switch": "pswitch_data", "sparse-switch": "sswitch_data"}.get(name, "array")
+            return name + " " + register(high) + ", " + label(payload_address, kind)
+        if instruction_format == "51l":
+            value = code[address + 1] | (code[address + 2] << 16) | (code[address + 3] << 32) | \
+                (code[address + 4] << 48)
+            return name + " " + register(high) + ", " + format_literal(signed(value, 64))
+        if instruction_format in ("35c", "45cc"):
+            count = high >> 4
+            arguments = code[address + 2]
+            numbers = [arguments & 0xF, (arguments >> 4) & 0xF, (arguments >> 8) & 0xF, arguments >> 12, high & 0xF]
+            registers = ", ".join(register(number) for number in numbers[:count])
+            return name + " {" + registers + "}, " + self.__dex.get_reference(name, code[address + 1])
+        if instruction_format in ("3rc", "4rcc"):
+            first = code[address + 2]
+            if high == 0:
+                registers = ""
+            elif high == 1:
+                registers = register(first)
+            else:
+                registers = register(first) + " .. " + register(first + high - 1)
+            return name + " {" + registers + "}, " + self.__dex.get_reference(name, code[address + 1])
+
+        return name
+
+
+class DexReader:
+    """
+    Reads the classes of an apk straight from its classes*.dex files. Dex files stored uncompressed are memory-mapped,
+    compressed ones are inflated in memory.
+    """
+
+    def __init__(self, apk_path):
+        self.__apk_file = open(apk_path, "rb")
+        self.__mmap = None
+        self.__view = None
+        self.__dex_files = list()
+
+        with zipfile.ZipFile(self.__apk_file) as apk:
+            entries = list()
+            for info in apk.infolist():
+                match = dex_file_name_pattern.match(info.filename)
+                if match is not None:
+                    entries.append((int(match.group(1) or 1), info))
+            entries.sort(key=lambda x: x[0])
+
+            for _, info in entries:
+                if info.compress_type == zipfile.ZIP_STORED:
+                    if self.__mmap is None:
+                        self.__mmap = mmap.mmap(self.__apk_file.fileno(), 0, access=mmap.ACCESS_READ)
+                        self.__view = memoryview(self.__mmap)
+                    # The data follows the local file header, whose name and extra field lengths may differ from the
+                    # central directory
+                    name_length, extra_length = struct.unpack_from("<HH", self.__mmap, info.header_offset + 26)
+                    start = info.header_offset + 30 + name_length + extra_length
+                    data = self.__view[start:start + info.file_size]
+                else:
+                    data = apk.read(info)
+                self.__dex_files.append(DexFile(data))
+
+    def get_class_handler(self, canonical_name):
+        """
+        :return: the handler of the class with the given canonical name or None if the apk does not define it
+        """
+        descriptor = "L" + canonical_name.replace(".", "/") + ";"
+        for dex_file in self.__dex_files:
+            class_def_offset = dex_file.class_defs.get(descriptor, None)
+            if class_def_offset is not None:
+                return DexClassHandler(dex_file, class_def_offset)
+        return None
+
+    def get_class_names(self):
+        names = list()
+        for dex_file in self.__dex_files:
+            names.extend(descriptor[1:-1].replace("/", ".") for descriptor in dex_file.class_defs.keys())
+        return names
+
+    def close(self):
+        for dex_file in self.__dex_files:
+            if isinstance(dex_file.data, memoryview):
+                dex_file.data.release()
+        self.__dex_files = list()
+
+        if self.__mmap is not None:
+            self.__view.release()
+            self.__mmap.close()
+        self.__apk_file.close()
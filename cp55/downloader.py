@@ -0,0 +1,71 @@
+import json
+import os
+import socket
+
+downloaded_status = "downloaded"
+
+default_timeout = 600.0
+
+
+def parse_address(address):
+    """
+    :param address: HOST:PORT, or PORT for the local host
+    :return: the tuple of the host and the port
+    """
+    host, _, port = address.rpartition(":")
+    return host if host != "" else "127.0.0.1", int(port)
+
+
+class DownloaderClient:
+    """
+    Client of downloader_server.py, the long-lived downloader that keeps its PlayStore session across the apps rather
+    than starting a container and logging in for each of them. The server limits the number of concurrent downloads
+    across all its clients, so the client can be shared by the threads and processes of a sweep.
+    """
+
+    def __init__(self, address, download_directory, timeout=default_timeout):
+        """
+        :param address: the HOST:PORT of the server
+        :param download_directory: the directory the server downloads to, as seen by the client
+        :param timeout: the maximum number of seconds without news from the server
+        """
+        self.address = parse_address(address)
+        self.download_directory = download_directory
+        self.timeout = timeout
+
+    def download(self, package_names):
+        """
+        Has the server download a batch of apps, named <package>.apk in the download directory.
+
+        :return: the results of the downloads, in the order they finish: dicts of the package, its status, "downloaded"
+                 or "failed", and either the path of the apk, its size and the duration of the download, or the error
+        :raises: OSError If the server cannot be reached or stops answering, ValueError If its answer is malformed.
+        """
+        package_names = list(package_names)
+        if len(package_names) == 0:
+            return
+
+        with socket.create_connection(self.address, timeout=self.timeout) as connection:
+            connection.sendall((json.dumps({"packages": package_names}) + "\n").encode())
+            with connection.makefile("r") as answer:
+                for _ in package_names:
+                    line = answer.readline()
+                    if line == "":
+                        raise ConnectionError("The downloader closed the connection")
+
+                    result = json.loads(line)
+                    if "package" not in result:
+                        raise ValueError("The downloader rejected the request: " + str(result.get("error", line)))
+                    if result["status"] == downloaded_status:
+                        result["path"] = os.path.join(self.download_directory, result.pop("file"))
+                    yield result
+
+    def download_apk(self, package_name):
+        """
+        :return: the path of the downloaded apk
+        :raises: Exception If the download failed.
+        """
+        result = list(self.download([package_name]))[0]
+        if result["status"] != downloaded_status:
+            raise Exception(result.get("error", "unknown error"))
+        return result["path"]
@@ -0,0 +1,124 @@
+import json
+
+wildcard = "*"
+
+
+class PackageNode:
+    """
+    Node of the package trie of FilterMatcher, one per package name segment.
+    """
+
+    __slots__ = ("children", "any_class", "any_method", "methods")
+
+    def __init__(self):
+        self.children = dict()
+        # Whether the wildcard rules ending at this package match any class, any method, or the given methods
+        self.any_class = False
+        self.any_method = False
+        self.methods = set()
+
+
+class FilterMatcher:
+    """
+    Compiled form of the object and method filters of filter.json.
+
+    Exact names are looked up in hash sets. The rules with wildcards are stored in a trie of package name segments, so
+    that a class is matched against all of them in a single walk down its package. The supported rules are:
+    - object filters: "a.b.C" for a class, "a.b.*" for any class of the package a.b or of its subpackages
+    - method filters: "a.b.C:m" for a method, "a.b.C:*" for any method of a class, "a.b.*:m" and "a.b.*:*" for a
+      method or any method of any class of a package or of its subpackages
+    """
+
+    def __init__(self, inspection_filter):
+        self.classes = set()
+        self.methods = set()
+        self.any_method_classes = set()
+        self.root = PackageNode()
+
+        if inspection_filter is None:
+            return
+
+        for object_filter in inspection_filter.get("object_filters", []):
+            if object_filter.endswith("." + wildcard):
+                self.__add_package(object_filter[:-2]).any_class = True
+            else:
+                self.classes.add(object_filter)
+
+        for method_filter in inspection_filter.get("method_filters", []):
+            class_name, _, method_name = method_filter.rpartition(":")
+            if class_name.endswith("." + wildcard):
+                node = self.__add_package(class_name[:-2])
+                if method_name == wildcard:
+                    node.any_method = True
+                else:
+                    node.methods.add(method_name)
+            elif method_name == wildcard:
+                self.any_method_classes.add(class_name)
+            else:
+                self.methods.add(method_filter)
+
+    def __add_package(self, package_name):
+        node = self.root
+        for segment in package_name.split("."):
+            child = node.children.get(segment, None)
+            if child is None:
+                child = PackageNode()
+                node.children[segment] = child
+            node = child
+        return node
+
+    def match(self, class_name, method_name):
+        """
+        Matches an invocation against all the rules.
+
+        :return: the list of the matches of the invocation, i.e. the class name if it matches an object filter and
+                 "class name:method name" if the method matches a method filter
+        """
+        matches = list()
+        method = class_name + ":" + method_name
+
+        class_matches = class_name in self.classes
+        method_matches = method in self.methods or class_name in self.any_method_classes
+
+        # Walk down the packages enclosing the class, the last segment being the class itself
+        node = self.root
+        segments = class_name.split(".")
+        for segment in segments[:-1]:
+            node = node.children.get(segment, None)
+            if node is None:
+                break
+            class_matches = class_matches or node.any_class
+            method_matches = method_matches or node.any_method or method_name in node.methods
+
+        if class_matches:
+            matches.append(class_name)
+        if method_matches:
+            matches.append(method)
+        return matches
+
+
+def format_filter_matches(matches):
+    """
+    :param matches: the set of the matches of the invocations of a component
+    :return: the matches as the json list stored in components.filter_matches
+    """
+    if len(matches) == 0:
+        return "[]"
+    return json.dumps(list(matches))
+
+
+compiled_filter = (None, None)
+
+
+def compile_filter(inspection_filter):
+    """
+    Returns the FilterMatcher of the given filter. The last compiled filter is kept, so that a run compiles its filter
+    once rather than for every apk.
+    """
+    global compiled_filter
+
+    source, matcher = compiled_filter
+    if source is not inspection_filter:
+        matcher = FilterMatcher(inspection_filter)
+        compiled_filter = (inspection_filter, matcher)
+    return matcher
@@ -0,0 +1,105 @@
+import gzip
+import json
+import os
+
+from cp55.filter_matcher import format_filter_matches
+
+artifact_version = 1
+artifact_extension = ".json.gz"
+
+
+def get_artifact_path(directory, package_name):
+    return os.path.join(directory, package_name + artifact_extension)
+
+
+def save_artifact(path, component_invocations, class_hashes=None):
+    """
+    Saves the invocations reachable from each inspected component of an app, so that a new filter can be matched
+    against them without decoding the app again, see match_artifact, and so that the components of a new version of
+    the app whose classes did not change can be carried forward, see ComponentInspector.
+
+    The artifact is a gzipped json document. The invocations reached by the components are numbered in a table of
+    (class index, method index) pairs over the lists of the class and method names, and the invocations of each
+    component are stored as the sorted differences between consecutive invocation numbers, which compress well.
+
+    :param component_invocations: list of tuples of the name, the type and the set of the (class name, method name)
+                                  invocations of each inspected component
+    :param class_hashes: dict mapping the names of the classes of the app the components depend on to the hashes of
+                         their content
+    """
+    invocation_numbers = dict()
+    for invocation in sorted(set().union(*[invocations for _, _, invocations in component_invocations])):
+        invocation_numbers[invocation] = len(invocation_numbers)
+
+    class_indexes = dict()
+    method_indexes = dict()
+    invocation_table = list()
+    for class_name, method_name in invocation_numbers.keys():
+        class_index = class_indexes.setdefault(class_name, len(class_indexes))
+        method_index = method_indexes.setdefault(method_name, len(method_indexes))
+        invocation_table.extend((class_index, method_index))
+
+    components = list()
+    for name, component_type, invocations in component_invocations:
+        numbers = sorted(invocation_numbers[invocation] for invocation in invocations)
+        deltas = [number - previous for number, previous in zip(numbers, [0] + numbers[:-1])]
+        components.append({"name": name, "type": component_type, "invocations": deltas})
+
+    artifact = {"version": artifact_version, "classes": list(class_indexes.keys()),
+                "methods": list(method_indexes.keys()), "invocations": invocation_table, "components": components,
+                "class_hashes": class_hashes if class_hashes is not None else dict()}
+
+    temporary_path = path + "." + str(os.getpid()) + ".tmp"
+    with gzip.open(temporary_path, "wt") as artifact_file:
+        json.dump(artifact, artifact_file, separators=(",", ":"))
+    os.replace(temporary_path, path)
+
+
+def load_artifact(path):
+    """
+    :return: a tuple of the list of the (class name, method name) invocations of the app, the list of the
+             (name, type, invocation indexes) of its components and the dict of the hashes of its classes
+    :raises: ValueError If the artifact was saved by another version of the analyser.
+    """
+    with gzip.open(path, "rt") as artifact_file:
+        artifact = json.load(artifact_file)
+
+    if artifact.get("version", None) != artifact_version:
+        raise ValueError("Unsupported artifact version in " + path)
+
+    classes = artifact["classes"]
+    methods = artifact["methods"]
+    table = artifact["invocations"]
+    invocations = [(classes[table[index]], methods[table[index + 1]]) for index in range(0, len(table), 2)]
+
+    components = list()
+    for component in artifact["components"]:
+        indexes = list()
+        number = 0
+        for delta in component["invocations"]:
+            number += delta
+            indexes.append(number)
+        components.append((component["name"], component["type"], indexes))
+
+    return invocations, components, artifact.get("class_hashes", dict())
+
+
+def match_artifact(path, filter_matcher):
+    """
+    Matches the invocations of the components of an app against a filter, as ComponentInspector would.
+
+    :param filter_matcher: the FilterMatcher of the filter
+    :return: a list of tuples of the name, the type and the filter matches of each component
+    """
+    invocations, components, _ = load_artifact(path)
+
+    invocation_matches = dict()
+    results = list()
+    for name, component_type, indexes in components:
+        matches = set()
+        for index in indexes:
+            if index not in invocation_matches:
+                invocation_matches[index] = filter_matcher.match(*invocations[index])
+            matches.update(invocation_matches[index])
+        results.append((name, component_type, format_filter_matches(matches)))
+    return results
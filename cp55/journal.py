@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+
+retry_statuses = {"failed", "download_failed", "timeout", "partial"}
+
+
+class Journal:
+    """
+    Append-only record of the outcome of every package of a sweep, used to resume a sweep after a crash.
+
+    Each outcome is a json line that is flushed to disk before record returns. When a package appears several times,
+    the last line wins. A line cut short by a crash is ignored when the journal is loaded.
+    """
+
+    def __init__(self, path):
+        self.__statuses = dict()
+
+        if os.path.exists(path):
+            with open(path, "r") as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.__statuses[entry["package"]] = entry["status"]
+
+        self.__file = open(path, "a")
+        self.__lock = threading.Lock()
+
+        # Terminates a line cut short by a crash, so that it does not swallow the next record
+        if self.__file.tell() > 0:
+            with open(path, "rb") as journal_file:
+                journal_file.seek(-1, os.SEEK_END)
+                if journal_file.read(1) != b"\n":
+                    self.__file.write("\n")
+
+    def get_status(self, package_name):
+        return self.__statuses.get(package_name, None)
+
+    def record(self, package_name, status):
+        line = json.dumps({"package": package_name, "status": status}) + "\n"
+
+        with self.__lock:
+            self.__statuses[package_name] = status
+            self.__file.write(line)
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+
+    def close(self):
+        self.__file.close()
+
+
+def select_packages(packages, journal, db, retry_failed=False, reanalyse=False):
+    """
+    Returns the packages that still have to be analysed. The status of a package is taken from the journal or, for
+    packages the journal does not know, from the database.
+
+    :param retry_failed: whether the packages whose analysis or download failed, or ran out of budget, are analysed
+                         again
+    :param reanalyse: whether the packages already stored in the database are analysed again, e.g. by an incremental
+                      sweep over new versions of the apps; only the packages of the journal are skipped then
+    """
+    selected = list()
+    for package_name in packages:
+        status = journal.get_status(package_name)
+        if status is None and not reanalyse:
+            status = db.get_app_analysis_status(package_name)
+
+        if status is None or (retry_failed and status in retry_statuses):
+            selected.append(package_name)
+
+    return selected
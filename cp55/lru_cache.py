@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+
+class LruCache:
+    """
+    Least recently used cache bounded by the total weight of its values rather than by their number.
+    """
+
+    def __init__(self, max_weight, weigher=len):
+        """
+        :param max_weight: the maximum total weight of the cached values
+        :param weigher: returns the weight of a value, e.g. its approximate size in bytes
+        """
+        self.__max_weight = max_weight
+        self.__weigher = weigher
+        self.__entries = OrderedDict()
+        self.__weight = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        :return: the cached value or None if the key is not in the cache
+        """
+        entry = self.__entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.__entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        weight = self.__weigher(value)
+        if weight > self.__max_weight:
+            return
+
+        old_entry = self.__entries.pop(key, None)
+        if old_entry is not None:
+            self.__weight -= old_entry[1]
+
+        self.__entries[key] = (value, weight)
+        self.__weight += weight
+
+        while self.__weight > self.__max_weight:
+            _, (_, evicted_weight) = self.__entries.popitem(last=False)
+            self.__weight -= evicted_weight
+            self.evictions += 1
+
+    def clear(self):
+        self.__entries.clear()
+        self.__weight = 0
+
+    def get_statistics(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.__entries),
+                "weight": self.__weight}
@@ -1,11 +1,33 @@
-from untangle import Element
+from cp55.axml_parser import android_namespace
 
 
 def prepend_android(text):
-    return "android:" + text
+    """
+    :return: the qualified name of an android attribute, as found in the attributes of a parsed xml element
+    """
+    return "{" + android_namespace + "}" + text
+
+
+authorities_attribute = prepend_android("authorities")
+direct_boot_aware_attribute = prepend_android("directBootAware")
+enabled_attribute = prepend_android("enabled")
+exported_attribute = prepend_android("exported")
+foreground_service_type_attribute = prepend_android("foregroundServiceType")
+grant_uri_permission_attribute = prepend_android("grantUriPermission")
+name_attribute = prepend_android("name")
+permission_attribute = prepend_android("permission")
+read_permission_attribute = prepend_android("readPermission")
+write_permission_attribute = prepend_android("writePermission")
 
 
 class ManifestElement:
+    """
+    A component or permission declared in the manifest. Only the attributes used by the analysis are read, from the
+    dict of the attributes of the xml element.
+    """
+
+    __slots__ = ("name", "permission", "foreground_service_type", "grant_uri_permission", "authorities",
+                 "read_permission", "write_permission", "enabled", "exported", "direct_boot_aware")
 
     def __init__(self):
         self.name = ""
@@ -36,119 +58,79 @@ class ManifestElement:
             self.direct_boot_aware = True
 
     def __str__(self):
-        properties = list(filter(lambda x: x[1] is not None, vars(self).items()))
+        properties = [(slot, getattr(self, slot)) for slot in ManifestElement.__slots__
+                      if getattr(self, slot) is not None]
         return "{" + ','.join("\n    %s: %s" % item for item in properties) + "\n}"
 
 
 class Activity(ManifestElement):
+    __slots__ = ()
 
-    def __init__(self, xml_element: Element):
+    def __init__(self, attributes):
         super().__init__()
-        self.allow_embedded = xml_element.get_attribute(prepend_android("allowEmbedded"))
-        self.allow_task_reparenting = xml_element.get_attribute(prepend_android("allowTaskReparenting"))
-        self.always_retain_task_state = xml_element.get_attribute(prepend_android("alwaysRetainTaskState"))
-        self.auto_remove_from_recents = xml_element.get_attribute(prepend_android("autoRemoveFromRecents"))
-        self.banner = xml_element.get_attribute(prepend_android("banner"))
-        self.clear_task_on_launch = xml_element.get_attribute(prepend_android("clearTaskOnLaunch"))
-        self.color_mode = xml_element.get_attribute(prepend_android("colorMode"))
-        self.config_changes = xml_element.get_attribute(prepend_android("configChanges"))
-        self.direct_boot_aware = xml_element.get_attribute(prepend_android("directBootAware"))
-        self.document_launch_mode = xml_element.get_attribute(prepend_android("documentLaunchMode"))
-        self.enabled = xml_element.get_attribute(prepend_android("enabled"))
-        self.exclude_from_recents = xml_element.get_attribute(prepend_android("excludeFromRecents"))
-        self.exported = xml_element.get_attribute(prepend_android("exported"))
-        self.finish_on_task_launch = xml_element.get_attribute(prepend_android("finishOnTaskLaunch"))
-        self.hardware_accelerated = xml_element.get_attribute(prepend_android("hardwareAccelerated"))
-        self.icon = xml_element.get_attribute(prepend_android("icon"))
-        self.immersive = xml_element.get_attribute(prepend_android("immersive"))
-        self.label = xml_element.get_attribute(prepend_android("label"))
-        self.launch_mode = xml_element.get_attribute(prepend_android("launchMode"))
-        self.lock_task_mode = xml_element.get_attribute(prepend_android("lockTaskMode"))
-        self.max_recents = xml_element.get_attribute(prepend_android("maxRecents"))
-        self.max_aspect_ratio = xml_element.get_attribute(prepend_android("maxAspectRatio"))
-        self.multiprocess = xml_element.get_attribute(prepend_android("multiprocess"))
-        self.name = xml_element.get_attribute(prepend_android("name"))
-        self.no_history = xml_element.get_attribute(prepend_android("noHistory"))
-        self.parent_activity_name = xml_element.get_attribute(prepend_android("parentActivityName"))
-        self.persistable_mode = xml_element.get_attribute(prepend_android("persistableMode"))
-        self.permission = xml_element.get_attribute(prepend_android("permission"))
-        self.process = xml_element.get_attribute(prepend_android("process"))
-        self.relinquish_task_identity = xml_element.get_attribute(prepend_android("relinquishTaskIdentity"))
-        self.resizeable_activity = xml_element.get_attribute(prepend_android("resizeableActivity"))
-        self.screen_orientation = xml_element.get_attribute(prepend_android("screenOrientation"))
-        self.show_for_all_users = xml_element.get_attribute(prepend_android("showForAllUsers"))
-        self.state_not_needed = xml_element.get_attribute(prepend_android("stateNotNeeded"))
-        self.supports_picture_in_picture = xml_element.get_attribute(prepend_android("supportsPictureInPicture"))
-        self.task_affinity = xml_element.get_attribute(prepend_android("taskAffinity"))
-        self.theme = xml_element.get_attribute(prepend_android("theme"))
-        self.ui_options = xml_element.get_attribute(prepend_android("uiOptions"))
-        self.window_soft_input_mode = xml_element.get_attribute(prepend_android("windowSoftInputMode"))
+
+        self.direct_boot_aware = attributes.get(direct_boot_aware_attribute)
+        self.enabled = attributes.get(enabled_attribute)
+        self.exported = attributes.get(exported_attribute)
+        self.name = attributes.get(name_attribute)
+        self.permission = attributes.get(permission_attribute)
 
         self.set_defaults()
 
 
 class BroadcastReceiver(ManifestElement):
+    __slots__ = ()
 
-    def __init__(self, xml_element: Element):
+    def __init__(self, attributes):
         super().__init__()
 
-        self.direct_boot_aware = xml_element.get_attribute(prepend_android("directBootAware"))
-        self.enabled = xml_element.get_attribute(prepend_android("enabled"))
-        self.exported = xml_element.get_attribute(prepend_android("exported"))
-        self.icon = xml_element.get_attribute(prepend_android("icon"))
-        self.label = xml_element.get_attribute(prepend_android("label"))
-        self.name = xml_element.get_attribute(prepend_android("name"))
-        self.permission = xml_element.get_attribute(prepend_android("permission"))
-        self.process = xml_element.get_attribute(prepend_android("process"))
+        self.direct_boot_aware = attributes.get(direct_boot_aware_attribute)
+        self.enabled = attributes.get(enabled_attribute)
+        self.exported = attributes.get(exported_attribute)
+        self.name = attributes.get(name_attribute)
+        self.permission = attributes.get(permission_attribute)
 
         self.set_defaults()
 
 
 class ContentProvider(ManifestElement):
+    __slots__ = ()
 
-    def __init__(self, xml_element: Element):
+    def __init__(self, attributes):
         super().__init__()
 
-        self.authorities = xml_element.get_attribute(prepend_android("authorities"))
-        self.name = xml_element.get_attribute(prepend_android("name"))
-        self.grant_uri_permission = xml_element.get_attribute(prepend_android("grantUriPermission"))
-        self.permission = xml_element.get_attribute(prepend_android("permission"))
-        self.read_permission = xml_element.get_attribute(prepend_android("readPermission"))
-        self.write_permission = xml_element.get_attribute(prepend_android("writePermission"))
-        self.enabled = xml_element.get_attribute(prepend_android("enabled"))
-        self.exported = xml_element.get_attribute(prepend_android("exported"))
-        self.init_order = xml_element.get_attribute(prepend_android("initOrder"))
-        self.multi_process = xml_element.get_attribute(prepend_android("multiProcess"))
-        self.process = xml_element.get_attribute(prepend_android("process"))
-        self.syncable = xml_element.get_attribute(prepend_android("syncable"))
-        self.icon = xml_element.get_attribute(prepend_android("icon"))
-        self.label = xml_element.get_attribute(prepend_android("label"))
+        self.authorities = attributes.get(authorities_attribute)
+        self.name = attributes.get(name_attribute)
+        self.grant_uri_permission = attributes.get(grant_uri_permission_attribute)
+        self.permission = attributes.get(permission_attribute)
+        self.read_permission = attributes.get(read_permission_attribute)
+        self.write_permission = attributes.get(write_permission_attribute)
+        self.enabled = attributes.get(enabled_attribute)
+        self.exported = attributes.get(exported_attribute)
 
         self.set_defaults()
 
 
 class Service(ManifestElement):
-    def __init__(self, xml_element: Element):
+    __slots__ = ()
+
+    def __init__(self, attributes):
         super().__init__()
 
-        self.description = xml_element.get_attribute(prepend_android("description"))
-        self.direct_boot_aware = xml_element.get_attribute(prepend_android("directBootAware"))
-        self.enabled = xml_element.get_attribute(prepend_android("enabled"))
-        self.exported = xml_element.get_attribute(prepend_android("exported"))
-        self.foreground_service_type = xml_element.get_attribute(prepend_android("foregroundServiceType"))
-        self.icon = xml_element.get_attribute(prepend_android("icon"))
-        self.isolated_process = xml_element.get_attribute(prepend_android("isolatedProcess"))
-        self.label = xml_element.get_attribute(prepend_android("label"))
-        self.name = xml_element.get_attribute(prepend_android("name"))
-        self.permission = xml_element.get_attribute(prepend_android("permission"))
-        self.process = xml_element.get_attribute(prepend_android("process"))
+        self.direct_boot_aware = attributes.get(direct_boot_aware_attribute)
+        self.enabled = attributes.get(enabled_attribute)
+        self.exported = attributes.get(exported_attribute)
+        self.foreground_service_type = attributes.get(foreground_service_type_attribute)
+        self.name = attributes.get(name_attribute)
+        self.permission = attributes.get(permission_attribute)
 
         self.set_defaults()
 
 
 class UsesPermission(ManifestElement):
-    def __init__(self, xml_element: Element):
+    __slots__ = ()
+
+    def __init__(self, attributes):
         super().__init__()
 
-        self.name = xml_element.get_attribute(prepend_android("name"))
-        self.max_sdk_version = xml_element.get_attribute(prepend_android("maxSdkVersion"))
+        self.name = attributes.get(name_attribute)
@@ -1,44 +1,89 @@
+import io
 from typing import List
+from xml.etree.ElementTree import iterparse
 
-import untangle
-
+from cp55.axml_parser import decode_binary_xml, is_binary_xml, read_manifest_from_apk
 from cp55.manifest_elements import UsesPermission, ContentProvider, Service, BroadcastReceiver, Activity, \
     ManifestElement
 
+# Classes of the elements read from the manifest, by the path of their tag
+element_classes = {
+    ("manifest", "uses-permission"): UsesPermission,
+    ("manifest", "application", "service"): Service,
+    ("manifest", "application", "provider"): ContentProvider,
+    ("manifest", "application", "receiver"): BroadcastReceiver,
+    ("manifest", "application", "activity"): Activity,
+}
+
 
 class ManifestHandler:
     """
     Class responsible for parsing the AndroidManifest.xml file.
     The app properties are extracted in the constructor.
+
+    The manifest can be the textual one decoded by apktool, the binary one left by apktool's --no-res option, or an
+    apk, in which case the binary manifest is read straight from the archive.
+
+    The manifest is parsed as a stream in a single pass: the elements are turned into ManifestElement objects as soon
+    as they start, and are dropped from the parser's tree once they end, so that the tree never holds more than the
+    path to the current element.
     """
 
-    def __init__(self, manifest_path):
-        manifest = untangle.parse(manifest_path).manifest
-
-        try:
-            self.__uses_permissions = list(map(lambda x: UsesPermission(x), manifest.uses_permission))
-        except AttributeError:
-            self.__uses_permissions = []
-
-        try:
-            self.__services = list(map(lambda x: Service(x), manifest.application.service))
-        except AttributeError:
-            self.__services = []
-
-        try:
-            self.__providers = list(map(lambda x: ContentProvider(x), manifest.application.provider))
-        except AttributeError:
-            self.__providers = []
-
-        try:
-            self.__receivers = list(map(lambda x: BroadcastReceiver(x), manifest.application.receiver))
-        except AttributeError:
-            self.__receivers = []
-
-        try:
-            self.__activities = list(map(lambda x: Activity(x), manifest.application.activity))
-        except AttributeError:
-            self.__activities = []
+    def __init__(self, manifest_path, budget=None, component_types=None):
+        """
+        :param budget: the budget of the manifest stage, checked for each element and for each chunk of a binary
+                       manifest
+        :param component_types: the tags of the components to read, e.g. {"provider", "service"}, all of them if None;
+                                the other components are skipped and their getters return empty lists
+        :raises: BudgetExceeded If reading the manifest exceeds its budget.
+        """
+        self.__uses_permissions = []
+        self.__services = []
+        self.__providers = []
+        self.__receivers = []
+        self.__activities = []
+
+        if manifest_path.endswith(".apk"):
+            source = io.BytesIO(read_manifest_from_apk(manifest_path, budget).encode("utf-8"))
+        else:
+            with open(manifest_path, "rb") as manifest_file:
+                content = manifest_file.read()
+
+            if is_binary_xml(content):
+                source = io.BytesIO(decode_binary_xml(content, budget).encode("utf-8"))
+            else:
+                source = io.BytesIO(content)
+
+        elements = {
+            UsesPermission: self.__uses_permissions,
+            Service: self.__services,
+            ContentProvider: self.__providers,
+            BroadcastReceiver: self.__receivers,
+            Activity: self.__activities,
+        }
+
+        wanted_classes = {path: element_class for path, element_class in element_classes.items()
+                          if element_class is UsesPermission or component_types is None or path[-1] in component_types}
+
+        path = list()
+        parents = list()
+        for event, xml_element in iterparse(source, events=("start", "end")):
+            if event == "start":
+                path.append(xml_element.tag)
+                parents.append(xml_element)
+
+                element_class = wanted_classes.get(tuple(path), None)
+                if element_class is not None:
+                    elements[element_class].append(element_class(xml_element.attrib))
+                    if budget is not None:
+                        budget.check()
+            else:
+                path.pop()
+                parents.pop()
+                # The ended element is the last child of its parent
+                xml_element.clear()
+                if len(parents) > 0:
+                    del parents[-1][-1]
 
     def get_permissions(self) -> List[ManifestElement]:
         return self.__uses_permissions
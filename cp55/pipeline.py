@@ -0,0 +1,75 @@
+import queue
+import threading
+import traceback
+
+end_of_stream = object()
+
+
+class Stage:
+    """
+    A step of a pipeline, run by a fixed number of worker threads that take their items from a bounded queue.
+    """
+
+    def __init__(self, name, function, workers=1, queue_size=1):
+        """
+        :param name: the name of the stage, used when reporting errors
+        :param function: called with each item of the stage; its return value is handed to the next stage, unless it
+                         is None, in which case the item is dropped
+        :param workers: the number of threads running the stage
+        :param queue_size: the maximum number of items waiting for the stage; producers block while the queue is full
+        """
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.threads = list()
+
+    def start(self, next_stage):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.__work, args=(next_stage,), name=self.name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """
+        Waits for the stage to process all the items in its queue.
+        """
+        for _ in self.threads:
+            self.queue.put(end_of_stream)
+        for thread in self.threads:
+            thread.join()
+
+    def __work(self, next_stage):
+        while True:
+            item = self.queue.get()
+            if item is end_of_stream:
+                return
+
+            try:
+                result = self.function(item)
+            except Exception:
+                print("Stage " + self.name + " failed to process an item.")
+                traceback.print_exc()
+                continue
+
+            if result is not None and next_stage is not None:
+                next_stage.queue.put(result)
+
+
+def run_pipeline(items, stages):
+    """
+    Pushes the items through the given stages, which run concurrently. The queues between the stages are bounded, so a
+    slow stage makes the stages in front of it wait instead of letting items pile up.
+
+    :param items: the inputs of the first stage
+    :param stages: the list of stages, in the order in which they are applied
+    """
+    for index, stage in enumerate(stages):
+        next_stage = stages[index + 1] if index + 1 < len(stages) else None
+        stage.start(next_stage)
+
+    for item in items:
+        stages[0].queue.put(item)
+
+    for stage in stages:
+        stage.stop()
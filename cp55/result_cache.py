@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+
+from cp55 import analyser_version
+from cp55.apk_handler import smali_backend
+
+hash_block_size = 1024 * 1024
+
+
+def hash_file(path):
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as hashed_file:
+        for block in iter(lambda: hashed_file.read(hash_block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of the analysis results of apks, stored as one json file per result.
+
+    A result is keyed by the SHA-256 of the apk, the hash of the inspection filter, the backend and the analyser
+    version, so that a change of the filter, of the backend or of the analysis logic never serves stale results. When the cache grows over its maximum
+    size, the least recently used results are evicted.
+    """
+
+    def __init__(self, directory, inspection_filter, max_size, backend=smali_backend):
+        """
+        :param directory: the directory holding the cached results, created if missing
+        :param inspection_filter: the filter the cached results were computed with
+        :param max_size: the maximum size of the cache in bytes
+        :param backend: the backend the cached results were computed with, see ApkHandler
+        """
+        self.__directory = directory
+        self.__max_size = max_size
+        self.__backend = backend
+        self.__filter_hash = hashlib.sha256(json.dumps(inspection_filter, sort_keys=True).encode()).hexdigest()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, apk_path):
+        key = hash_file(apk_path) + ":" + self.__filter_hash + ":" + self.__backend + ":" + analyser_version
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        :return: the cached result or None if the key is not in the cache
+        """
+        path = self.__get_path(key)
+        try:
+            with open(path, "r") as result_file:
+                result = json.load(result_file)
+        except (OSError, ValueError):
+            return None
+
+        # The modification time of the entry is its last use
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return result
+
+    def put(self, key, result):
+        path = self.__get_path(key)
+        # The threads of a process may store the results of the same apk concurrently
+        temporary_path = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+
+        with open(temporary_path, "w") as result_file:
+            json.dump(result, result_file)
+        os.replace(temporary_path, path)
+
+        self.__evict()
+
+    def __get_path(self, key):
+        return os.path.join(self.__directory, key + ".json")
+
+    def __evict(self):
+        entries = list()
+        total_size = 0
+        with os.scandir(self.__directory) as directory_entries:
+            for entry in directory_entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.__max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
@@ -0,0 +1,188 @@
+import itertools
+import os
+import queue
+import shutil
+import threading
+
+preferred_scratch_root = "/dev/shm"
+scratch_directory_name = "cp55-scratch"
+trash_prefix = ".trash."
+
+default_min_free = 1024 * 1024 * 1024
+
+end_of_stream = None
+
+
+class ScratchSpace:
+    """
+    Places the decode workspaces of the apps, i.e. apktool's output directories, preferably in a tmpfs such as
+    /dev/shm, since the tens of thousands of small smali files apktool writes for an app make the metadata updates
+    dominate on disk and network backed volumes.
+
+    A workspace is only placed in the scratch root while its file system has min_free bytes free, which accounts for
+    the workspaces of all the processes sharing it; it is placed in the fallback root otherwise, so that a small or
+    full tmpfs never fails the decoding of an app.
+
+    Every process places its workspaces in its own directory of the roots, named after its pid, so that the runs and
+    processes sharing a root never decode into the same workspace. The directories left behind by the processes that
+    are no longer alive are deleted by reap_stale.
+
+    A released workspace is renamed out of the way at once and deleted by a background reaper thread, so that the
+    next app decoded into the same workspace does not wait on the deletion.
+    """
+
+    def __init__(self, root=None, fallback_root=scratch_directory_name, min_free=default_min_free):
+        """
+        :param root: the directory the workspaces are created in; if None, a directory in /dev/shm when it is
+                     writable, the fallback root otherwise
+        :param fallback_root: the directory the workspaces are created in when the root is short of space
+        :param min_free: the number of bytes left free on the file system of the root
+        """
+        if root is None:
+            root = fallback_root
+            if os.path.isdir(preferred_scratch_root) and os.access(preferred_scratch_root, os.W_OK):
+                root = os.path.join(preferred_scratch_root, scratch_directory_name)
+        os.makedirs(root, exist_ok=True)
+
+        self.root = root
+        self.fallback_root = fallback_root
+        self.min_free = min_free
+        self.__can_fall_back = os.path.realpath(root) != os.path.realpath(fallback_root)
+        self.__process_directories = [os.path.join(directory, str(os.getpid())) for directory in {root, fallback_root}]
+
+        self.placed = 0
+        self.fallbacks = 0
+        self.released = 0
+        self.reclaimed_bytes = 0
+
+        self.__trash_numbers = itertools.count()
+        self.__queue = queue.Queue()
+        self.__reaper = threading.Thread(target=self.__reap, name="reaper", daemon=True)
+        self.__reaper.start()
+
+        # A directory of the pid was left behind by a process that is no longer alive
+        for process_directory in self.__process_directories:
+            if os.path.isdir(process_directory):
+                remove_tree(process_directory)
+
+    def get_workspace(self, name):
+        """
+        :param name: the name of the workspace, unique among the apps decoded concurrently by the process
+        :return: the path of the workspace, in the scratch root if it has enough free space
+        """
+        root = self.root
+        if self.__can_fall_back and not self.__has_free_space():
+            self.fallbacks += 1
+            root = self.fallback_root
+        else:
+            self.placed += 1
+
+        process_directory = os.path.join(root, str(os.getpid()))
+        os.makedirs(process_directory, exist_ok=True)
+        return os.path.join(process_directory, name)
+
+    def __has_free_space(self):
+        try:
+            return shutil.disk_usage(self.root).free >= self.min_free
+        except OSError:
+            return False
+
+    def release(self, workspace):
+        """
+        Hands a workspace to the reaper. The workspace is renamed within its parent directory, so that its path can be
+        used again right away.
+        """
+        if os.path.exists(workspace):
+            self.released += 1
+            self.__discard(workspace, os.path.dirname(os.path.normpath(workspace)))
+
+    def __discard(self, path, trash_directory):
+        trash = os.path.join(trash_directory, trash_prefix + os.path.basename(os.path.normpath(path)) + "." +
+                             str(os.getpid()) + "." + str(next(self.__trash_numbers)))
+        try:
+            os.rename(path, trash)
+        except OSError:
+            # Another process may have taken the directory already
+            if not os.path.exists(path):
+                return
+            trash = path
+        self.__queue.put(trash)
+
+    def reap_stale(self):
+        """
+        Hands to the reaper the directories of the processes that are no longer alive, along with the workspaces they
+        did not release. A directory is moved into the one of the process first, so that it is found again if the
+        process stops before deleting it.
+        """
+        for root in {self.root, self.fallback_root}:
+            if not os.path.isdir(root):
+                continue
+
+            for entry in os.scandir(root):
+                if entry.name.isdigit() and entry.is_dir(follow_symlinks=False) and \
+                        not is_process_alive(int(entry.name)):
+                    process_directory = os.path.join(root, str(os.getpid()))
+                    os.makedirs(process_directory, exist_ok=True)
+                    self.__discard(entry.path, process_directory)
+
+    def close(self):
+        """
+        Waits until the released workspaces are deleted, stops the reaper and removes the directories of the process
+        once they are empty.
+        """
+        self.__queue.put(end_of_stream)
+        self.__reaper.join()
+
+        for process_directory in self.__process_directories:
+            try:
+                os.rmdir(process_directory)
+            except OSError:
+                pass
+
+    def get_statistics(self):
+        return {"placed": self.placed, "fallbacks": self.fallbacks, "released": self.released,
+                "reclaimed_bytes": self.reclaimed_bytes}
+
+    def __reap(self):
+        while True:
+            trash = self.__queue.get()
+            if trash is end_of_stream:
+                return
+
+            try:
+                self.reclaimed_bytes += remove_tree(trash)
+            except OSError as e:
+                print("Failed to delete the workspace " + trash + " due to {}".format(e))
+                shutil.rmtree(trash, ignore_errors=True)
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_tree(path):
+    """
+    Deletes a directory tree, like shutil.rmtree, without following symbolic links.
+
+    :return: the total size of the deleted files in bytes
+    """
+    size = 0
+    for directory, directory_names, file_names in os.walk(path, topdown=False):
+        for file_name in file_names:
+            file_path = os.path.join(directory, file_name)
+            size += os.lstat(file_path).st_size
+            os.unlink(file_path)
+        for directory_name in directory_names:
+            directory_path = os.path.join(directory, directory_name)
+            if os.path.islink(directory_path):
+                os.unlink(directory_path)
+            else:
+                os.rmdir(directory_path)
+    os.rmdir(path)
+    return size
@@ -1,64 +1,28 @@
+import hashlib
 import re
+from collections.abc import Mapping
 
-
-def find_methods(methods_section):
-    methods = {}
-    method_signature = None
-    method_lines = []
-
-    for line in methods_section:
-        if line.startswith(".method"):
-            method_signature = line.replace(".method ", "")
-            method_lines = []
-        elif line.startswith(".end method"):
-            methods[method_signature] = method_lines
-        else:
-            method_lines.append(line)
-
-    return methods
-
-
-def split_file_sections(smali_file):
-    sections = {}
-
-    section_title = "class definition"
-    section_lines = []
-
-    for line in smali_file:
-        if line.startswith("#"):
-            sections[section_title] = section_lines
-            section_title = line.replace("# ", "")
-            section_lines = []
-        else:
-            section_lines.append(line)
-
-    sections[section_title] = section_lines
-
-    return sections
+from cp55.smali_instructions import decode_instruction
 
 
 def find_invoked_methods(code_snippet):
     invoked_methods = {}
 
     for line in code_snippet:
-        if line.__contains__("invoke"):
-            objects = re.findall("L.*?;", line)
-            if len(objects) == 0:
-                continue
-            called_object = objects[0][1:-1].replace("/", ".")
-
-            method = re.findall("->.*\\)", line)
-            if len(method) != 1:
-                continue
-            method = method[0][2:].split("(")[0]
-
-            invoked_method = invoked_methods.get(called_object)
-            if invoked_method is None:
-                methods = set()
-                methods.add(method)
-                invoked_methods[called_object] = methods
-            else:
-                invoked_method.add(method)
+        if not line.startswith("invoke"):
+            continue
+
+        _, _, called_object, method, _ = decode_instruction(line)
+        if called_object is None:
+            continue
+
+        invoked_method = invoked_methods.get(called_object)
+        if invoked_method is None:
+            methods = set()
+            methods.add(method)
+            invoked_methods[called_object] = methods
+        else:
+            invoked_method.add(method)
 
     return invoked_methods
 
@@ -82,28 +46,147 @@ def find_method_name(method_signature):
             return part.split("(")[0]
 
 
-class SmaliHandler:
+def find_method_key(method_signature):
+    """
+    Strips the access flags from a method signature, e.g. "public final foo(I)V" becomes "foo(I)V".
+    """
+    return method_signature.rsplit(" ", 1)[-1]
 
-    def __init__(self, smali_path):
-        smali_file = open(smali_path, 'r')
-        content = smali_file.readlines()
-        smali_file.close()
 
-        content = list(filter(lambda x: x != "",
-                              map(lambda x: x.replace("\n", "").lstrip(" "),
-                                  content)))
+def strip_lines(code):
+    return list(filter(lambda x: x != "",
+                       map(lambda x: x.lstrip(" "),
+                           code.split("\n"))))
+
 
-        file_sections = split_file_sections(content)
+method_boundary_pattern = re.compile("^ *\\.(method|end method)(.*)$", re.MULTILINE)
+
+
+class MethodBodies(Mapping):
+    """
+    Maps the method signatures of a class to the lines of their bodies. Only the location of each body is known
+    upfront, a body is decoded the first time it is accessed.
+    """
+
+    def __init__(self, locations, decoder):
+        """
+        :param locations: dict mapping each method signature to the location of its body
+        :param decoder: returns the lines of a body given its location
+        """
+        self.__locations = locations
+        self.__decoder = decoder
+        self.__bodies = dict()
+        self.__keys = dict()
 
-        self.canonical_name = find_canonical_name(file_sections["class definition"])
+        # Index of the signatures without their access flags, for exact lookups in get_method
+        for method_signature in locations.keys():
+            self.__keys[find_method_key(method_signature)] = method_signature
 
-        self.methods = find_methods(file_sections.get("direct methods", {}))
-        self.methods.update(find_methods(file_sections.get("virtual methods", {})))
+    def __getitem__(self, method_signature):
+        body = self.__bodies.get(method_signature, None)
+        if body is None:
+            body = self.__decoder(self.__locations[method_signature])
+            self.__bodies[method_signature] = body
+        return body
 
-        self.invoked_methods = {}
-        for method_signature, code in self.methods.items():
-            method_name = find_method_name(method_signature)
-            self.invoked_methods[method_name] = find_invoked_methods(code)
+    def __iter__(self):
+        return iter(self.__locations)
+
+    def __len__(self):
+        return len(self.__locations)
+
+    def find_signature(self, method_name):
+        """
+        Returns the full signature of the method given its name and prototype, or None if the class does not have it.
+        The name and prototype must match exactly, e.g. "a(I)V" never finds "ba(I)V".
+        """
+        return self.__keys.get(method_name, None)
+
+
+class InvokedMethods(Mapping):
+    """
+    Maps the method names of a class to the methods they invoke, computed the first time a method is accessed.
+    When a method is overloaded, the invocations of its last overload are used.
+    """
+
+    def __init__(self, methods: MethodBodies):
+        self.__methods = methods
+        self.__signatures = dict()
+        self.__invocations = dict()
+
+        for method_signature in methods.keys():
+            self.__signatures[find_method_name(method_signature)] = method_signature
+
+    def __getitem__(self, method_name):
+        invocations = self.__invocations.get(method_name, None)
+        if invocations is None:
+            invocations = find_invoked_methods(self.__methods[self.__signatures[method_name]])
+            self.__invocations[method_name] = invocations
+        return invocations
+
+    def __iter__(self):
+        return iter(self.__signatures)
+
+    def __len__(self):
+        return len(self.__signatures)
+
+
+class SmaliHandler:
+    """
+    Class responsible for parsing a smali file. The constructor only reads the class name, the methods of the class
+    are indexed when they are first accessed, and their bodies and invocations when each of them is first accessed.
+    """
+
+    def __init__(self, smali_path):
+        smali_file = open(smali_path, 'r')
+        self.__content = smali_file.read()
+        smali_file.close()
+
+        # Approximate memory footprint, used to bound the class handler cache
+        self.size = len(self.__content)
+        self.__content_hash = None
+        self.__methods = None
+        self.__invoked_methods = None
+
+        # The class definition ends at the first method
+        first_method = method_boundary_pattern.search(self.__content)
+        class_definition_end = first_method.start() if first_method is not None else len(self.__content)
+        self.canonical_name = find_canonical_name(strip_lines(self.__content[:class_definition_end]))
+
+    @property
+    def methods(self):
+        if self.__methods is None:
+            locations = dict()
+            method_signature = None
+            body_start = None
+            for match in method_boundary_pattern.finditer(self.__content):
+                if match.group(1) == "method":
+                    method_signature = match.group(2).strip()
+                    body_start = match.end()
+                elif method_signature is not None:
+                    locations[method_signature] = (body_start, match.start())
+                    method_signature = None
+
+            self.__methods = MethodBodies(locations, self.__decode_body)
+        return self.__methods
+
+    @property
+    def invoked_methods(self):
+        if self.__invoked_methods is None:
+            self.__invoked_methods = InvokedMethods(self.methods)
+        return self.__invoked_methods
+
+    def __decode_body(self, location):
+        return strip_lines(self.__content[location[0]:location[1]])
+
+    @property
+    def content_hash(self):
+        """
+        The hash of the smali of the class, which identifies the class across apps, see SummaryCache.
+        """
+        if self.__content_hash is None:
+            self.__content_hash = hashlib.blake2b(self.__content.encode(), digest_size=16).hexdigest()
+        return self.__content_hash
 
     def get_invoked_methods(self):
         return self.invoked_methods
@@ -119,7 +202,7 @@ class SmaliHandler:
                             "insert(Landroid/net/Uri;Landroid/content/ContentValues;)Landroid/net/Uri;"
         :return: the content of the method
         """
-        for name, lines in self.methods.items():
-            if method_name in name:
-                return lines
-        return None
+        method_signature = self.methods.find_signature(method_name)
+        if method_signature is None:
+            return None
+        return self.methods[method_signature]
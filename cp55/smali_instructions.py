@@ -0,0 +1,66 @@
+import re
+
+invoke_pattern = re.compile("^\\{([^}]*)\\}, \\[*L([^;]*);->([^(]*)(\\(.*)$")
+register_pattern = re.compile("^[vp][0-9]+$")
+register_range_pattern = re.compile("^([vp])([0-9]+) \\.\\. ([vp])([0-9]+)$")
+
+# Decoded form of the lines that are not instructions, e.g. labels and directives
+no_instruction = (None, (), None, None, None)
+
+
+def parse_registers(operands):
+    """
+    Parses the registers of an instruction, i.e. its leading operands that are registers.
+    """
+    registers = list()
+    for operand in operands.split(", "):
+        if register_pattern.match(operand) is None:
+            break
+        registers.append(operand)
+    return tuple(registers)
+
+
+def parse_invoke_registers(registers):
+    """
+    Parses the register list of an invoke instruction, e.g. "v0, v1" or "v0 .. v3". A range is expanded into all its
+    registers, unless it spans both local and parameter registers, which cannot be numbered without the register count
+    of the method.
+    """
+    if registers == "":
+        return ()
+
+    register_range = register_range_pattern.match(registers)
+    if register_range is None:
+        return tuple(registers.split(", "))
+
+    first_prefix, first, last_prefix, last = register_range.groups()
+    if first_prefix != last_prefix:
+        return first_prefix + first, last_prefix + last
+    return tuple(first_prefix + str(number) for number in range(int(first), int(last) + 1))
+
+
+def decode_instruction(line):
+    """
+    Decodes a line of a smali method body with precompiled patterns, in a single pass over the line.
+
+    :param line: a stripped line of a method body, e.g. "invoke-virtual {p0, v0}, Lcom/a/B;->c(Ljava/lang/String;)V"
+    :return: a tuple of the opcode, the registers, the class of the invoked method (as a canonical name), the name of
+             the invoked method and its full signature, e.g. ("invoke-virtual", ("p0", "v0"), "com.a.B", "c",
+             "c(Ljava/lang/String;)V"). The last three are None for instructions other than invokes, all but the
+             registers are None for lines that are not instructions.
+    """
+    if line == "" or not "a" <= line[0] <= "z":
+        return no_instruction
+
+    opcode, _, operands = line.partition(" ")
+    if operands == "":
+        return opcode, (), None, None, None
+
+    if opcode.startswith("invoke"):
+        invoke = invoke_pattern.match(operands)
+        if invoke is None:
+            return opcode, (), None, None, None
+        registers, owner, method_name, prototype = invoke.groups()
+        return opcode, parse_invoke_registers(registers), owner.replace("/", "."), method_name, method_name + prototype
+
+    return opcode, parse_registers(operands), None, None, None
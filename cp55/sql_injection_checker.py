@@ -1,7 +1,9 @@
-import re
-
 from cp55.apk_handler import ApkHandler
-from cp55.smali_handler import SmaliHandler
+from cp55.budget import Budget
+from cp55.smali_instructions import decode_instruction
+
+# Maximum depth of the chain of calls followed from the checked method
+default_max_call_depth = 16
 
 sql_calls = {
     "android.database.sqlite.SQLiteDatabase:insert",
@@ -17,304 +19,296 @@ sql_calls = {
 }
 
 
+# Packages of the platform classes, which an app cannot replace, except for the support libraries bundled by apps
+platform_packages = ("java.", "javax.", "dalvik.", "android.")
+bundled_packages = ("android.support.", "android.arch.")
+
+
+def is_platform_class(class_name):
+    return class_name.startswith(platform_packages) and not class_name.startswith(bundled_packages)
+
+
 def is_sql_api_call(method_call):
     if method_call in sql_calls:
         return True
     return False
 
 
-def split_sections(method):
-    sections = {}
+class BasicBlock:
+    """
+    A straight sequence of instructions of a method, entered only at its first instruction and left only after its
+    last one.
+    """
 
-    if method is None:
-        return sections
+    def __init__(self):
+        # The decoded instructions of the block, see decode_instruction
+        self.instructions = list()
+        # The labels the last instruction jumps to
+        self.jump_targets = list()
+        # The label of the payload of a switch ending the block
+        self.switch_payload = None
+        # The registers tested by a branch ending the block
+        self.tested_registers = ()
+        self.falls_through = True
+        self.successors = list()
 
-    current_section = list()
-    current_section_name = "start"
-    sections[current_section_name] = current_section
-    previous_section_name = None
 
-    in_pswitch_data = False
-    for line in method:
-        if line.startswith(":"):
-            if not in_pswitch_data:
-                sections[current_section_name] = current_section
-                current_section = list()
-                previous_section_name = current_section_name
-                current_section_name = line
-            else:
-                current_section.append(line)
-
-            if line.startswith(":goto") and (
-                    previous_section_name.startswith(":pswitch") or previous_section_name.startswith(":sswitch")) \
-                    and sections[previous_section_name][-1] == "nop":
-                sections[previous_section_name][-1] = "goto " + current_section_name
-
-        elif line.startswith("."):
-            if line.startswith(".packed-switch"):
-                in_pswitch_data = True
-                current_section.append(line)
-            elif line == ".end packed-switch":
-                in_pswitch_data = False
-                current_section.append(line)
-            else:
-                continue
-        else:
-            current_section.append(line)
+def is_block_end(opcode):
+    return opcode.startswith("if-") or opcode.startswith("goto") or opcode.startswith("return") or \
+        opcode == "throw" or opcode == "packed-switch" or opcode == "sparse-switch"
 
-    sections[current_section_name] = current_section
 
-    sections = {key: value for (key, value) in sections.items()
-                if not key.startswith(":try") and not key.startswith(":catch")}
+def build_control_flow_graph(method):
+    """
+    Splits a method in basic blocks at its labels and branches, and links each block to the blocks that may follow it.
 
-    return sections
+    The :try labels do not split blocks, and no edges are added for exceptions: a catch handler is only reached by an
+    explicit jump, like the rest of the code.
 
+    :param method: the lines of the method
+    :return: the list of basic blocks, the first one being the entry of the method
+    """
+    if method is None:
+        return []
 
-def build_execution_paths(method):
-    sections = split_sections(method)
+    blocks = [BasicBlock()]
+    labels = dict()
+    payloads = dict()
+    pending_labels = list()
+    payload_targets = None
 
-    if len(sections) == 0:
-        return []
+    for line in method:
+        if payload_targets is not None:
+            # Packed switch payloads list the target labels, sparse switch payloads list "key -> label" lines
+            if line.startswith(".end"):
+                payload_targets = None
+            elif line.startswith(":") or "->" in line:
+                payload_targets.append(line.split()[-1])
+            continue
 
-    visited_sections = set()
-    visited_sections.add("start")
-
-    execution_paths = list()
-    execution_paths.append(sections["start"])
-
-    old_visited_sections_number = -1
-    while visited_sections != set(sections.keys()) and old_visited_sections_number != len(visited_sections):
-        old_visited_sections_number = len(visited_sections)
-        new_execution_paths = list()
-        while len(execution_paths) > 0:
-            path = execution_paths.pop(0)
-
-            lines_in_section = len(path)
-            new_path = list()
-            for i in range(0, lines_in_section):
-                line = path.pop(0)
-
-                if line.startswith("if"):
-                    # if-test vA, vB, +CCCC
-                    # if-testz vAA, +BBBB
-
-                    tokens = line.split()
-                    if_cond = tokens[0]
-                    first_register = tokens[1].replace(",", "")
-                    dest_branch = tokens[-1]
-
-                    if if_cond.endswith("z"):
-                        second_register = str(0)
-                    else:
-                        second_register = tokens[2].replace(",", "")
-
-                    true_path = list(new_path)
-                    false_path = list(new_path)
-
-                    if if_cond == "if-eq" or if_cond == "if-eqz":
-                        true_path.append("c: " + first_register + " == " + second_register)
-                        false_path.append("c: " + first_register + " != " + second_register)
-                    elif if_cond == "if-ne" or if_cond == "if-nez":
-                        true_path.append("c: " + first_register + " != " + second_register)
-                        false_path.append("c: " + first_register + " == " + second_register)
-                    elif if_cond == "if-lt" or if_cond == "if-ltz":
-                        true_path.append("c: " + first_register + " < " + second_register)
-                        false_path.append("c: " + first_register + " >= " + second_register)
-                    elif if_cond == "if-ge" or if_cond == "if-gez":
-                        true_path.append("c: " + first_register + " >= " + second_register)
-                        false_path.append("c: " + first_register + " < " + second_register)
-                    elif if_cond == "if-gt" or if_cond == "if-gtz":
-                        true_path.append("c: " + first_register + " > " + second_register)
-                        false_path.append("c: " + first_register + " <= " + second_register)
-                    elif if_cond == "if-le" or if_cond == "if-lez":
-                        true_path.append("c: " + first_register + " <= " + second_register)
-                        false_path.append("c: " + first_register + " > " + second_register)
-
-                    true_path.extend(sections[dest_branch])
-                    false_path.extend(path)
-
-                    new_execution_paths.append(true_path)
-                    new_execution_paths.append(false_path)
-
-                    visited_sections.add(dest_branch)
-                    break
-
-                elif line.startswith("goto"):
-                    # goto +AA
-                    # goto/16 +AAAA
-                    # goto/32 +AAAAAAAA
-                    target_branch = line.split()[-1]
-
-                    new_path.extend(sections[target_branch])
-                    new_execution_paths.append(new_path)
-
-                    visited_sections.add(target_branch)
-
-                elif line.startswith("sparse-switch"):
-                    # sparse-switch vAA, +BBBBBBBB
-                    sparse_switch_tokens = line.split()
-                    register_to_test = sparse_switch_tokens[1].replace(",", "")
-                    switch_table_offset = sparse_switch_tokens[-1]
-                    switch_table_section = sections[switch_table_offset]
-
-                    default_condition = []
-                    for switch_table_entry in switch_table_section:
-                        # 0x1 -> :sswitch_0
-                        entry_tokens = switch_table_entry.split()
-                        register_value = entry_tokens[0]
-                        target_branch = entry_tokens[-1]
-                        if target_branch in sections.keys():
-                            default_condition.append("" + register_to_test + " != " + register_value)
-                            switch_path = list(new_path)
-                            switch_path.append("c: " + register_to_test + " == " + register_value)
-                            switch_path.extend(sections[target_branch])
-                            new_execution_paths.append(switch_path)
-                            visited_sections.add(target_branch)
-
-                    # the default path is taken when no switch condition is met
-                    default_path = list(new_path)
-                    default_path.append("c: " + " && ".join(default_condition))
-                    default_path.extend(path)
-                    new_execution_paths.append(default_path)
-
-                    visited_sections.add(switch_table_offset)
-                    break
-
-                elif line.startswith("packed-switch"):
-                    # packed-switch vAA, +BBBBBBBB
-                    packed_switch_tokens = line.split()
-                    register_to_test = packed_switch_tokens[1].replace(",", "")
-                    switch_table_offset = packed_switch_tokens[-1]
-                    switch_table_section = sections[switch_table_offset]
-
-                    index = 0
-                    first_case_value = None
-                    for switch_table_entry in switch_table_section:
-                        if switch_table_entry.startswith(".packed-switch"):
-                            first_case_value = int(switch_table_entry.split()[1], 0)
-                        elif switch_table_entry in sections.keys():
-                            switch_path = list(new_path)
-                            switch_path.append("c: " + register_to_test + " == " + str(index + first_case_value))
-                            switch_path.extend(sections[switch_table_entry])
-                            index = index + 1
-                            new_execution_paths.append(switch_path)
-                            visited_sections.add(switch_table_entry)
-
-                    # the default path is taken when no switch condition is met
-                    default_path = list(new_path)
-                    default_path.append("c: " + register_to_test + " < " + str(first_case_value) + " && " +
-                                        register_to_test + " >= " + str(index + first_case_value))
-                    default_path.extend(path)
-                    new_execution_paths.append(default_path)
-
-                    visited_sections.add(switch_table_offset)
-                    break
-                else:
-                    new_path.append(line)
-
-            if len(new_path) == lines_in_section:
-                new_execution_paths.append(new_path)
-
-        execution_paths = new_execution_paths
-
-    return execution_paths
+        if line.startswith(":"):
+            if not line.startswith(":try_"):
+                pending_labels.append(line)
+            continue
+
+        if line.startswith("."):
+            if line.startswith(".packed-switch") or line.startswith(".sparse-switch") or \
+                    line.startswith(".array-data"):
+                payload_targets = list()
+                for label in pending_labels:
+                    payloads[label] = payload_targets
+                pending_labels = list()
+            continue
+
+        instruction = decode_instruction(line)
+        opcode, registers = instruction[0], instruction[1]
+        if opcode is None:
+            continue
+
+        if len(pending_labels) > 0:
+            if len(blocks[-1].instructions) > 0:
+                blocks.append(BasicBlock())
+            for label in pending_labels:
+                labels[label] = len(blocks) - 1
+            pending_labels = list()
+
+        block = blocks[-1]
+        block.instructions.append(instruction)
+        if not is_block_end(opcode):
+            continue
+
+        target = line.split()[-1]
+        if opcode.startswith("if-"):
+            block.jump_targets.append(target)
+            block.tested_registers = registers
+        elif opcode.startswith("goto"):
+            block.jump_targets.append(target)
+            block.falls_through = False
+        elif opcode.endswith("-switch"):
+            block.switch_payload = target
+            block.tested_registers = registers
+        else:
+            block.falls_through = False
+        blocks.append(BasicBlock())
 
+    for index, block in enumerate(blocks):
+        targets = list(block.jump_targets)
+        if block.switch_payload is not None:
+            targets.extend(payloads.get(block.switch_payload, []))
+        for target in targets:
+            if target in labels and labels[target] not in block.successors:
+                block.successors.append(labels[target])
+        if block.falls_through and index + 1 < len(blocks) and index + 1 not in block.successors:
+            block.successors.append(index + 1)
+
+    return blocks
 
-class SqlInjectionChecker:
 
-    def __init__(self, apk_handler: ApkHandler):
+class SqlInjectionChecker:
+    """
+    Checks whether the values of some registers of a method reach an sql api call without being checked first.
+
+    A value is checked when a branch (if or switch) tests a register holding it. The values are tracked through moves
+    and into the methods of the app they are passed to, and the result of a call becomes tracked as well.
+
+    The summary of a called method is computed once per set of tracked parameters and reused by all its callers, so a
+    checker should be shared by all the checks of an app. The summaries that only depend on the class of the method are
+    also shared across apps through the summary cache.
+    """
+
+    def __init__(self, apk_handler: ApkHandler, max_call_depth=default_max_call_depth, budget: Budget = None,
+                 summary_cache=None):
+        """
+        :param max_call_depth: calls deeper than this are assumed not to reach an sql api call
+        :param budget: the budget of the checks, checked for every block explored
+        :param summary_cache: the SummaryCache the self-contained summaries are taken from and added to, if any
+        """
         self.apk_handler = apk_handler
+        self.budget = budget
+        self.max_call_depth = max_call_depth
+        self.summary_cache = summary_cache
+        self.summaries = dict()
+        self.in_progress = set()
 
     def check_method(self, method, tracked_variables):
-        execution_paths = build_execution_paths(method)
-        for path in execution_paths:
-            is_terminal, variables_dict, secondary_conditions = self.check_execution_path(path, tracked_variables)
-            if is_terminal:
-                primary_conditions = 0
-                for variable, conditions in variables_dict.items():
-                    primary_conditions += len(conditions)
-
-                if primary_conditions == 0 and len(secondary_conditions) == 0:
-                    return False
-        return True
-
-    def check_execution_path(self, path, tracked_variables: set):
-        variables_dict = dict()
-        secondary_conditions = list()
-        for variable in tracked_variables:
-            variables_dict[variable] = list()
-
-        store_move_result = False
-        for line in path:
-            tokens = line.split()
-            if line.startswith("move"):
-                instruction = tokens[0]
-
-                if instruction.startswith("move-result") or instruction == "move-exception":
-                    if store_move_result:
-                        tracked_variables.add(tokens[1])
-                        variables_dict[tokens[1]] = list()
-                else:
-                    dest_register = tokens[1].replace(",", "")
-                    src_register = tokens[-1]
-
-                    if src_register in tracked_variables:
-                        tracked_variables.add(dest_register)
-                        variables_dict[dest_register] = list()
-
-            elif line.startswith("const"):
-                dest_register = tokens[1].replace(",", "")
-                if dest_register in tracked_variables:
-                    tracked_variables.remove(dest_register)
-
-            elif line.startswith("invoke"):
-                invoke_args = re.findall("{.*}", line)[0][1:-1].replace(",", "").split()
-                called_object = re.findall("L.*;->", line)[0][1:-3].replace("/", ".")
-                called_method = re.findall("->.*\\(", line)[0][2:-1]
-                method_signature = re.findall("->.*\\(.*", line)[0][2:]
-                method_call = called_object + ":" + called_method
-
-                if is_sql_api_call(method_call):
-                    return True, variables_dict, secondary_conditions
-                else:
-                    argument_mapping = dict()
-                    rec_tracked_vars = set()
-                    for i in range(0, len(invoke_args)):
-                        if invoke_args[i] in tracked_variables:
-                            rec_var = "p" + str(i)
-                            argument_mapping[rec_var] = invoke_args[i]
-                            rec_tracked_vars.add(rec_var)
-                    if len(tracked_variables) != 0:
-                        store_move_result = True
-
-                        smali_path = self.apk_handler.get_smali_file_path(called_object)
-                        if smali_path is None:
-                            continue
-                        else:
-                            smali_handler = SmaliHandler(smali_path)
-                            method = smali_handler.get_method(method_signature)
-                            execution_paths = build_execution_paths(method)
-                            for path in execution_paths:
-                                reached_terminal, rec_vars_dict, rec_sec_cond = self.check_execution_path(path,
-                                                                                                          rec_tracked_vars)
-                                if reached_terminal:
-                                    secondary_conditions.extend(rec_sec_cond)
-                                    for key, value in rec_vars_dict.items():
-                                        if key in argument_mapping.keys():
-                                            map(lambda x: x + " IN " + method_call, value)
-                                            variables_dict[argument_mapping[key]].extend(value)
-
-                                    return True, variables_dict, secondary_conditions
-
-                    else:
+        """
+        :param method: the lines of the method
+        :param tracked_variables: the registers holding the values to track, e.g. {"p1"}
+        :return: False if an sql api call can be reached without the tracked values being checked, True otherwise
+        """
+        _, unchecked, _, _ = self.__summarise_method(method, tracked_variables, 0)
+        return not unchecked
+
+    def __summarise_call(self, called_object, method_signature, tracked_variables, depth):
+        """
+        Returns the summary of a called method of the app, see __summarise_method. The summaries are memoized by
+        method and tracked parameters. A recursive call to a method being summarised, and a call deeper than
+        max_call_depth, are assumed not to reach an sql api call; the summaries depending on such an assumption are
+        not memoized. The complete and self-contained summaries are added to the summary cache.
+        """
+        key = (called_object, method_signature, frozenset(tracked_variables))
+        summary = self.summaries.get(key, None)
+        if summary is not None:
+            return summary
+
+        if key in self.in_progress or depth > self.max_call_depth:
+            return False, False, False, False
+
+        class_handler = self.apk_handler.get_class_handler(called_object)
+        if class_handler is None:
+            return None
+
+        if self.summary_cache is not None:
+            cached_summary = self.summary_cache.get_sql_summary(class_handler, method_signature, tracked_variables)
+            if cached_summary is not None:
+                summary = cached_summary + (True, True)
+                self.summaries[key] = summary
+                return summary
+
+        self.in_progress.add(key)
+        try:
+            summary = self.__summarise_method(class_handler.get_method(method_signature), tracked_variables, depth,
+                                              called_object)
+        finally:
+            self.in_progress.remove(key)
+
+        if summary[2]:
+            self.summaries[key] = summary
+            if summary[3] and self.summary_cache is not None:
+                self.summary_cache.put_sql_summary(class_handler, method_signature, tracked_variables, summary[0],
+                                                   summary[1])
+        return summary
+
+    def __summarise_method(self, method, tracked_variables, depth, class_name=None):
+        """
+        Explores the control flow graph of the method with a worklist. The state of a path at the entry of a block is
+        the set of tracked registers, whether the result of the last call is tracked and whether a tracked value has been
+        checked. Each block is visited at most once per distinct state, and a path ends at the first sql api call it
+        reaches, or at the first call to a method of the app that reaches one.
+
+        :param class_name: the name of the class of the method, None if it is not summarised for the summary cache
+        :return: a tuple of whether an sql api call is reachable, whether it is reachable without the tracked values
+                 being checked, whether the summary is complete, i.e. no call was cut short by recursion or depth, and
+                 whether it is self-contained, i.e. it only depends on the class of the method and on the platform
+        """
+        blocks = build_control_flow_graph(method)
+        if len(blocks) == 0:
+            return False, False, True, True
+
+        reaches_sql = False
+        complete = True
+        self_contained = class_name is not None
+        start = (0, frozenset(tracked_variables), False, False)
+        visited = {start}
+        worklist = [start]
+
+        while len(worklist) > 0:
+            block_index, tracked, store_move_result, checked = worklist.pop()
+            if self.budget is not None:
+                self.budget.check()
+
+            block = blocks[block_index]
+            tracked = set(tracked)
+            terminated = False
+
+            for opcode, registers, called_object, called_method, method_signature in block.instructions:
+                if opcode.startswith("move"):
+                    if opcode.startswith("move-result") or opcode == "move-exception":
+                        if store_move_result:
+                            tracked.add(registers[0])
+                    elif registers[-1] in tracked:
+                        tracked.add(registers[0])
+
+                elif opcode.startswith("const"):
+                    tracked.discard(registers[0])
+
+                elif opcode.startswith("invoke") and called_object is not None:
+                    if is_sql_api_call(called_object + ":" + called_method):
+                        if not checked:
+                            return True, True, True, self_contained
+                        reaches_sql = True
+                        terminated = True
+                        break
+
+                    if len(tracked) == 0:
                         store_move_result = False
                         continue
 
-            elif tokens[0] == "c:":
-                tokens_set = set(tokens)
-                for variable in tracked_variables:
-                    if variable in tokens_set:
-                        variables_dict[variable].append(line)
-                        secondary_conditions.append(line)
+                    store_move_result = True
+
+                    # The tracked arguments become the tracked parameters of the called method
+                    called_tracked = set()
+                    for index, register in enumerate(registers):
+                        if register in tracked:
+                            called_tracked.add("p" + str(index))
+
+                    summary = self.__summarise_call(called_object, method_signature, called_tracked, depth + 1)
+                    if summary is None:
+                        # Whether another app defines the class only matters if it is not a platform class
+                        self_contained = self_contained and is_platform_class(called_object)
+                        continue
+
+                    called_reaches_sql, called_unchecked, called_complete, called_self_contained = summary
+                    complete = complete and called_complete
+                    self_contained = self_contained and called_self_contained and called_object == class_name
+                    if called_unchecked and not checked:
+                        return True, True, True, self_contained
+                    if called_reaches_sql:
+                        reaches_sql = True
+                        terminated = True
+                        break
+
+            if terminated:
+                continue
+
+            # A branch testing a tracked register checks the value on all the paths that follow
+            if any(register in tracked for register in block.tested_registers):
+                checked = True
+
+            for successor in block.successors:
+                state = (successor, frozenset(tracked), store_move_result, checked)
+                if state not in visited:
+                    visited.add(state)
+                    worklist.append(state)
 
-        return False, variables_dict, secondary_conditions
+        return reaches_sql, False, complete, self_contained
@@ -0,0 +1,148 @@
+import json
+import sqlite3
+
+from cp55 import analyser_version
+
+summary_cache_schema = """
+CREATE TABLE IF NOT EXISTS invoked_methods
+(
+    class_key       TEXT PRIMARY KEY,
+    invoked_methods TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sql_summaries
+(
+    class_key   TEXT,
+    method      TEXT,
+    tracked     TEXT,
+    reaches_sql BOOLEAN,
+    unchecked   BOOLEAN,
+    PRIMARY KEY (class_key, method, tracked)
+);
+"""
+
+# Number of new summaries held in memory before they are written to the cache
+default_write_batch = 512
+
+
+class SummaryCache:
+    """
+    Corpus-wide cache of the summaries of classes, shared by all the apps of a sweep and by the worker processes
+    analysing them, so that the library classes bundled by many apps are only analysed once.
+
+    The summaries are keyed by the hash of the content of a class and the analyser version, so that a class is only
+    reused when it is identical. Two kinds of summaries are kept: the invocations of the methods of a class, used to
+    build the call graph, and the sql taint summaries of its methods, see SqlInjectionChecker. Only the taint summaries
+    that do not depend on other classes are stored, as the other classes may differ from one app to another.
+
+    The classes read by the dex backend have no content hash, as their bytecode refers to the tables of their dex file,
+    and bypass the cache.
+    """
+
+    def __init__(self, path, write_batch=default_write_batch):
+        """
+        :param path: the SQLite file holding the cache, created if missing
+        :param write_batch: the number of new summaries written together
+        """
+        self.write_batch = max(1, write_batch)
+        self.__connection = sqlite3.connect(path, timeout=60)
+        self.__connection.execute("PRAGMA journal_mode=WAL;")
+        self.__connection.executescript(summary_cache_schema)
+        self.__pending_invoked_methods = list()
+        self.__pending_sql_summaries = list()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_invoked_methods(self, class_handler):
+        """
+        :return: dict mapping the method names of the class to dicts mapping the called class names to the called
+                 method names, as class_handler.invoked_methods does, or None if the class is not in the cache
+        """
+        class_key = get_class_key(class_handler)
+        if class_key is None:
+            return None
+
+        row = self.__connection.execute("SELECT invoked_methods FROM invoked_methods WHERE class_key = ?;",
+                                        (class_key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put_invoked_methods(self, class_handler, invoked_methods):
+        class_key = get_class_key(class_handler)
+        if class_key is None:
+            return
+
+        serialisable = {method: {called_class: sorted(called_methods)
+                                 for called_class, called_methods in invocations.items()}
+                        for method, invocations in invoked_methods.items()}
+        self.__pending_invoked_methods.append((class_key, json.dumps(serialisable, separators=(",", ":"))))
+        self.__write_if_full()
+
+    def get_sql_summary(self, class_handler, method_signature, tracked_variables):
+        """
+        :return: a tuple of whether an sql api call is reachable and whether it is reachable without the tracked values
+                 being checked, or None if the summary is not in the cache
+        """
+        class_key = get_class_key(class_handler)
+        if class_key is None:
+            return None
+
+        row = self.__connection.execute("SELECT reaches_sql, unchecked FROM sql_summaries "
+                                        "WHERE class_key = ? AND method = ? AND tracked = ?;",
+                                        (class_key, method_signature, format_tracked(tracked_variables))).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return bool(row[0]), bool(row[1])
+
+    def put_sql_summary(self, class_handler, method_signature, tracked_variables, reaches_sql, unchecked):
+        class_key = get_class_key(class_handler)
+        if class_key is None:
+            return
+
+        self.__pending_sql_summaries.append((class_key, method_signature, format_tracked(tracked_variables),
+                                             reaches_sql, unchecked))
+        self.__write_if_full()
+
+    def __write_if_full(self):
+        if len(self.__pending_invoked_methods) + len(self.__pending_sql_summaries) >= self.write_batch:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the new summaries to the cache. A summary written concurrently by another process is kept.
+        """
+        if len(self.__pending_invoked_methods) + len(self.__pending_sql_summaries) == 0:
+            return
+
+        with self.__connection:
+            self.__connection.executemany("INSERT OR IGNORE INTO invoked_methods VALUES (?, ?);",
+                                          self.__pending_invoked_methods)
+            self.__connection.executemany("INSERT OR IGNORE INTO sql_summaries VALUES (?, ?, ?, ?, ?);",
+                                          self.__pending_sql_summaries)
+        self.__pending_invoked_methods = list()
+        self.__pending_sql_summaries = list()
+
+    def close(self):
+        self.flush()
+        self.__connection.close()
+
+
+def get_class_key(class_handler):
+    """
+    :return: the key of the class in the cache, None if the class cannot be cached
+    """
+    if class_handler.content_hash is None:
+        return None
+    return analyser_version + ":" + class_handler.content_hash
+
+
+def format_tracked(tracked_variables):
+    return ",".join(sorted(tracked_variables))
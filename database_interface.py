@@ -1,112 +1,262 @@
 import os
+import threading
 
 import mysql.connector
-import pprint
+import mysql.connector.pooling
 
+from result_sinks import ConsoleSink, JsonlSink, ParquetSink, ResultSink, SqliteSink, UpdatableSink
 
-class DatabaseInterface:
+# Re-analysed apps keep their row, LAST_INSERT_ID(id) makes lastrowid return its id
+insert_app_query = "INSERT INTO apps (package_name, analysis_status) VALUES (%s, %s) " \
+                   "ON DUPLICATE KEY UPDATE analysis_status = VALUES(analysis_status), id = LAST_INSERT_ID(id);"
+
+insert_components_query = "INSERT INTO components (app_id, name, type, enabled, exported, direct_boot_aware, " \
+                          "filter_matches, permission, authorities, grant_uri_permission, write_permission, " \
+                          "read_permission, has_sql, foreground_service_type) " \
+                          "VALUES (%(app_id)s, %(name)s, %(type)s, %(enabled)s, %(exported)s, " \
+                          "%(direct_boot_aware)s, %(filter_matches)s, %(permission)s, %(authorities)s, " \
+                          "%(grant_uri_permission)s, %(write_permission)s, %(read_permission)s, %(has_sql)s, " \
+                          "%(foreground_service_type)s);"
+
+insert_sql_checks_query = "INSERT INTO sql_checks (app_id, provider_name, method_name, has_query_checks, " \
+                          "has_uri_checks)" \
+                          "VALUES (%(app_id)s, %(provider_name)s, %(method_name)s, %(has_query_checks)s, " \
+                          "%(has_uri_checks)s);"
+
+# A re-analysed app replaces its previous components and sql checks
+delete_components_query = "DELETE FROM components WHERE app_id = %s;"
+delete_sql_checks_query = "DELETE FROM sql_checks WHERE app_id = %s;"
+
+update_app_analysis_status_query = "UPDATE apps SET analysis_status = %s WHERE id = %s;"
+
+update_filter_matches_query = "UPDATE components SET filter_matches = %s " \
+                              "WHERE app_id = (SELECT id FROM apps WHERE package_name = %s) " \
+                              "AND name = %s AND type = %s;"
+
+default_pool_size = 4
+
+
+class MySqlSink(UpdatableSink):
+    """
+    Stores the results in the MySQL database.
+
+    The connections are taken from a pool that is opened on first use, and are given back to it after each operation.
+    The results of an app are written in a single transaction by store_app_results, which can also group the
+    transactions of several apps into one commit.
+    """
 
-    def __init__(self):
+    def __init__(self, pool_size=default_pool_size, group_commit=1):
+        """
+        :param pool_size: the maximum number of open connections
+        :param group_commit: the number of apps whose results are committed together by store_app_results
+        """
         self.endpoint = "cp55.ckxgs3folg2a.eu-west-1.rds.amazonaws.com"
         self.port = "3306"
         self.user = "admin"
         self.passwd = os.getenv("CP55PASSWD")
         self.db_name = "cp55"
 
+        self.pool_size = pool_size
+        self.group_commit = max(1, group_commit)
+        self.__pool = None
+        self.__pool_lock = threading.Lock()
+        self.__batch_connection = None
+        self.__pending = list()
+
     def get_connection(self):
+        """
+        Takes a connection from the pool, opening the pool if needed. The connection goes back to the pool when it is
+        closed.
+        """
         if self.passwd is None:
             return None
 
         try:
-            conn = mysql.connector.connect(host=self.endpoint, user=self.user, passwd=self.passwd,
-                                           port=self.port, database=self.db_name)
-            return conn
+            with self.__pool_lock:
+                if self.__pool is None:
+                    self.__pool = mysql.connector.pooling.MySQLConnectionPool(
+                        pool_name="cp55", pool_size=self.pool_size, host=self.endpoint, user=self.user,
+                        passwd=self.passwd, port=self.port, database=self.db_name)
+            return self.__pool.get_connection()
         except Exception as e:
             print("Database connection failed due to {}".format(e))
 
-    def insert_app(self, package_name, analysis_status):
-        query = "INSERT INTO apps (package_name, analysis_status) VALUES (%s, %s);"
-        values = (package_name, analysis_status)
-
+    def __fetch_one(self, query, values):
         conn = self.get_connection()
         if conn is None:
-            pprint.pp("App: " + package_name + ". analysis status: " + analysis_status)
-            return
-
-        cursor = conn.cursor()
-        cursor.execute(query, values)
-
-        conn.commit()
-
-        return cursor.lastrowid
-
-    def insert_components(self, app_id, components):
-        for component in components:
-            component["app_id"] = app_id
-
-        query = "INSERT INTO components (app_id, name, type, enabled, exported, direct_boot_aware, filter_matches, " \
-                "permission, authorities, grant_uri_permission, write_permission, read_permission, has_sql, " \
-                "foreground_service_type) " \
-                "VALUES (%(app_id)s, %(name)s, %(type)s, %(enabled)s, %(exported)s, %(direct_boot_aware)s, " \
-                "%(filter_matches)s, %(permission)s, %(authorities)s, %(grant_uri_permission)s, " \
-                "%(write_permission)s, %(read_permission)s, %(has_sql)s, %(foreground_service_type)s);"
-
-        conn = self.get_connection()
-        if conn is None:
-            pprint.pp(components)
-            return
-
-        cursor = conn.cursor()
-        cursor.executemany(query, components)
-
-        conn.commit()
-
-        return cursor.lastrowid
-
-    def insert_sql_checks(self, app_id, sql_checks):
-        for sql_check in sql_checks:
-            sql_check["app_id"] = app_id
-
-        query = "INSERT INTO sql_checks (app_id, provider_name, method_name, has_query_checks, has_uri_checks)" \
-                "VALUES (%(app_id)s, %(provider_name)s, %(method_name)s, %(has_query_checks)s, %(has_uri_checks)s);"
+            return None
 
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, values)
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return row[0]
+        finally:
+            conn.close()
+
+    def store_app_results(self, package_name, analysis_status, components, sql_checks=None, final_status=None):
+        """
+        Stores the row of an app, its components, its sql checks and its final status in a single transaction, so that
+        an app is either stored entirely or not at all. The components and sql checks of a previous analysis of the app
+        are replaced.
+
+        With group commit, the transaction is committed once group_commit apps are pending; the apps stored since the
+        last commit are lost if the process dies before it. Each app is written behind its own savepoint, so a failing
+        app does not undo the other pending ones.
+
+        :param final_status: the status the app ends with, e.g. "full" once its sql checks are stored, defaults to
+                             analysis_status
+        :return: the list of (package name, final status) of the apps committed by this call
+        """
+        final_status = final_status if final_status is not None else analysis_status
+
+        if self.__batch_connection is None:
+            self.__batch_connection = self.get_connection()
+            if self.__batch_connection is None:
+                raise IOError("Database connection failed")
+
+        cursor = self.__batch_connection.cursor()
+        try:
+            cursor.execute("SAVEPOINT app_results;")
+            cursor.execute(insert_app_query, (package_name, analysis_status))
+            app_id = cursor.lastrowid
+            cursor.execute(delete_components_query, (app_id,))
+            cursor.execute(delete_sql_checks_query, (app_id,))
+
+            for component in components:
+                component["app_id"] = app_id
+            if len(components) > 0:
+                cursor.executemany(insert_components_query, components)
+
+            if sql_checks is not None:
+                for sql_check in sql_checks:
+                    sql_check["app_id"] = app_id
+                if len(sql_checks) > 0:
+                    cursor.executemany(insert_sql_checks_query, sql_checks)
+
+            if final_status != analysis_status:
+                cursor.execute(update_app_analysis_status_query, (final_status, app_id))
+        except Exception:
+            try:
+                cursor.execute("ROLLBACK TO SAVEPOINT app_results;")
+            except Exception:
+                # The connection is unusable, the pending apps are dropped and will be analysed again
+                cursor.close()
+                self.__pending = list()
+                self.__batch_connection.close()
+                self.__batch_connection = None
+            raise
+        finally:
+            if self.__batch_connection is not None:
+                cursor.close()
+
+        self.__pending.append((package_name, final_status))
+        if len(self.__pending) >= self.group_commit:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Commits the apps stored by store_app_results since the last commit.
+
+        :return: the list of (package name, final status) of the committed apps
+        """
+        committed = self.__pending
+        self.__pending = list()
+
+        if self.__batch_connection is not None:
+            try:
+                self.__batch_connection.commit()
+            finally:
+                self.__batch_connection.close()
+                self.__batch_connection = None
+
+        return committed
+
+    def close(self):
+        """
+        Commits the pending apps and gives the connection back to the pool.
+
+        :return: see flush
+        """
+        return self.flush()
+
+    def get_app_analysis_status(self, package_name):
+        query = "SELECT analysis_status FROM apps WHERE package_name = %s;"
+        return self.__fetch_one(query, (package_name,))
+
+    def update_filter_matches(self, package_name, filter_matches):
         conn = self.get_connection()
         if conn is None:
-            pprint.pp(sql_checks)
-            return
-
-        cursor = conn.cursor()
-        cursor.executemany(query, sql_checks)
+            raise IOError("Database connection failed")
 
-        conn.commit()
-
-        return cursor.lastrowid
-
-    def update_app_analysis_status(self, app_id, status):
-        query = "UPDATE apps SET analysis_status = %s WHERE id = %s;"
-        values = (status, app_id)
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(update_filter_matches_query, [(matches, package_name, name, component_type)
+                                                             for name, component_type, matches in filter_matches])
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def create_sink(sink_spec=None, group_commit=1):
+    """
+    Creates the sink described by a command line specification:
+    - "mysql": the MySQL database, whose password is taken from the CP55PASSWD env variable
+    - "console": prints the results
+    - "sqlite:PATH", "jsonl:PATH" and "parquet:DIRECTORY": local files, see result_sinks.py
+    Without a specification, the MySQL database is used if its password is set, the console otherwise.
+
+    :param group_commit: the number of apps whose results are committed together, for the sinks that support it
+    """
+    if sink_spec is None:
+        sink_spec = "mysql" if os.getenv("CP55PASSWD") is not None else "console"
+
+    kind, _, path = sink_spec.partition(":")
+    if kind == "mysql":
+        return MySqlSink(group_commit=group_commit)
+    if kind == "console":
+        return ConsoleSink()
+    if kind == "sqlite":
+        return SqliteSink(path, group_commit)
+    if kind == "jsonl":
+        return JsonlSink(path)
+    if kind == "parquet":
+        return ParquetSink(path)
+    raise ValueError("Unknown sink " + sink_spec)
 
-        conn = self.get_connection()
-        if conn is None:
-            return
 
-        cursor = conn.cursor()
-        cursor.execute(query, values)
+class DatabaseInterface:
+    """
+    Class responsible for storing the analysis results, in the sink given to the constructor. See ResultSink for the
+    meaning of the returned lists of committed apps.
+    """
 
-        conn.commit()
+    def __init__(self, sink: ResultSink = None):
+        """
+        :param sink: defaults to the MySQL database if its password is set, to the console otherwise
+        """
+        self.sink = sink if sink is not None else create_sink()
 
-        return cursor.lastrowid
+    def insert_app(self, package_name, analysis_status):
+        """
+        Stores an app without components, e.g. one whose download failed.
+        """
+        return self.sink.store_app_results(package_name, analysis_status, [])
 
-    def get_app_id_by_package_name(self, package_name):
-        query = "SELECT id FROM apps WHERE package_name = %s;"
+    def store_app_results(self, package_name, analysis_status, components, sql_checks=None, final_status=None):
+        return self.sink.store_app_results(package_name, analysis_status, components, sql_checks, final_status)
 
-        conn = self.get_connection()
-        if conn is None:
-            return
+    def get_app_analysis_status(self, package_name):
+        return self.sink.get_app_analysis_status(package_name)
 
-        cursor = conn.cursor()
-        cursor.execute(query, (package_name,))
+    def update_filter_matches(self, package_name, filter_matches):
+        self.sink.update_filter_matches(package_name, filter_matches)
 
-        app_id = cursor.fetchone()
+    def flush(self):
+        return self.sink.flush()
 
-        return app_id[0]
+    def close(self):
+        return self.sink.close()
@@ -2,7 +2,7 @@ CREATE TABLE apps
 (
     id              INT NOT NULL AUTO_INCREMENT,
     package_name    VARCHAR(255) UNIQUE,
-    analysis_status ENUM ('full', 'background', 'sql', 'download_failed', 'failed'),
+    analysis_status ENUM ('full', 'background', 'sql', 'download_failed', 'failed', 'timeout', 'partial'),
     PRIMARY KEY (id)
 );
 
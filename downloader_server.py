@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import json
+import os
+import re
+import shutil
+import socketserver
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Only uses the standard library and PlaystoreDownloader, so that it runs in the downloader image on its own
+
+default_port = 5555
+default_concurrency = 4
+apk_file_extension = ".apk"
+
+package_name_pattern = re.compile(r"^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$")
+
+
+class PlaystoreSource:
+    """
+    Downloads the apks from the PlayStore with PlaystoreDownloader, logged in once for the lifetime of the server.
+    """
+
+    def __init__(self, credentials):
+        from playstore.playstore import Playstore
+
+        self.api = Playstore(credentials)
+
+    def fetch(self, package_name, path):
+        if not self.api.download(package_name, path):
+            raise Exception("the PlayStore did not serve the apk")
+
+
+class DirectorySource:
+    """
+    Serves the apks of a local directory, named after their package, in place of the PlayStore, e.g. for testing.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, package_name, path):
+        shutil.copyfile(os.path.join(self.directory, package_name + apk_file_extension), path)
+
+
+class DownloadService:
+    """
+    Downloads the apks requested by the clients into the download directory, at most concurrency of them at a time
+    whatever the number of clients.
+    """
+
+    def __init__(self, source, download_directory, concurrency=default_concurrency):
+        self.source = source
+        self.download_directory = download_directory
+        self.__executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="download")
+        self.__temporary_numbers = itertools.count()
+
+    def download(self, package_names):
+        """
+        :return: the results of the downloads of the given packages, in the order they finish
+        """
+        futures = [self.__executor.submit(self.__download, package_name) for package_name in package_names]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def __download(self, package_name):
+        """
+        The apk is written to a temporary file renamed once complete, so that a client never reads a partial apk.
+
+        :return: a dict of the package, its status ("downloaded" or "failed"), and either the name of the apk in the
+                 download directory, its size and the duration of the download, or the error
+        """
+        if not isinstance(package_name, str) or package_name_pattern.match(package_name) is None:
+            return {"package": str(package_name), "status": "failed", "error": "invalid package name"}
+
+        file_name = package_name + apk_file_extension
+        path = os.path.join(self.download_directory, file_name)
+        temporary_path = path + "." + str(next(self.__temporary_numbers)) + ".part"
+
+        start = time.monotonic()
+        try:
+            self.source.fetch(package_name, temporary_path)
+            os.replace(temporary_path, path)
+        except Exception as e:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return {"package": package_name, "status": "failed", "error": str(e) or type(e).__name__}
+
+        return {"package": package_name, "status": "downloaded", "file": file_name, "size": os.path.getsize(path),
+                "seconds": round(time.monotonic() - start, 3)}
+
+
+class DownloadRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a connection carrying one request: a json line {"packages": [...]}. The result of every package is written
+    back as a json line as soon as its download finishes, see DownloadService.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            package_names = request["packages"]
+        except (ValueError, KeyError, TypeError):
+            self.__write({"error": "invalid request"})
+            return
+
+        for result in self.server.service.download(package_names):
+            self.__write(result)
+
+    def __write(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode())
+        self.wfile.flush()
+
+
+class DownloadServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, service):
+        super().__init__(address, DownloadRequestHandler)
+        self.service = service
+
+    def handle_error(self, request, client_address):
+        print("Failed to serve the request of " + str(client_address) + ".")
+        traceback.print_exc()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Long-lived downloader of apks, which keeps its PlayStore session and "
+                                                 "serves the requests of apk_analyser.py --downloader.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address the server listens on, 0.0.0.0 when it runs in a container")
+    parser.add_argument("--port", type=int, default=default_port, help="port the server listens on")
+    parser.add_argument("--downloads", default="output/", help="directory the apks are downloaded to")
+    parser.add_argument("--concurrency", type=int, default=default_concurrency,
+                        help="maximum number of apks downloaded at the same time")
+    parser.add_argument("--credentials", default="credentials.json",
+                        help="the credentials of PlaystoreDownloader")
+    parser.add_argument("--stub", metavar="DIRECTORY",
+                        help="serve the apks of a directory, named <package>.apk, instead of the PlayStore")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+
+    os.makedirs(arguments.downloads, exist_ok=True)
+    if arguments.stub is not None:
+        source = DirectorySource(arguments.stub)
+    else:
+        source = PlaystoreSource(arguments.credentials)
+
+    service = DownloadService(source, arguments.downloads, arguments.concurrency)
+    with DownloadServer((arguments.host, arguments.port), service) as server:
+        print("Serving downloads on " + arguments.host + ":" + str(arguments.port) + ".")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
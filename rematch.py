@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+from cp55.filter_matcher import compile_filter
+from cp55.invocation_artifact import artifact_extension, get_artifact_path, match_artifact
+from database_interface import DatabaseInterface, create_sink
+from result_sinks import UpdatableSink
+
+worker_state = dict()
+
+
+def init_worker(inspection_filter, artifact_directory):
+    worker_state["filter_matcher"] = compile_filter(inspection_filter)
+    worker_state["artifact_directory"] = artifact_directory
+
+
+def match_package(package_name):
+    """
+    :return: a tuple of the package name and the filter matches of its components, None if its artifact cannot be read
+    """
+    try:
+        path = get_artifact_path(worker_state["artifact_directory"], package_name)
+        return package_name, match_artifact(path, worker_state["filter_matcher"])
+    except (OSError, ValueError) as e:
+        print("Failed to read the artifact of app " + package_name + " due to {}".format(e))
+        return package_name, None
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Matches the invocations saved by apk_analyser.py --artifacts "
+                                                 "against a filter, and updates the filter matches of the stored "
+                                                 "components without decoding the apps again.")
+    parser.add_argument("artifacts", help="the directory of the artifacts")
+    parser.add_argument("packages", nargs="*", help="the apps to match, all the apps of the directory if missing")
+    parser.add_argument("--filter", default="filter.json", help="the filter the components are matched against")
+    parser.add_argument("--sink",
+                        help="where the components are updated: mysql, console or sqlite:PATH, the jsonl and parquet "
+                             "sinks cannot be updated; defaults to mysql if CP55PASSWD is set, to console otherwise")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes matching the artifacts")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+
+    sink = create_sink(arguments.sink)
+    if not isinstance(sink, UpdatableSink):
+        print("The " + type(sink).__name__ + " cannot update stored results, use mysql, console or sqlite:PATH.")
+        sink.close()
+        exit(1)
+
+    with open(arguments.filter, "r") as inspection_filter_file:
+        inspection_filter = json.load(inspection_filter_file)
+
+    packages = arguments.packages
+    if len(packages) == 0:
+        packages = sorted(file_name[:-len(artifact_extension)] for file_name in os.listdir(arguments.artifacts)
+                          if file_name.endswith(artifact_extension))
+    print("Matching " + str(len(packages)) + " app(s).")
+
+    db = DatabaseInterface(sink)
+    updated = 0
+    with Pool(processes=arguments.workers, initializer=init_worker,
+              initargs=(inspection_filter, arguments.artifacts)) as pool:
+        for package_name, filter_matches in pool.imap_unordered(match_package, packages, chunksize=16):
+            if filter_matches is None:
+                continue
+
+            try:
+                db.update_filter_matches(package_name, filter_matches)
+                updated += 1
+            except Exception as e:
+                print("Failed to update the components of app " + package_name + " due to {}".format(e))
+    db.close()
+
+    print("Updated the components of " + str(updated) + " app(s).")
+
+
+if __name__ == "__main__":
+    main()
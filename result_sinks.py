@@ -0,0 +1,340 @@
+import abc
+import json
+import os
+import pprint
+import sqlite3
+import threading
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+component_columns = ["name", "type", "enabled", "exported", "direct_boot_aware", "filter_matches", "permission",
+                     "authorities", "grant_uri_permission", "write_permission", "read_permission", "has_sql",
+                     "foreground_service_type"]
+sql_check_columns = ["provider_name", "method_name", "has_query_checks", "has_uri_checks"]
+
+# The tables of database_schema.sql, in SQLite's dialect
+sqlite_schema = """
+CREATE TABLE IF NOT EXISTS apps
+(
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    package_name    TEXT UNIQUE,
+    analysis_status TEXT CHECK (analysis_status IN ('full', 'background', 'sql', 'download_failed', 'failed',
+                                                    'timeout', 'partial'))
+);
+
+CREATE TABLE IF NOT EXISTS components
+(
+    id                      INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_id                  INTEGER REFERENCES apps (id),
+    name                    TEXT,
+    type                    TEXT CHECK (type IN ('activity', 'provider', 'service', 'receiver')),
+    enabled                 BOOLEAN,
+    exported                BOOLEAN,
+    direct_boot_aware       BOOLEAN,
+    filter_matches          JSON,
+    permission              TEXT,
+    authorities             TEXT,
+    grant_uri_permission    TEXT,
+    write_permission        TEXT,
+    read_permission         TEXT,
+    has_sql                 BOOLEAN,
+    foreground_service_type TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sql_checks
+(
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_id           INTEGER REFERENCES apps (id),
+    provider_name    TEXT,
+    method_name      TEXT,
+    has_query_checks BOOLEAN,
+    has_uri_checks   BOOLEAN
+);
+"""
+
+sqlite_insert_app_query = "INSERT INTO apps (package_name, analysis_status) VALUES (?, ?) " \
+                          "ON CONFLICT (package_name) DO UPDATE SET analysis_status = excluded.analysis_status;"
+sqlite_insert_components_query = "INSERT INTO components (app_id, " + ", ".join(component_columns) + ") VALUES (" + \
+                                 ", ".join(":" + column for column in ["app_id"] + component_columns) + ");"
+sqlite_insert_sql_checks_query = "INSERT INTO sql_checks (app_id, " + ", ".join(sql_check_columns) + ") VALUES (" + \
+                                 ", ".join(":" + column for column in ["app_id"] + sql_check_columns) + ");"
+sqlite_delete_components_query = "DELETE FROM components WHERE app_id = ?;"
+sqlite_delete_sql_checks_query = "DELETE FROM sql_checks WHERE app_id = ?;"
+sqlite_update_filter_matches_query = "UPDATE components SET filter_matches = ? " \
+                                     "WHERE app_id = (SELECT id FROM apps WHERE package_name = ?) " \
+                                     "AND name = ? AND type = ?;"
+
+
+class ResultSink(abc.ABC):
+    """
+    Destination of the analysis results, see DatabaseInterface.
+
+    The results of an app are stored together by store_app_results. A sink may hold them back until flush, in which
+    case store_app_results returns the apps it did not commit yet; the callers only consider an app stored once it is
+    returned by store_app_results, flush or close.
+    """
+
+    @abc.abstractmethod
+    def store_app_results(self, package_name, analysis_status, components, sql_checks=None, final_status=None):
+        """
+        Stores the results of an app.
+
+        :param components: the list of component results, see ComponentInspector.inspect_background_components
+        :param sql_checks: the list of sql checks, see ComponentInspector.inspect_providers_for_sql_injection
+        :param final_status: the status the app ends with, defaults to analysis_status
+        :return: the list of (package name, final status) of the apps committed by this call
+        """
+
+    def get_app_analysis_status(self, package_name):
+        """
+        :return: the stored status of the app, or None if it is unknown to the sink
+        """
+        return None
+
+    def flush(self):
+        """
+        :return: the list of (package name, final status) of the apps committed by this call
+        """
+        return []
+
+    def close(self):
+        """
+        Commits the results held back and releases the resources of the sink.
+
+        :return: see flush
+        """
+        return self.flush()
+
+
+class UpdatableSink(ResultSink):
+    """
+    Sink whose stored results can be updated in place, the only kind rematch.py can write to.
+    """
+
+    @abc.abstractmethod
+    def update_filter_matches(self, package_name, filter_matches):
+        """
+        Replaces the filter matches of the stored components of an app, see rematch.py.
+
+        :param filter_matches: list of tuples of the name, the type and the filter matches of each component
+        """
+
+
+class ConsoleSink(UpdatableSink):
+    """
+    Prints the results, used when no other sink is configured.
+    """
+
+    def store_app_results(self, package_name, analysis_status, components, sql_checks=None, final_status=None):
+        pprint.pp("App: " + package_name + ". analysis status: " + analysis_status)
+        pprint.pp(components)
+        if sql_checks is not None:
+            pprint.pp(sql_checks)
+        return [(package_name, final_status if final_status is not None else analysis_status)]
+
+    def update_filter_matches(self, package_name, filter_matches):
+        pprint.pp("App: " + package_name + ". filter matches:")
+        pprint.pp(filter_matches)
+
+
+class SqliteSink(UpdatableSink):
+    """
+    Stores the results in a local SQLite file with the tables of database_schema.sql. Several processes can share the
+    file, SQLite serialises their transactions.
+    """
+
+    def __init__(self, path, group_commit=1):
+        """
+        :param group_commit: the number of apps whose results are committed together
+        """
+        self.group_commit = max(1, group_commit)
+        self.__connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.__connection.executescript(sqlite_schema)
+        self.__lock = threading.Lock()
+        self.__pending = list()
+
+    def store_app_results(self, package_name, analysis_status, components, sql_checks=None, final_status=None):
+        final_status = final_status if final_status is not None else analysis_status
+
+        with self.__lock:
+            cursor = self.__connection.cursor()
+            # Releasing a savepoint outside of a transaction would commit it
+            if not self.__connection.in_transaction:
+                cursor.execute("BEGIN;")
+            cursor.execute("SAVEPOINT app_results;")
+            try:
+                cursor.execute(sqlite_insert_app_query, (package_name, final_status))
+                app_id = cursor.execute("SELECT id FROM apps WHERE package_name = ?;", (package_name,)).fetchone()[0]
+                # A re-analysed app replaces its previous components and sql checks
+                cursor.execute(sqlite_delete_components_query, (app_id,))
+                cursor.execute(sqlite_delete_sql_checks_query, (app_id,))
+
+                for component in components:
+                    component["app_id"] = app_id
+                cursor.executemany(sqlite_insert_components_query, components)
+
+                if sql_checks is not None:
+                    for sql_check in sql_checks:
+                        sql_check["app_id"] = app_id
+                    cursor.executemany(sqlite_insert_sql_checks_query, sql_checks)
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT app_results;")
+                cursor.execute("RELEASE SAVEPOINT app_results;")
+                raise
+            cursor.execute("RELEASE SAVEPOINT app_results;")
+
+            self.__pending.append((package_name, final_status))
+            if len(self.__pending) < self.group_commit:
+                return []
+            return self.__commit()
+
+    def __commit(self):
+        committed = self.__pending
+        self.__pending = list()
+        try:
+            self.__connection.commit()
+        except Exception:
+            # A failed commit leaves the transaction open, the pending apps are dropped so they can be stored again
+            self.__connection.rollback()
+            raise
+        return committed
+
+    def get_app_analysis_status(self, package_name):
+        with self.__lock:
+            row = self.__connection.execute("SELECT analysis_status FROM apps WHERE package_name = ?;",
+                                            (package_name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def update_filter_matches(self, package_name, filter_matches):
+        with self.__lock:
+            self.__connection.executemany(sqlite_update_filter_matches_query,
+                                          [(matches, package_name, name, component_type)
+                                           for name, component_type, matches in filter_matches])
+            self.__connection.commit()
+
+    def flush(self):
+        with self.__lock:
+            return self.__commit()
+
+    def close(self):
+        committed = self.flush()
+        self.__connection.close()
+        return committed
+
+
+class JsonlSink(ResultSink):
+    """
+    Streams the results to a file, one json line per app holding its row of the apps table along with its components
+    and its sql checks. Each line is flushed as soon as it is written.
+    """
+
+    def __init__(self, path):
+        self.__file = open(path, "a")
+        self.__lock = threading.Lock()
+
+    def store_app_results(self, package_name, analysis_status, components, sql_checks=None, final_status=None):
+        final_status = final_status if final_status is not None else analysis_status
+        line = json.dumps({"package_name": package_name, "analysis_status": final_status,
+                           "components": [{column: component.get(column, None) for column in component_columns}
+                                          for component in components],
+                           "sql_checks": [{column: sql_check.get(column, None) for column in sql_check_columns}
+                                          for sql_check in sql_checks or []]}) + "\n"
+
+        with self.__lock:
+            self.__file.write(line)
+            self.__file.flush()
+        return [(package_name, final_status)]
+
+    def close(self):
+        self.__file.close()
+        return []
+
+
+class ParquetSink(ResultSink):
+    """
+    Writes the results as Parquet files, one per table and batch of apps, in a directory. The components and sql
+    checks refer to their app by package name, since the files of different workers are merged later.
+
+    Requires pyarrow. The apps of a batch are only committed once its files are written, by flush or once batch_size
+    apps are pending.
+    """
+
+    def __init__(self, directory, batch_size=1000):
+        """
+        :param batch_size: the number of apps written in each file
+        """
+        if pyarrow is None:
+            raise ImportError("The parquet sink requires pyarrow")
+
+        self.directory = directory
+        self.batch_size = max(1, batch_size)
+        os.makedirs(directory, exist_ok=True)
+
+        string = pyarrow.string()
+        boolean = pyarrow.bool_()
+        self.schemas = {
+            "apps": pyarrow.schema([("package_name", string), ("analysis_status", string)]),
+            "components": pyarrow.schema([("package_name", string), ("name", string), ("type", string),
+                                          ("enabled", boolean), ("exported", boolean),
+                                          ("direct_boot_aware", boolean), ("filter_matches", string),
+                                          ("permission", string), ("authorities", string),
+                                          ("grant_uri_permission", string), ("write_permission", string),
+                                          ("read_permission", string), ("has_sql", boolean),
+                                          ("foreground_service_type", string)]),
+            "sql_checks": pyarrow.schema([("package_name", string), ("provider_name", string),
+                                          ("method_name", string), ("has_query_checks", boolean),
+                                          ("has_uri_checks", boolean)])
+        }
+
+        self.__rows = {table: list() for table in self.schemas.keys()}
+        self.__pending = list()
+        self.__batches = 0
+        self.__lock = threading.Lock()
+
+    def store_app_results(self, package_name, analysis_status, components, sql_checks=None, final_status=None):
+        final_status = final_status if final_status is not None else analysis_status
+
+        with self.__lock:
+            self.__rows["apps"].append({"package_name": package_name, "analysis_status": final_status})
+            for component in components:
+                row = {column: component.get(column, None) for column in component_columns}
+                row["package_name"] = package_name
+                self.__rows["components"].append(row)
+            for sql_check in sql_checks or []:
+                row = {column: sql_check.get(column, None) for column in sql_check_columns}
+                row["package_name"] = package_name
+                self.__rows["sql_checks"].append(row)
+
+            self.__pending.append((package_name, final_status))
+            if len(self.__pending) < self.batch_size:
+                return []
+            return self.__write_batch()
+
+    def __write_batch(self):
+        if len(self.__pending) == 0:
+            return []
+
+        # The rows are dropped even if a file cannot be written, so that the failed apps can be stored again
+        tables = dict()
+        for table, rows in self.__rows.items():
+            tables[table] = pyarrow.Table.from_pylist(rows, schema=self.schemas[table])
+            rows.clear()
+        committed = self.__pending
+        self.__pending = list()
+
+        # The apps table is written last, so an app in it has its components and sql checks written as well
+        for table in ("components", "sql_checks", "apps"):
+            path = os.path.join(self.directory, table + "-" + str(os.getpid()) + "-" + str(self.__batches) +
+                                ".parquet")
+            pyarrow.parquet.write_table(tables[table], path)
+        self.__batches += 1
+
+        return committed
+
+    def flush(self):
+        with self.__lock:
+            return self.__write_batch()
@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+import traceback
+
+from result_sinks import ResultSink
+
+default_batch_size = 50
+default_batch_delay = 5.0
+default_max_retries = 3
+default_retry_delay = 1.0
+default_queue_size = 1024
+
+flush_request = object()
+end_of_stream = object()
+
+
+class BundleCollector(ResultSink):
+    """
+    Keeps the results stored by a worker process in memory, so that the worker hands them to the ResultWriter of the
+    main process instead of storing them itself. A bundle is the tuple of the arguments of store_app_results.
+    """
+
+    def __init__(self):
+        self.bundles = list()
+
+    def store_app_results(self, package_name, analysis_status, components, sql_checks=None, final_status=None):
+        self.bundles.append((package_name, analysis_status, components, sql_checks, final_status))
+        return []
+
+    def take(self):
+        """
+        :return: the bundles stored since the last call
+        """
+        bundles = self.bundles
+        self.bundles = list()
+        return bundles
+
+
+class ResultWriter:
+    """
+    Stores the results of the apps in a background thread, so that the analysis does not wait on the database.
+
+    The writer has the storage methods of DatabaseInterface, which queue the results of an app and return at once. The
+    writer thread takes the results from the queue in batches, stores the apps of a batch and commits them together.
+    A batch is written once it holds batch_size apps, or batch_delay seconds after its first app arrived. The apps that
+    could not be stored or committed are written again, up to max_retries times with an exponential backoff; the apps
+    still failing after that are left out of the journal, so that they are analysed again when the sweep resumes.
+    """
+
+    def __init__(self, db, on_commit=None, batch_size=default_batch_size, batch_delay=default_batch_delay,
+                 max_retries=default_max_retries, retry_delay=default_retry_delay, queue_size=default_queue_size):
+        """
+        :param db: the DatabaseInterface the results are written to
+        :param on_commit: called by the writer thread with the package name and the final status of every committed
+                          app, e.g. Journal.record
+        :param batch_size: the maximum number of apps committed together
+        :param batch_delay: the maximum number of seconds an app waits for its batch to fill
+        :param max_retries: the number of times the failed apps of a batch are written again
+        :param retry_delay: the number of seconds before the first retry, doubled for every further one
+        :param queue_size: the maximum number of apps waiting for the writer; producers block while the queue is full
+        """
+        self.db = db
+        self.on_commit = on_commit
+        self.batch_size = max(1, batch_size)
+        self.batch_delay = batch_delay
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self.__queue = queue.Queue(maxsize=max(1, queue_size))
+        self.__thread = threading.Thread(target=self.__work, name="writer", daemon=True)
+        self.__thread.start()
+
+    def insert_app(self, package_name, analysis_status):
+        """
+        Queues an app without components, e.g. one whose download failed.
+        """
+        return self.store_app_results(package_name, analysis_status, [])
+
+    def store_app_results(self, package_name, analysis_status, components, sql_checks=None, final_status=None):
+        """
+        Queues the results of an app, see DatabaseInterface.store_app_results.
+
+        :return: an empty list, the committed apps are handed to on_commit by the writer thread
+        """
+        self.__queue.put((package_name, analysis_status, components, sql_checks, final_status))
+        return []
+
+    def get_app_analysis_status(self, package_name):
+        return self.db.get_app_analysis_status(package_name)
+
+    def flush(self):
+        """
+        Waits until the queued results are committed.
+
+        :return: an empty list, see store_app_results
+        """
+        self.__queue.put(flush_request)
+        self.__queue.join()
+        return []
+
+    def close(self):
+        """
+        Commits the queued results, stops the writer thread and closes the database interface.
+
+        :return: an empty list, see store_app_results
+        """
+        self.__queue.put(end_of_stream)
+        self.__thread.join()
+        self.__report(self.db.close())
+        return []
+
+    def __work(self):
+        batch = list()
+        deadline = None
+        taken = 0
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.__queue.get(timeout=timeout)
+                taken += 1
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple):
+                if len(batch) == 0:
+                    deadline = time.monotonic() + self.batch_delay
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+
+            self.__write_batch(batch)
+            batch = list()
+            deadline = None
+            for _ in range(taken):
+                self.__queue.task_done()
+            taken = 0
+
+            if item is end_of_stream:
+                return
+
+    def __write_batch(self, batch):
+        pending = batch
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+            committed = list()
+            for bundle in pending:
+                try:
+                    committed.extend(self.db.store_app_results(*bundle))
+                except Exception as e:
+                    print("Failed to store the results of app " + bundle[0] + " due to {}".format(e))
+            try:
+                committed.extend(self.db.flush())
+            except Exception as e:
+                print("Failed to commit the results of " + str(len(pending)) + " app(s) due to {}".format(e))
+            self.__report(committed)
+
+            committed_packages = set(package_name for package_name, _ in committed)
+            pending = [bundle for bundle in pending if bundle[0] not in committed_packages]
+            if len(pending) == 0:
+                return
+
+        print("Gave up storing the results of " + ", ".join(bundle[0] for bundle in pending) + ".")
+
+    def __report(self, committed):
+        if self.on_commit is None:
+            return
+
+        for package_name, status in committed:
+            try:
+                self.on_commit(package_name, status)
+            except Exception:
+                print("Failed to record the commit of app " + package_name + ".")
+                traceback.print_exc()
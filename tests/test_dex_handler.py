@@ -0,0 +1,89 @@
+import struct
+import unittest
+
+from cp55.dex_handler import DexFile, DexClassHandler
+
+header_size = 0x70
+
+
+def build_dex(code):
+    """
+    Builds a dex file of a single class LFoo; with a single static method run()V of the given code units.
+    """
+    strings = ["LFoo;", "V", "run"]
+
+    string_ids_offset = header_size
+    type_ids_offset = string_ids_offset + len(strings) * 4
+    proto_ids_offset = type_ids_offset + 2 * 4
+    method_ids_offset = proto_ids_offset + 12
+    class_defs_offset = method_ids_offset + 8
+    data_offset = class_defs_offset + 32
+
+    data = bytearray()
+    string_offsets = []
+    for string in strings:
+        string_offsets.append(data_offset + len(data))
+        data += bytes([len(string)]) + string.encode() + b"\x00"
+    while len(data) % 4 != 0:
+        data += b"\x00"
+
+    code_offset = data_offset + len(data)
+    data += struct.pack("<HHHHII", 1, 0, 1, 0, 0, len(code)) + struct.pack("<%dH" % len(code), *code)
+
+    # No fields, one direct method of index 0, public static, no virtual method
+    class_data_offset = data_offset + len(data)
+    data += bytes([0, 0, 1, 0, 0, 0x09]) + encode_uleb128(code_offset)
+
+    dex = bytearray(header_size)
+    struct.pack_into("<12I", dex, 0x38, len(strings), string_ids_offset, 2, type_ids_offset, 1, proto_ids_offset,
+                     0, 0, 1, method_ids_offset, 1, class_defs_offset)
+    dex += struct.pack("<%dI" % len(strings), *string_offsets)
+    dex += struct.pack("<II", 0, 1)
+    dex += struct.pack("<III", 1, 1, 0)
+    dex += struct.pack("<HHI", 0, 0, 2)
+    dex += struct.pack("<8I", 0, 0x9, 0xFFFFFFFF, 0, 0, 0, class_data_offset, 0)
+    dex += data
+    return bytes(dex)
+
+
+def encode_uleb128(value):
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value == 0:
+            encoded.append(byte)
+            return bytes(encoded)
+        encoded.append(byte | 0x80)
+
+
+class DexClassHandlerTest(unittest.TestCase):
+
+    def get_class_handler(self, code):
+        dex_file = DexFile(build_dex(code))
+        return DexClassHandler(dex_file, dex_file.class_defs["LFoo;"])
+
+    def test_invoke_custom_renders_call_site(self):
+        # invoke-custom {v0}, call_site_5 then return-void; there is no method of index 5
+        class_handler = self.get_class_handler([0x10FC, 5, 0x0000, 0x000E])
+
+        lines = class_handler.get_method("run()V")
+        self.assertIn("invoke-custom {v0}, call_site_5", lines)
+        self.assertEqual({}, class_handler.get_invoked_methods()["run"])
+
+    def test_invoke_custom_range_renders_call_site(self):
+        # invoke-custom/range {v0}, call_site_7 then return-void
+        class_handler = self.get_class_handler([0x01FD, 7, 0x0000, 0x000E])
+
+        self.assertIn("invoke-custom/range {v0}, call_site_7", class_handler.get_method("run()V"))
+
+    def test_invoke_static_resolves_method(self):
+        # invoke-static {}, LFoo;->run()V then return-void
+        class_handler = self.get_class_handler([0x0071, 0, 0x0000, 0x000E])
+
+        self.assertIn("invoke-static {}, LFoo;->run()V", class_handler.get_method("run()V"))
+        self.assertEqual({"Foo": {"run"}}, class_handler.get_invoked_methods()["run"])
+
+
+if __name__ == "__main__":
+    unittest.main()